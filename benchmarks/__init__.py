@@ -0,0 +1,5 @@
+"""benchmarks - performance benchmarks for the cMonkey hot paths
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""cluster_residuals.py - times the per-cluster residuals that write_stats
+computed on submatrix copies against datamatrix.cluster_residuals() and
+the cached ClusterResiduals after a few clusters changed
+
+usage: PYTHONPATH=. python3 benchmarks/cluster_residuals.py [--rows 5000] [--cols 300]
+           [--clusters 300]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+
+import numpy as np
+import cmonkey.datamatrix as dm
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+def legacy_residuals(membership, ratios, num_clusters):
+    """the residuals of the cluster submatrices"""
+    result = []
+    for cluster in range(1, num_clusters + 1):
+        row_names = membership.rows_for_cluster(cluster)
+        column_names = membership.columns_for_cluster(cluster)
+        result.append(ratios.submatrix_by_name(row_names, column_names).residual())
+    return np.array(result)
+
+
+def cached_residuals(cache, rows, cols, changed):
+    """the cached residuals after the row memberships of the changed
+    clusters were modified"""
+    rows[0, changed] = ~rows[0, changed]
+    return cache.residuals(rows, cols)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='cluster residual benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=300)
+    parser.add_argument('--changed', type=int, default=10,
+                        help='clusters that change between two cached computations')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    membership = synthetic.make_membership(ratios, config_params)
+    rows = np.array(membership.row_indicator(dense=True))
+    cols = np.array(membership.col_indicator(dense=True))
+
+    reference = legacy_residuals(membership, ratios, args.clusters)
+    batched = dm.cluster_residuals(ratios, rows, cols)
+    cache = dm.ClusterResiduals(ratios)
+    cache.residuals(rows, cols)
+    changed = np.arange(args.changed)
+
+    print('%d genes x %d conditions, %d clusters, max diff %.2e' %
+          (args.rows, args.cols, args.clusters, np.max(np.abs(reference - batched))))
+    for name, fun in [('submatrix', lambda: legacy_residuals(membership, ratios, args.clusters)),
+                      ('batched', lambda: dm.cluster_residuals(ratios, rows, cols)),
+                      ('cached', lambda: cached_residuals(cache, rows, cols, changed))]:
+        print('%-12s %10.2f ms' % (name, timed(fun, args.repeat) * 1000))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""cluster_stats.py - times the member score aggregates of an iteration on
+the cluster_stats kernel against the previous per-cluster loops of
+ScoringFunctionCombiner.log_subresult(), which runs for every row scoring
+function with the default log_subresults = True, and
+motif.compute_mean_score()
+
+usage: PYTHONPATH=. python3 benchmarks/cluster_stats.py [--rows 5000] [--clusters 600]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import math
+
+import numpy as np
+import cmonkey.cluster_stats as cluster_stats
+import cmonkey.membership as memb
+from benchmarks import synthetic
+from benchmarks.combine import make_scores
+from benchmarks.row_scoring import timed
+
+
+def legacy_trim_mean(values, trim):
+    """the previous util.trim_mean()"""
+    if not values or len(values) == 0:
+        return 0
+    values = sorted(values, reverse=True)
+    if trim == 0.5:
+        return np.median(values)
+    k_floor = int(math.floor(trim * len(values)))
+    trim_values_floor = values[k_floor:len(values) - k_floor]
+    return np.mean(np.ma.masked_array(trim_values_floor, np.isnan(trim_values_floor)))
+
+
+def legacy_log_subresult(membership, matrix):
+    """the trim mean that the previous log_subresult() logged"""
+    scores = []
+    mvalues = matrix.values
+    for cluster in range(1, matrix.num_columns + 1):
+        cluster_rows = membership.rows_for_cluster(cluster)
+        for row in range(matrix.num_rows):
+            if matrix.row_names[row] in cluster_rows:
+                scores.append(mvalues[row][cluster - 1])
+    return legacy_trim_mean(scores, 0.05)
+
+
+def legacy_mean_score(matrix, membership):
+    """the previous motif.compute_mean_score()"""
+    values = []
+    for cluster in range(1, membership.num_clusters() + 1):
+        row_indexes = matrix.row_indexes_for(membership.rows_for_cluster(cluster))
+        values.extend(matrix.values[row_indexes, cluster - 1])
+    return np.mean(values)
+
+
+def log_subresult(membership, matrix):
+    """the trim mean that log_subresult() logs"""
+    return cluster_stats.trim_mean(cluster_stats.member_values(
+        matrix.values, memb.aligned_row_indicator(membership, matrix.row_names)), 0.05)
+
+
+def mean_score(matrix, membership):
+    """motif.compute_mean_score()"""
+    return np.mean(cluster_stats.member_values(
+        matrix.values, memb.aligned_row_indicator(membership, matrix.row_names)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='cluster statistics benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=600)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    membership = synthetic.make_membership(ratios, config_params)
+    scores = make_scores(ratios, args.clusters, False, 0)
+    print('%d genes, %d clusters' % (args.rows, args.clusters))
+    for name, legacy, kernel in [
+            ('log_subresult', lambda: legacy_log_subresult(membership, scores),
+             lambda: log_subresult(membership, scores)),
+            ('mean_score', lambda: legacy_mean_score(scores, membership),
+             lambda: mean_score(scores, membership))]:
+        legacy_time = timed(legacy, args.repeat)
+        kernel_time = timed(kernel, args.repeat)
+        print('%-14s legacy %10.2f ms  kernel %8.2f ms  speedup %8.1f  diff %.2e' %
+              (name, legacy_time * 1000, kernel_time * 1000, legacy_time / kernel_time,
+               abs(legacy() - kernel())))
+
+    def all_stats():
+        stats = cluster_stats.ClusterStats(
+            scores.values, memb.aligned_row_indicator(membership, scores.row_names))
+        return stats.means(), stats.medians(), stats.trim_means(0.05)
+    elapsed = timed(all_stats, args.repeat)
+    print('%-14s %10.2f ms for the means, medians and trim means of all clusters' %
+          ('ClusterStats', elapsed * 1000))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""column_scoring.py - compares the per-cluster column scoring against the
+batched version in scoring.compute_column_scores_batched()
+
+usage: PYTHONPATH=. python3 benchmarks/column_scoring.py [--rows 5000] [--cols 300]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+
+import numpy as np
+import cmonkey.scoring as scoring
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='column scoring benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, nargs='*', default=[300, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--multiprocessing', action='store_true',
+                        help='run the reference implementation on a process pool')
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    print('%-10s %14s %14s %10s %12s' % ('clusters', 'per-cluster', 'batched',
+                                         'speedup', 'max diff'))
+    for num_clusters in args.clusters:
+        config_params = synthetic.make_config(num_clusters, args.rows, args.cols)
+        config_params['multiprocessing'] = args.multiprocessing
+        membership = synthetic.make_membership(ratios, config_params)
+
+        ref = scoring.compute_column_scores_reference(membership, ratios, num_clusters,
+                                                      config_params).values
+        batched = scoring.compute_column_scores(membership, ratios, num_clusters,
+                                                config_params).values
+        maxdiff = np.max(np.abs(ref - batched))
+
+        t_ref = timed(lambda: scoring.compute_column_scores_reference(
+            membership, ratios, num_clusters, config_params), args.repeat)
+        t_batched = timed(lambda: scoring.compute_column_scores(
+            membership, ratios, num_clusters, config_params), args.repeat)
+        print('%-10d %12.3f s %12.3f s %9.1fx %12.2e' % (num_clusters, t_ref, t_batched,
+                                                         t_ref / t_batched, maxdiff))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""combine.py - times scoring.combine() against the previous version, which
+collected the cluster member scores per cluster, sorted the values of
+sparse score matrices and allocated each weighted matrix separately
+
+usage: PYTHONPATH=. python3 benchmarks/combine.py [--rows 5000] [--clusters 600]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+
+import numpy as np
+import cmonkey.datamatrix as dm
+import cmonkey.scoring as scoring
+import cmonkey.stats as stats
+import cmonkey.util as util
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+def legacy_combine(result_matrices, score_scalings, membership):
+    """the MAD scaled combination of the previous combine()"""
+    for m in result_matrices:
+        m.fix_extreme_values()
+        m.subtract_with_quantile(0.99)
+    mat = result_matrices[0]
+    index_map = {name: index for index, name in enumerate(mat.row_names)}
+    rsm = []
+    for cluster in range(1, membership.num_clusters() + 1):
+        row_members = sorted(membership.rows_for_cluster(cluster))
+        rsm.extend([mat.values[index_map[row], cluster - 1] for row in row_members])
+    scale = stats.mad(rsm)
+    rscores = dm.DataMatrix(mat.num_rows, mat.num_columns, mat.row_names, mat.column_names,
+                            values=(mat.values - util.median(rsm)) / scale)
+    rscores.fix_extreme_values()
+    in_matrices = [rscores.values]
+    rs_quant = util.quantile(rscores.values, 0.01)
+    for m in result_matrices[1:]:
+        qqq = abs(util.quantile(m.values, 0.01))
+        if qqq == 0:
+            qqq = sorted(m.values.ravel())[9]
+        in_matrices.append(m.values / qqq * abs(rs_quant))
+    combined_score = np.zeros(in_matrices[0].shape)
+    for values, scaling in zip(in_matrices, score_scalings):
+        combined_score += values * scaling
+    return dm.DataMatrix(mat.num_rows, mat.num_columns, mat.row_names, mat.column_names,
+                         values=combined_score)
+
+
+def make_scores(ratios, num_clusters, sparse, seed):
+    """score matrix genes x clusters, sparse ones have mostly zeros"""
+    rng = np.random.RandomState(seed)
+    values = rng.normal(size=(ratios.num_rows, num_clusters))
+    if sparse:
+        values[rng.uniform(size=values.shape) < 0.995] = 0.0
+    return dm.DataMatrix(ratios.num_rows, num_clusters, ratios.row_names,
+                         ['%d' % cluster for cluster in range(1, num_clusters + 1)],
+                         values=values)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='combiner benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=600)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    config_params.update({'quantile_normalize': False, 'debug': {}})
+    membership = synthetic.make_membership(ratios, config_params)
+    inputs = [make_scores(ratios, args.clusters, sparse, seed)
+              for seed, sparse in enumerate([False, True, False])]
+    scalings = [6.0, 0.5, 0.25]
+
+    def copies():
+        return [dm.DataMatrix.from_array(m.values.copy(), m.row_names, m.column_names)
+                for m in inputs]
+
+    reference = legacy_combine(copies(), scalings, membership)
+    combined = scoring.combine(copies(), scalings, membership, 1, config_params)
+    print('%d genes, %d clusters, max diff %.2e' %
+          (args.rows, args.clusters, np.max(np.abs(reference.values - combined.values))))
+
+    buffer = combined.values
+    for name, fun in [('legacy', lambda: legacy_combine(copies(), scalings, membership)),
+                      ('combine', lambda: scoring.combine(copies(), scalings, membership, 1,
+                                                          config_params)),
+                      ('reused', lambda: scoring.combine(copies(), scalings, membership, 1,
+                                                         config_params, out=buffer))]:
+        print('%-10s %10.2f ms' % (name, timed(fun, args.repeat) * 1000))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""compensate_size.py - times membership.compensate_size() against the
+per-cluster size compensation it replaced
+
+usage: PYTHONPATH=. python3 benchmarks/compensate_size.py [--rows 5000] [--cols 300]
+           [--clusters 1000]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import math
+
+import cmonkey.membership as memb
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+from benchmarks.membership_update import make_scores
+
+
+def legacy_compensate_size(membership, matrix, rd_scores, cd_scores):
+    """the per-cluster size compensation"""
+    num_clusters = membership.num_clusters()
+    row_scale = matrix.num_rows * membership.num_clusters_per_row() / float(num_clusters)
+    col_scale = matrix.num_columns * membership.num_clusters_per_column() / float(num_clusters)
+    for cluster in range(1, num_clusters + 1):
+        row_size = max(membership.num_row_members(cluster),
+                       membership.min_cluster_rows_allowed())
+        col_size = max(membership.num_column_members(cluster), matrix.num_columns / 10.0)
+        rd_scores.multiply_column_by(cluster - 1, math.exp(-float(row_size) / row_scale))
+        cd_scores.multiply_column_by(cluster - 1, math.exp(-float(col_size) / col_scale))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='size compensation benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    membership = synthetic.make_membership(ratios, config_params)
+    rd_scores = make_scores(ratios.row_names, args.clusters)
+    cd_scores = make_scores(ratios.column_names, args.clusters)
+
+    print('%d genes x %d conditions, %d clusters' % (args.rows, args.cols, args.clusters))
+    for name, compensate in [('per-cluster', legacy_compensate_size),
+                             ('bincount', memb.compensate_size)]:
+        elapsed = timed(lambda: compensate(membership, ratios, rd_scores, cd_scores),
+                        args.repeat)
+        print('%-12s %8.2f ms' % (name, elapsed * 1000))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""fuzzify.py - times membership.fuzzify() against the member value
+collection of the previous per-cluster loops
+
+The previous version passed the collected values to R's sd() and rnorm()
+through stats.sd_rnorm(). That call is not part of the legacy timing, so
+the legacy numbers are a lower bound.
+
+usage: PYTHONPATH=. python3 benchmarks/fuzzify.py [--rows 2000] [--cols 300]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+
+import cmonkey.membership as memb
+import cmonkey.datamatrix as dm
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+def legacy_member_values(membership, scores, clusters_for):
+    """the member value collection of the previous fuzzify()"""
+    values = scores.values
+    row_names = scores.row_names
+    result = []
+    for col in range(scores.num_columns):
+        members = clusters_for(col + 1)
+        for row in range(scores.num_rows):
+            if row_names[row] in members:
+                result.append(values[row, col])
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fuzzify benchmark')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    config_params['random_seed'] = 42
+    membership = synthetic.make_membership(ratios, config_params)
+    row_scores = dm.DataMatrix(args.rows, args.clusters, ratios.row_names,
+                               values=synthetic.make_ratios(args.rows, args.clusters).values)
+    col_scores = dm.DataMatrix(args.cols, args.clusters, ratios.column_names,
+                               values=synthetic.make_ratios(args.cols, args.clusters).values)
+
+    t_legacy = timed(lambda: (legacy_member_values(membership, row_scores,
+                                                   membership.rows_for_cluster),
+                              legacy_member_values(membership, col_scores,
+                                                   membership.columns_for_cluster)),
+                     args.repeat)
+    t_new = timed(lambda: memb.fuzzify(membership, row_scores, col_scores, 2000,
+                                       {'iteration': 1}, 'both'), args.repeat)
+    print('%d genes x %d conditions, %d clusters, rows and columns fuzzed' %
+          (args.rows, args.cols, args.clusters))
+    print('legacy member collection (without R): %8.3f s' % t_legacy)
+    print('fuzzify():                            %8.3f s' % t_new)
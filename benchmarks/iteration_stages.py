@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""iteration_stages.py - times the stages of CMonkeyRun.run_iteration()
+on the bundled halobacterium example data
+
+The run is set up like bin/cmonkey2 does it, with a fixed random seed.
+MEME and MAST are replaced by a stub that returns seeded p-values for the
+cluster sequences, so the motif code path runs without the MEME suite.
+The run works offline: the organism is read from an RSAT directory that
+is made from the halo features, feature names, STRING links and operons
+in testdata/. The genome is not bundled, so the contigs are seeded random
+sequences of the lengths in the feature file, which is all the stubbed
+motif stage needs. --rsat_dir uses an RSAT directory with the real
+genome instead.
+
+Every stage is timed in every iteration and the report contains the mean
+and the 95th percentile in milliseconds. If a baseline report exists, the
+stages are compared against it and the exit status is 1 if a stage's
+mean is slower than the baseline by more than the tolerance.
+
+usage: PYTHONPATH=. python3 benchmarks/iteration_stages.py [--iterations 20]
+           [--report stages.json] [--baseline benchmarks/iteration_stages_baseline.json]
+           [--save_baseline] [--rsat_dir DIR]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import cmonkey.cmonkey_run as cmr
+import cmonkey.config as conf
+import cmonkey.meme_suite as meme
+import cmonkey.membership as memb
+import cmonkey.network as nw
+import cmonkey.motif as motif
+
+HALO_RATIOS = 'example_data/hal/halo_ratios5.tsv'
+HALO_RSAT_ORGANISM = 'Halobacterium_sp'
+HALO_FEATURES = 'testdata/Halobacterium_sp_features'
+HALO_FEATURE_NAMES = 'testdata/Halobacterium_sp_feature_names'
+HALO_STRING = 'testdata/string_links_64091.tab'
+HALO_OPERONS = 'testdata/gnc64091_ref.named'
+DEFAULT_BASELINE = 'benchmarks/iteration_stages_baseline.json'
+STAGES = ['row_scoring', 'motif_scoring', 'network_scoring', 'column_scoring',
+          'membership_update', 'write_results', 'write_stats']
+
+
+def stub_meme_suite():
+    """replaces the MEME and MAST invocations with a seeded stub"""
+    def run_meme_and_mast(self, params):
+        random = np.random.RandomState(params.cluster)
+        feature_ids = sorted(params.seqs.keys())
+        pvalues = random.uniform(1e-6, 1.0, len(feature_ids))
+        pe_values = [(feature_id, pvalue, pvalue * len(feature_ids))
+                     for feature_id, pvalue in zip(feature_ids, pvalues)]
+        return meme.MemeRunResult(pe_values, {}, [])
+
+    meme.check_meme_version = lambda cache_dir=None: '4.12.0'
+    meme.MemeSuite.__call__ = run_meme_and_mast
+    meme.MemeSuite.remove_low_complexity = remove_low_complexity
+
+
+def remove_low_complexity(self, seqs):
+    """MemeSuite.remove_low_complexity() without the dust filter: the
+    sequences that are longer than the motif width, as strings"""
+    result = {}
+    for feature_id, seq in seqs.items():
+        if not isinstance(seq, str):
+            seq = seq[1]
+        if len(seq) > self.max_width:
+            result[feature_id] = seq
+    return result
+
+
+def make_rsat_dir(dirname, seed):
+    """writes the RSAT files of the halo organism into dirname, in the
+    layout that rsat.RsatFiles reads. The contig sequences are drawn with
+    the seed, their lengths are the positions of the SEQ_END features"""
+    shutil.copyfile(HALO_FEATURES, os.path.join(dirname, 'feature.tab'))
+    shutil.copyfile(HALO_FEATURE_NAMES, os.path.join(dirname, 'feature_names.tab'))
+    contig_lengths = {}
+    with open(HALO_FEATURES) as infile:
+        for line in infile:
+            row = line.split('\t')
+            if not line.startswith('--') and row[1] == 'SEQ_END':
+                contig_lengths[row[3]] = int(row[5])
+    random = np.random.RandomState(seed)
+    for contig, length in sorted(contig_lengths.items()):
+        with open(os.path.join(dirname, contig + '.tab'), 'w') as outfile:
+            outfile.write(''.join(random.choice(list('ACGT'), length)))
+
+
+class StageTimer:
+    """collects the wall clock times of the stages in milliseconds"""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    def wrap(self, stage, fun):
+        """returns fun with the time of each call recorded under stage"""
+        def timed_fun(*args, **kwargs):
+            start = time.time()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                self.samples[stage].append((time.time() - start) * 1000.0)
+        return timed_fun
+
+    def report(self):
+        result = {}
+        for stage, samples in self.samples.items():
+            if len(samples) > 0:
+                result[stage] = {'mean_ms': float(np.mean(samples)),
+                                 'p95_ms': float(np.percentile(samples, 95)),
+                                 'count': len(samples)}
+        return result
+
+
+def make_run(args, outdir, rsat_dir):
+    """sets up a CMonkeyRun on the example data through the regular
+    command line configuration"""
+    sys.argv = ['cmonkey2', '--organism', 'hal', '--out', outdir,
+                '--random_seed', str(args.seed),
+                '--num_iterations', str(args.iterations),
+                '--rsat_dir', rsat_dir, '--rsat_organism', HALO_RSAT_ORGANISM,
+                '--string', HALO_STRING, '--operons', HALO_OPERONS, HALO_RATIOS]
+    if args.cachedir is not None:
+        sys.argv.extend(['--cachedir', args.cachedir])
+    if args.num_cores is not None:
+        sys.argv.extend(['--num_cores', str(args.num_cores)])
+    _, params, ratios = conf.setup()
+    # results and statistics are written in every iteration, so
+    # every iteration contributes a sample
+    params['result_freq'] = 1
+    params['stats_freq'] = 1
+    run = cmr.CMonkeyRun(ratios, params)
+    run.prepare_run()
+    return run
+
+
+def instrument(run, timer):
+    """wraps the stages of run_iteration() with the timer"""
+    run.row_scoring.compute = timer.wrap('row_scoring', run.row_scoring.compute)
+    run.column_scoring.compute = timer.wrap('column_scoring', run.column_scoring.compute)
+    for scoring_function in run.row_scoring.scoring_functions:
+        if isinstance(scoring_function, nw.ScoringFunction):
+            scoring_function.compute = timer.wrap('network_scoring', scoring_function.compute)
+        elif isinstance(scoring_function, motif.MotifScoringFunctionBase):
+            scoring_function.compute = timer.wrap('motif_scoring', scoring_function.compute)
+    # the membership is broadcast to the workers, so it must not hold the
+    # wrapper itself
+    memb.OrigMembership.update = timer.wrap('membership_update', memb.OrigMembership.update)
+    run.write_results = timer.wrap('write_results', run.write_results)
+    run.write_stats = timer.wrap('write_stats', run.write_stats)
+
+
+def compare(report, baseline, tolerance):
+    """prints the stages against the baseline, returns the regressed stages"""
+    regressions = []
+    print('%-18s %12s %12s %12s %9s' % ('stage', 'mean ms', 'p95 ms', 'base mean', 'ratio'))
+    for stage in STAGES:
+        if stage not in report:
+            continue
+        line = '%-18s %12.1f %12.1f' % (stage, report[stage]['mean_ms'], report[stage]['p95_ms'])
+        if baseline is not None and stage in baseline:
+            ratio = report[stage]['mean_ms'] / max(baseline[stage]['mean_ms'], 1e-6)
+            line += ' %12.1f %9.2f' % (baseline[stage]['mean_ms'], ratio)
+            if ratio > 1.0 + tolerance:
+                line += '  REGRESSION'
+                regressions.append(stage)
+        print(line)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='per-stage iteration benchmark')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--num_cores', type=int, default=None)
+    parser.add_argument('--cachedir', default=None)
+    parser.add_argument('--rsat_dir', default=None,
+                        help='RSAT directory of the organism, by default made from testdata')
+    parser.add_argument('--report', default='iteration_stages.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown of a stage mean')
+    parser.add_argument('--save_baseline', action='store_true',
+                        help='store this report as the new baseline')
+    args = parser.parse_args()
+
+    stub_meme_suite()
+    timer = StageTimer()
+    outdir = tempfile.mkdtemp(prefix='cmonkey-stages-')
+    rsat_dir = args.rsat_dir
+    if rsat_dir is None:
+        # the run clears its output directory, so the files go elsewhere
+        rsat_dir = tempfile.mkdtemp(prefix='cmonkey-stages-rsat-')
+        make_rsat_dir(rsat_dir, args.seed)
+    run = make_run(args, outdir, rsat_dir)
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        instrument(run, timer)
+        run.pool()
+        for iteration in range(1, args.iterations + 1):
+            run.run_iteration(iteration)
+    finally:
+        run.cleanup()
+        if args.rsat_dir is None:
+            shutil.rmtree(rsat_dir)
+
+    report = {'iterations': args.iterations, 'seed': args.seed,
+              'stages': timer.report()}
+    with open(args.report, 'w') as outfile:
+        json.dump(report, outfile, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)['stages']
+    regressions = compare(report['stages'], baseline, args.tolerance)
+    if len(regressions) > 0:
+        print('regressions in: %s' % ', '.join(regressions))
+        sys.exit(1)
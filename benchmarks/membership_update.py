@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""membership_update.py - times the row and column membership updates
+against their row-by-row reference implementations
+
+usage: PYTHONPATH=. python3 benchmarks/membership_update.py [--rows 5000] [--cols 1000]
+           [--clusters 300]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+
+import numpy as np
+import cmonkey.datamatrix as dm
+import cmonkey.membership as memb
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+def make_scores(names, num_clusters, seed=43):
+    """random density scores of names for all clusters"""
+    rng = np.random.RandomState(seed)
+    return dm.DataMatrix(len(names), num_clusters, names,
+                         [str(cluster) for cluster in range(1, num_clusters + 1)],
+                         values=rng.uniform(size=(len(names), num_clusters)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='membership update benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=1000)
+    parser.add_argument('--clusters', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    config_params['random_seed'] = 42
+    rd_scores = make_scores(ratios.row_names, args.clusters)
+    cd_scores = make_scores(ratios.column_names, args.clusters)
+
+    print('%d genes x %d slots, %d conditions x %d slots, %d clusters' %
+          (args.rows, config_params['memb.clusters_per_row'], args.cols,
+           config_params['memb.clusters_per_col'], args.clusters))
+    for name, update, scores in [
+            ('reference', memb.update_for_rows_reference, rd_scores),
+            ('vectorized', memb.update_for_rows, rd_scores),
+            ('reference', memb.update_for_cols_reference, cd_scores),
+            ('vectorized', memb.update_for_cols, cd_scores)]:
+        membership = synthetic.make_membership(ratios, config_params)
+        elapsed = timed(lambda: update(membership, scores, False), args.repeat)
+        print('%-16s %-11s %8.2f ms' % (update.__name__.replace('_reference', ''),
+                                         name, elapsed * 1000))
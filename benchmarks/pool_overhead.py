@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""pool_overhead.py - per-iteration cost of the process pool: a pool
+forked for every map() call that inherits its input from module globals,
+against the run's persistent util.WorkerPool that receives the membership
+through broadcast()
+
+Each simulated iteration performs --maps pool maps over all clusters with
+a cheap per-cluster task, so the timing is dominated by the pool overhead.
+
+usage: PYTHONPATH=. python3 benchmarks/pool_overhead.py [--rows 5000] [--cols 300]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import multiprocessing as mp
+
+import cmonkey.util as util
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+MATRIX = None
+MEMBERSHIP = None
+
+
+def legacy_task(cluster):
+    """per-cluster task that reads its input from the module globals"""
+    rows = MATRIX.row_indexes_for(MEMBERSHIP.rows_for_cluster(cluster))
+    return MATRIX.values[rows].sum()
+
+
+def task(cluster):
+    """per-cluster task that reads its input from the worker state"""
+    state = util.worker_state()
+    matrix = state['ratios']
+    rows = matrix.row_indexes_for(state['membership'].rows_for_cluster(cluster))
+    return matrix.values[rows].sum()
+
+
+def legacy_iteration(matrix, membership, num_clusters, num_cores, num_maps):
+    global MATRIX, MEMBERSHIP
+    for _ in range(num_maps):
+        MATRIX = matrix
+        MEMBERSHIP = membership
+        pool = mp.Pool(num_cores)
+        pool.map(legacy_task, range(1, num_clusters + 1))
+        pool.close()
+        pool.join()
+        MATRIX = None
+        MEMBERSHIP = None
+
+
+def pooled_iteration(membership, num_clusters, num_maps):
+    for _ in range(num_maps):
+        util.pool_map({'multiprocessing': True}, task, range(1, num_clusters + 1),
+                      state={'membership': membership})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pool overhead benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=300)
+    parser.add_argument('--cores', type=int, default=4)
+    parser.add_argument('--maps', type=int, default=4,
+                        help='number of pool maps per iteration')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    membership = synthetic.make_membership(ratios, config_params)
+
+    t_legacy = timed(lambda: legacy_iteration(ratios, membership, args.clusters,
+                                              args.cores, args.maps), args.repeat)
+    pool = util.WorkerPool(args.cores, state={'ratios': ratios})
+    util.set_run_pool(pool)
+    try:
+        t_pooled = timed(lambda: pooled_iteration(membership, args.clusters, args.maps),
+                         args.repeat)
+    finally:
+        util.set_run_pool(None)
+        pool.close()
+
+    print('%d genes x %d conditions, %d clusters, %d cores, %d maps per iteration' %
+          (args.rows, args.cols, args.clusters, args.cores, args.maps))
+    print('pool forked per map:  %8.1f ms/iteration' % (t_legacy * 1000))
+    print('persistent run pool:  %8.1f ms/iteration' % (t_pooled * 1000))
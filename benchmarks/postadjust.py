@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""postadjust.py - times membership.postadjust() against the cluster
+adjustment it replaced, which searched the best remaining row once per
+added row and ran serially
+
+usage: PYTHONPATH=. python3 benchmarks/postadjust.py [--rows 5000] [--clusters 1000]
+           [--cores 4]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import copy
+import sys
+
+import numpy as np
+import cmonkey.datamatrix as dm
+import cmonkey.membership as memb
+import cmonkey.util as util
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+def legacy_adjust_cluster(membership, cluster, rowscores, cutoff, limit):
+    """the cluster adjustment that searches the best row for every addition"""
+    def max_row_in_column(matrix, column):
+        sm = matrix.submatrix_by_name(wh, [matrix.column_names[column]])
+        sm_values = sm.values
+        max_row = 0
+        max_score = -sys.float_info.max
+        for row in range(sm.num_rows):
+            if sm_values[row][0] > max_score:
+                max_score = sm_values[row, 0]
+                max_row = row
+        return sm.row_names[max_row]
+
+    old_rows = membership.rows_for_cluster(cluster)
+    not_in = [(i, row) for i, row in enumerate(rowscores.row_names)
+              if row not in old_rows]
+    threshold = rowscores.submatrix_by_name(old_rows,
+                                            [rowscores.column_names[cluster - 1]]).quantile(cutoff)
+    wh = []
+    rs_values = rowscores.values
+    for row, row_name in not_in:
+        if rs_values[row, cluster - 1] < threshold:
+            wh.append(row_name)
+    if len(wh) == 0 or len(wh) > limit:
+        return {}
+
+    tries = 0
+    result = {}
+    while len(wh) > 0 and tries < memb.MAX_ADJUST_TRIES:
+        wh2 = max_row_in_column(rowscores, cluster - 1)
+        result[wh2] = cluster
+        wh.remove(wh2)
+        tries += 1
+    return result
+
+
+def legacy_postadjust(membership, rowscores, cutoff=0.33, limit=100):
+    assign_list = [legacy_adjust_cluster(membership, cluster, rowscores, cutoff, limit)
+                   for cluster in range(1, membership.num_clusters() + 1)]
+    for assign in assign_list:
+        for row, cluster in assign.items():
+            membership.add_cluster_to_row(row, cluster, force=True)
+
+
+def make_rowscores(ratios, num_clusters, seed=44):
+    """row scores with a few ties, as the density scores have"""
+    rng = np.random.RandomState(seed)
+    return dm.DataMatrix(ratios.num_rows, num_clusters, ratios.row_names,
+                         [str(cluster) for cluster in range(1, num_clusters + 1)],
+                         values=np.round(rng.normal(size=(ratios.num_rows, num_clusters)), 3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='postadjust benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=50)
+    parser.add_argument('--clusters', type=int, default=1000)
+    parser.add_argument('--cores', type=int, default=4)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    rowscores = make_rowscores(ratios, args.clusters)
+    membership = synthetic.make_membership(ratios, config_params)
+
+    legacy = copy.deepcopy(membership)
+    t_legacy = timed(lambda: legacy_postadjust(legacy, rowscores, limit=args.limit), 1)
+    serial = copy.deepcopy(membership)
+    t_serial = timed(lambda: memb.postadjust(serial, rowscores, limit=args.limit), 1)
+    if serial.row_membs.tolist() != legacy.row_membs.tolist():
+        raise Exception('postadjust() and the legacy version disagree')
+
+    pool_params = dict(config_params, multiprocessing=True, num_cores=args.cores)
+    pool = util.WorkerPool(args.cores)
+    util.set_run_pool(pool)
+    t_pooled = {}
+    try:
+        for shared in [False, True]:
+            pooled = copy.deepcopy(membership)
+            scores = copy.deepcopy(rowscores)
+            if shared:
+                scores.share_values()
+            t_pooled[shared] = timed(lambda: memb.postadjust(pooled, scores, limit=args.limit,
+                                                             config_params=pool_params), 1)
+            if pooled.row_membs.tolist() != legacy.row_membs.tolist():
+                raise Exception('pooled postadjust() and the legacy version disagree')
+    finally:
+        util.set_run_pool(None)
+        pool.close()
+        util.release_shared()
+
+    print('%d genes, %d clusters, limit %d' % (args.rows, args.clusters, args.limit))
+    print('legacy, serial:                 %10.1f ms' % (t_legacy * 1000))
+    print('single pass, serial:            %10.1f ms' % (t_serial * 1000))
+    print('single pass, %d cores:           %10.1f ms' % (args.cores, t_pooled[False] * 1000))
+    print('single pass, %d cores, shared:   %10.1f ms' % (args.cores, t_pooled[True] * 1000))
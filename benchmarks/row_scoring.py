@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""row_scoring.py - compares the per-cluster row scoring against the
+batched kernel in microarray.compute_row_scores_batched() and the
+incremental update of microarray.RowScoreStatistics after a membership
+update that changes --changed_rows of the rows and 5 columns
+
+usage: PYTHONPATH=. python3 benchmarks/row_scoring.py [--rows 5000] [--cols 300]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import time
+
+import numpy as np
+import cmonkey.microarray as ma
+from benchmarks import synthetic
+
+
+def change_membership(membership, num_clusters, changed_rows, rng):
+    """changes one cluster slot of the given fraction of the rows and of 5
+    columns, like an iteration's membership update does"""
+    row_names = membership.row_names
+    for index in rng.choice(len(row_names), int(len(row_names) * changed_rows), replace=False):
+        membership.replace_row_cluster(row_names[index], rng.randint(0, 2),
+                                       rng.randint(1, num_clusters + 1))
+    col_names = membership.col_names
+    for index in rng.choice(len(col_names), 5, replace=False):
+        membership.replace_column_cluster(col_names[index], 0, rng.randint(1, num_clusters + 1))
+
+
+def timed_update(statistics, membership, num_clusters, changed_rows, repeat):
+    """returns the best time of the statistics update and the scores after
+    repeat membership changes"""
+    rng = np.random.RandomState(17)
+    best = None
+    for _ in range(repeat):
+        change_membership(membership, num_clusters, changed_rows, rng)
+        start = time.time()
+        statistics.update(membership)
+        statistics.row_scores()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def timed(fun, repeat):
+    """returns the best wall clock time of repeat calls to fun"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fun()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='row scoring benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, nargs='*', default=[300, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--changed_rows', type=float, default=0.05)
+    parser.add_argument('--multiprocessing', action='store_true',
+                        help='run the reference implementation on a process pool')
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    print('%-10s %14s %14s %14s %10s %12s' % ('clusters', 'per-cluster', 'batched',
+                                              'incremental', 'speedup', 'max diff'))
+    for num_clusters in args.clusters:
+        config_params = synthetic.make_config(num_clusters, args.rows, args.cols)
+        config_params['multiprocessing'] = args.multiprocessing
+        membership = synthetic.make_membership(ratios, config_params)
+
+        ref = ma.compute_row_scores_reference(membership, ratios, num_clusters,
+                                              config_params).values
+        batched = ma.compute_row_scores_batched(membership, ratios, num_clusters)
+        finite = np.isfinite(ref)
+        maxdiff = np.max(np.abs(ref[finite] - batched[finite]))
+
+        t_ref = timed(lambda: ma.compute_row_scores_reference(membership, ratios, num_clusters,
+                                                              config_params), args.repeat)
+        t_batched = timed(lambda: ma.compute_row_scores_batched(membership, ratios,
+                                                                num_clusters), args.repeat)
+        statistics = ma.RowScoreStatistics(ratios, num_clusters)
+        statistics.recompute(membership)
+        t_update = timed_update(statistics, membership, num_clusters, args.changed_rows,
+                                args.repeat)
+        print('%-10d %12.3f s %12.3f s %12.3f s %9.1fx %12.2e' %
+              (num_clusters, t_ref, t_batched, t_update, t_ref / t_batched, maxdiff))
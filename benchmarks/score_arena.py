@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""score_arena.py - peak RSS and time per iteration of the scoring with and
+without the score arena of the run
+
+Every variant runs in its own process, so the peak RSS is its own:
+
+  legacy    new result matrices, gc.collect() before every scoring function
+            and after every iteration like the previous versions
+  no-arena  new result matrices (use_score_arena = False)
+  arena     the result matrices are taken from a ScoreArena
+
+An iteration computes the combined row scores of the row scoring and two
+sparse scoring functions that stand in for the network and motif scores,
+the column scores and changes the membership like benchmarks/row_scoring.py
+
+usage: PYTHONPATH=. python3 benchmarks/score_arena.py [--rows 5000] [--cols 300]
+           [--clusters 600] [--iterations 20]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import gc
+import json
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+import numpy as np
+import cmonkey.datamatrix as dm
+import cmonkey.microarray as ma
+import cmonkey.scoring as scoring
+from benchmarks import synthetic
+from benchmarks.row_scoring import change_membership
+
+VARIANTS = ['legacy', 'no-arena', 'arena']
+
+
+class NullSession:
+    """discards the run logs"""
+    def add(self, entry):
+        pass
+
+
+class BenchmarkRun:
+    """the parts of a CMonkeyRun that the scoring functions use"""
+    def __init__(self, ratios, membership, config_params, arena):
+        self.ratios = ratios
+        self.config_params = config_params
+        self.__membership = membership
+        self.__arena = arena
+        self.__session = NullSession()
+
+    def organism(self):
+        return None
+
+    def membership(self):
+        return self.__membership
+
+    def dbsession(self):
+        return self.__session
+
+    def score_arena(self):
+        return self.__arena
+
+
+class SparseScoringFunction(scoring.ScoringFunctionBase):
+    """scores a random 1% of the genes of every cluster, like the network
+    and motif scores that are 0 for most genes"""
+    def __init__(self, function_id, cmrun):
+        scoring.ScoringFunctionBase.__init__(self, function_id, cmrun)
+        self.run_log = scoring.RunLog(function_id, cmrun.dbsession(), self.config_params)
+        self.rng = np.random.RandomState(len(function_id))
+
+    def do_compute(self, iteration_result, ref_matrix=None):
+        matrix = self.result_matrix()
+        num_scored = max(1, matrix.num_rows // 100)
+        for cluster in range(self.num_clusters()):
+            rows = self.rng.choice(matrix.num_rows, num_scored, replace=False)
+            matrix.values[rows, cluster] = -self.rng.exponential(size=num_scored)
+        return matrix
+
+
+def collect_before(scoring_function):
+    """the previous combiner's gc.collect() before each scoring function"""
+    compute = scoring_function.compute
+
+    def collected_compute(*args, **kwargs):
+        gc.collect()
+        return compute(*args, **kwargs)
+    scoring_function.compute = collected_compute
+
+
+def run_variant(args):
+    """runs the iterations of args.variant, returns the peak RSS in MB
+    and the mean time per iteration in ms"""
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    config_params.update({'quantile_normalize': False, 'log_subresults': False,
+                          'debug': {}, 'use_BSCM': False, 'use_chi2': False,
+                          'num_iterations': args.iterations,
+                          'Rows': {'schedule': lambda i: True,
+                                   'scaling': ('scaling_const', 6.0)},
+                          'Networks': {'schedule': lambda i: True,
+                                       'scaling': ('scaling_const', 0.5)},
+                          'Motifs': {'schedule': lambda i: True,
+                                     'scaling': ('scaling_const', 1.0)},
+                          'Columns': {'schedule': lambda i: True}})
+    membership = synthetic.make_membership(ratios, config_params)
+    arena = dm.ScoreArena() if args.variant == 'arena' else None
+    run = BenchmarkRun(ratios, membership, config_params, arena)
+    functions = [ma.RowScoringFunction('Rows', run),
+                 SparseScoringFunction('Networks', run),
+                 SparseScoringFunction('Motifs', run)]
+    column_scoring = scoring.ColumnScoringFunction('Columns', run)
+    if args.variant == 'legacy':
+        for scoring_function in functions:
+            collect_before(scoring_function)
+    row_scoring = scoring.ScoringFunctionCombiner(None, membership, functions, config_params)
+
+    rng = np.random.RandomState(17)
+    elapsed = []
+    for iteration in range(1, args.iterations + 1):
+        start = time.time()
+        iteration_result = {'iteration': iteration, 'score_means': {}}
+        row_scoring.compute(iteration_result)
+        column_scoring.compute(iteration_result)
+        change_membership(membership, args.clusters, 0.05, rng)
+        if args.variant == 'legacy':
+            gc.collect()
+        elapsed.append((time.time() - start) * 1000.0)
+    # ru_maxrss is in kilobytes on Linux
+    return {'variant': args.variant,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'mean_ms': float(np.mean(elapsed)),
+            'arena_mb': 0.0 if arena is None else arena.nbytes() / 1024.0 / 1024.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='score arena benchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=600)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--variant', choices=VARIANTS, default=None,
+                        help='run a single variant in this process')
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        # the run logs are not stored, their mapper warnings are not of interest
+        warnings.simplefilter('ignore')
+        print(json.dumps(run_variant(args)))
+        sys.exit(0)
+
+    print('%d genes, %d conditions, %d clusters, %d iterations' %
+          (args.rows, args.cols, args.clusters, args.iterations))
+    print('%-10s %14s %14s %10s' % ('variant', 'peak RSS MB', 'ms/iteration', 'arena MB'))
+    for variant in VARIANTS:
+        output = subprocess.check_output(
+            [sys.executable, sys.argv[0], '--rows', str(args.rows), '--cols', str(args.cols),
+             '--clusters', str(args.clusters), '--iterations', str(args.iterations),
+             '--variant', variant])
+        result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+        print('%-10s %14.1f %14.1f %10.1f' % (variant, result['peak_rss_mb'],
+                                             result['mean_ms'], result['arena_mb']))
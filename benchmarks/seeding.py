@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""seeding.py - times the membership seeding: the NumPy k-means row
+seeder, serial and with its starts on a worker pool, and the column
+seeder against the per-cluster column seeding it replaced.
+
+R's kmeans() is timed as well with --r, which needs R and rpy2.
+
+usage: PYTHONPATH=. python3 benchmarks/seeding.py [--rows 20000] [--cols 300]
+           [--clusters 600] [--r]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+
+import numpy as np
+import cmonkey.membership as memb
+import cmonkey.stats as stats
+import cmonkey.microarray as ma
+import cmonkey.scoring as scoring
+from benchmarks import synthetic
+from benchmarks.row_scoring import timed
+
+
+def legacy_seed_column_members(matrix, row_membership, num_clusters, num_clusters_per_column):
+    """the per-cluster column seeding, with a stable argsort in place of
+    R's order()"""
+    cscores = np.zeros([matrix.num_columns, num_clusters])
+    for cluster_num in range(1, num_clusters + 1):
+        rows = [matrix.row_names[row_index] for row_index in range(matrix.num_rows)
+                if row_membership[row_index][0] == cluster_num]
+        _, scores = scoring.compute_column_scores_submatrix(
+            matrix.submatrix_by_name(row_names=rows))
+        cscores.T[cluster_num - 1] = scores
+    return [list(np.argsort(cscores[i], kind='stable')[:num_clusters_per_column] + 1)
+            for i in range(matrix.num_columns)]
+
+
+def seed_rows(ratios, num_clusters, config_params):
+    row_membership = [[0, 0] for _ in range(ratios.num_rows)]
+    memb.make_kmeans_row_seeder(num_clusters, config_params)(row_membership, ratios)
+    return row_membership
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='seeding benchmark')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--clusters', type=int, default=600)
+    parser.add_argument('--num_cores', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--r', action='store_true', help="also time R's kmeans()")
+    args = parser.parse_args()
+
+    ratios = synthetic.make_ratios(args.rows, args.cols)
+    config_params = synthetic.make_config(args.clusters, args.rows, args.cols)
+    config_params['random_seed'] = 42
+    num_clusters_per_column = config_params['memb.clusters_per_col']
+    print('%d genes x %d conditions, %d clusters' % (args.rows, args.cols, args.clusters))
+
+    backends = [('numpy', False), ('numpy', True)]
+    if args.r:
+        backends.append(('r', False))
+    for backend, multiprocessing in backends:
+        params = dict(config_params, multiprocessing=multiprocessing, num_cores=args.num_cores)
+        stats.set_backend(backend)
+        elapsed = timed(lambda: seed_rows(ratios, args.clusters, params), args.repeat)
+        print('k-means %-5s %-16s %10.2f s' % (backend, 'pool' if multiprocessing else 'serial',
+                                               elapsed))
+
+    stats.set_backend('numpy')
+    row_membership = seed_rows(ratios, args.clusters, config_params)
+    legacy = legacy_seed_column_members(ratios, row_membership, args.clusters,
+                                        num_clusters_per_column)
+    vectorized = ma.seed_column_members(ratios, row_membership, args.clusters,
+                                        num_clusters_per_column)
+    same = sum(sorted(a) == sorted(b) for a, b in zip(legacy, vectorized))
+    print('column seeding: %d of %d columns with the same clusters' % (same, args.cols))
+    for name, seeder in [('per-cluster', legacy_seed_column_members),
+                         ('vectorized', ma.seed_column_members)]:
+        elapsed = timed(lambda: seeder(ratios, row_membership, args.clusters,
+                                       num_clusters_per_column), args.repeat)
+        print('column seeder %-16s %10.2f s' % (name, elapsed))
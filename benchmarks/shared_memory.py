@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""shared_memory.py - memory use of worker pools that read the ratios
+matrix, with and without DataMatrix.share_values()
+
+Each worker sums the whole matrix and reports its memory use. The totals
+are summed over the parent and all workers. RSS counts shared pages in
+every process, PSS splits them between the processes that map them, so
+the PSS total is the actual memory use.
+
+usage: PYTHONPATH=. python3 benchmarks/shared_memory.py [--rows 40000] [--cols 500]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import os
+
+import cmonkey.util as util
+from benchmarks import synthetic
+
+
+def memory_kb():
+    """returns (rss, pss) of this process in kB"""
+    result = {}
+    with open('/proc/self/smaps_rollup') as infile:
+        for line in infile:
+            fields = line.split()
+            if fields[0] in ('Rss:', 'Pss:'):
+                result[fields[0]] = int(fields[1])
+    return result['Rss:'], result['Pss:']
+
+
+def touch_matrix(_):
+    """reads every value of the matrix and reports the memory use"""
+    util.worker_state()['ratios'].values.sum()
+    rss, pss = memory_kb()
+    return os.getpid(), rss, pss
+
+
+def measure(ratios, num_workers, start_method, shared):
+    """returns the total (rss, pss) in MB of the parent and the workers"""
+    if shared:
+        ratios.share_values()
+    pool = util.WorkerPool(num_workers, state={'ratios': ratios}, start_method=start_method)
+    try:
+        per_worker = {}
+        for pid, rss, pss in pool.map(touch_matrix, range(num_workers * 4)):
+            per_worker[pid] = (rss, pss)
+        rss, pss = memory_kb()
+        rss += sum(value[0] for value in per_worker.values())
+        pss += sum(value[1] for value in per_worker.values())
+    finally:
+        pool.close()
+        util.release_shared()
+    return rss / 1024.0, pss / 1024.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='shared memory benchmark')
+    parser.add_argument('--rows', type=int, default=40000)
+    parser.add_argument('--cols', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--start_methods', nargs='*', default=['fork', 'forkserver', 'spawn'])
+    args = parser.parse_args()
+
+    print('%d genes x %d conditions (%.1f MB values), %d workers' %
+          (args.rows, args.cols, args.rows * args.cols * 8 / 1024.0 / 1024.0, args.workers))
+    print('%-12s %-8s %14s %14s' % ('start', 'shared', 'total RSS MB', 'total PSS MB'))
+    for start_method in args.start_methods:
+        for shared in [False, True]:
+            # a fresh matrix for every measurement, share_values() replaces the values
+            ratios = synthetic.make_ratios(args.rows, args.cols)
+            rss, pss = measure(ratios, args.workers, start_method, shared)
+            print('%-12s %-8s %14.1f %14.1f' % (start_method, shared, rss, pss))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""submatrix.py - microbenchmark for DataMatrix submatrix extraction
+
+Calls the submatrix functions repeatedly on a 5000 x 300 matrix with
+cluster-sized selections. The legacy name-based implementation is too slow
+to run 10^5 times, so its time is measured on a smaller number of calls
+and extrapolated.
+
+usage: PYTHONPATH=. python3 benchmarks/submatrix.py [--calls 100000]
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import argparse
+import time
+
+import numpy as np
+import cmonkey.datamatrix as dm
+from benchmarks import synthetic
+
+
+def legacy_submatrix_by_name(matrix, row_names=None, column_names=None):
+    """the name-based submatrix extraction before the index-based API"""
+    def make_values(row_indexes, column_indexes):
+        if row_indexes is None and column_indexes is None:
+            return matrix.values
+        elif row_indexes is None:
+            return matrix.values[:, column_indexes]
+        elif column_indexes is None:
+            return matrix.values[row_indexes]
+        else:
+            return matrix.values[row_indexes][:, column_indexes]
+
+    if row_names is None:
+        row_names = matrix.row_names
+        row_indexes = None
+    else:
+        row_names = [name for name in sorted(row_names)
+                     if name in set(matrix.row_names)]
+        row_indexes = matrix.row_indexes_for(row_names)
+
+    if column_names is None:
+        column_names = matrix.column_names
+        col_indexes = None
+    else:
+        column_names = [name for name in sorted(column_names)
+                        if name in set(matrix.column_names)]
+        col_indexes = matrix.column_indexes_for(column_names)
+
+    new_values = make_values(row_indexes, col_indexes)
+    return dm.DataMatrix(len(row_names), len(column_names), row_names,
+                         column_names, values=new_values)
+
+
+def run(label, fun, selections, num_calls):
+    """times num_calls calls of fun, cycling through the selections"""
+    num_selections = len(selections)
+    start = time.time()
+    for i in range(num_calls):
+        fun(*selections[i % num_selections])
+    elapsed = time.time() - start
+    print('%-32s %8d calls %10.3f s %10.2f us/call' % (label, num_calls, elapsed,
+                                                     elapsed / num_calls * 1e6))
+    return elapsed / num_calls
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='submatrix microbenchmark')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--cols', type=int, default=300)
+    parser.add_argument('--calls', type=int, default=100000)
+    parser.add_argument('--legacy_calls', type=int, default=20)
+    parser.add_argument('--cluster_rows', type=int, default=50)
+    parser.add_argument('--cluster_cols', type=int, default=150)
+    args = parser.parse_args()
+
+    matrix = synthetic.make_ratios(args.rows, args.cols)
+    rng = np.random.RandomState(42)
+    index_selections = []
+    name_selections = []
+    for _ in range(100):
+        rows = np.sort(rng.choice(args.rows, args.cluster_rows, replace=False))
+        cols = np.sort(rng.choice(args.cols, args.cluster_cols, replace=False))
+        index_selections.append((rows, cols))
+        name_selections.append(({matrix.row_names[i] for i in rows},
+                                {matrix.column_names[i] for i in cols}))
+    contiguous = [(np.arange(i, i + args.cluster_rows), None) for i in range(100)]
+
+    legacy = run('legacy submatrix_by_name',
+                 lambda r, c: legacy_submatrix_by_name(matrix, r, c),
+                 name_selections, args.legacy_calls)
+    by_name = run('submatrix_by_name', matrix.submatrix_by_name,
+                  name_selections, args.calls)
+    run('submatrix_by_index', matrix.submatrix_by_index, index_selections, args.calls)
+    run('submatrix_by_index view', lambda r, c: matrix.submatrix_by_index(r, c, view=True),
+        index_selections, args.calls)
+    run('submatrix_by_index view (rows)',
+        lambda r, c: matrix.submatrix_by_index(r, c, view=True), contiguous, args.calls)
+    print('legacy extrapolated to %d calls: %.1f s, speedup of submatrix_by_name: %.0fx' %
+          (args.calls, legacy * args.calls, legacy / by_name))
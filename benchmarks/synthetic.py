@@ -0,0 +1,51 @@
+"""synthetic.py - synthetic inputs for the benchmarks
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import numpy as np
+import cmonkey.datamatrix as dm
+import cmonkey.membership as memb
+
+
+def make_ratios(num_rows, num_cols, seed=42, nan_fraction=0.01):
+    """creates a normally distributed ratios matrix with some missing values"""
+    rng = np.random.RandomState(seed)
+    values = rng.normal(size=(num_rows, num_cols))
+    values[rng.uniform(size=values.shape) < nan_fraction] = np.nan
+    return dm.DataMatrix(num_rows, num_cols,
+                         ['G%05d' % i for i in range(num_rows)],
+                         ['C%04d' % i for i in range(num_cols)],
+                         values=values)
+
+
+def make_config(num_clusters, num_rows, num_cols):
+    """membership configuration that roughly follows the default.ini settings"""
+    return {'num_clusters': num_clusters,
+            'memb.clusters_per_row': 2,
+            'memb.clusters_per_col': int(round(num_clusters / 2.0)) if num_cols >= 60
+            else int(round(num_clusters * 2.0 / 3.0)),
+            'memb.prob_row_change': 0.5,
+            'memb.prob_col_change': 1.0,
+            'memb.max_changes_per_row': 1,
+            'memb.max_changes_per_col': 5,
+            'memb.min_cluster_rows_allowed': 3,
+            'memb.max_cluster_rows_allowed': 70,
+            'multiprocessing': False,
+            'num_cores': None,
+            'add_fuzz': 'rows',
+            'output_dir': 'out'}
+
+
+def make_membership(ratios, config_params, seed=42):
+    """random membership with the configured number of slots filled"""
+    rng = np.random.RandomState(seed)
+    num_clusters = config_params['num_clusters']
+    per_row = config_params['memb.clusters_per_row']
+    per_col = config_params['memb.clusters_per_col']
+    row_members = {name: list(rng.choice(num_clusters, per_row, replace=False) + 1)
+                   for name in ratios.row_names}
+    col_members = {name: list(rng.choice(num_clusters, per_col, replace=False) + 1)
+                   for name in ratios.column_names}
+    return memb.OrigMembership(ratios.row_names, ratios.column_names,
+                               row_members, col_members, config_params)
@@ -14,11 +14,9 @@ Danziger et al.
 BMC Systems Biology, 2015
 """
 import numpy as np
-import scipy as sp
 import math
 import random
 import datetime as dt
-import multiprocessing as mp
 import logging
 
 import cmonkey.datamatrix as datamatrix
@@ -123,6 +121,8 @@ class BSCM:
          geneNames  -- A list of genes in the cluster
          singleCore -- Set to True to use a single core.  False may not work.
         """
+        # scipy.stats takes a while to import and is only needed here
+        import scipy.stats
         pVals = {}
 
         relGenes = list(set(geneNames) & set(self.ratios.row_names))
@@ -163,10 +163,8 @@ class BSCM:
                 for i in range(0, len(noVarNs)):
                     newargs.append([noVarRats[i], noVarNs[i], self.tolerance,
                                     self.maxTime, self.chunkSize, self.verbose, noVarCns[i]])
-                pool = mp.Pool(num_cores)
-                newVars = pool.map(getVarianceMeanSDvect_mp_wrapper, newargs)
-                pool.close()
-                pool.join()
+                with util.get_mp_pool({'num_cores': num_cores}) as pool:
+                    newVars = pool.map(getVarianceMeanSDvect_mp_wrapper, newargs)
             else:
                 tolerance = np.repeat(self.tolerance, len(noVarNs)).tolist()
                 maxTime = np.repeat(self.maxTime, len(noVarNs)).tolist()
@@ -181,7 +179,7 @@ class BSCM:
             curN = str(noVarNs[idx])
             if self.useChi2:
                 curVars = newVars[idx]
-                self.allVars[cn][curN] = sp.stats.chi2.fit(curVars, df=int(curN))
+                self.allVars[cn][curN] = scipy.stats.chi2.fit(curVars, df=int(curN))
             else:
                 self.allVars[cn][curN] = newVars[idx]
 
@@ -199,7 +197,7 @@ class BSCM:
                 curVar = np.var(geneVect)
                 if self.useChi2:
                     [df, loc, scale] = self.allVars[cn][str(n)]
-                    pVals[cn] = 1-sp.stats.chi2.sf(curVar, df=df, loc=loc, scale=scale)
+                    pVals[cn] = 1-scipy.stats.chi2.sf(curVar, df=df, loc=loc, scale=scale)
                 else:
                     pVals[cn] = np.mean(self.allVars[cn][str(n)] < curVar)
 
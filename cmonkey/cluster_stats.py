@@ -0,0 +1,98 @@
+# vi: sw=4 ts=4 et:
+"""cluster_stats.py - per-cluster statistics of score matrices
+
+The statistics are computed over the member values of a score matrix
+(genes x clusters), which a bool membership indicator of the same shape
+selects, e.g. memb.aligned_row_indicator(). All clusters are reduced at
+once: the member values are gathered into a block of (max. members x
+clusters), which is padded with NaN and sorted per cluster, and masked
+by the number of members of each cluster. The statistics ignore NaN
+member values.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import math
+import numpy as np
+
+
+def member_values(values, indicator):
+    """the member values of all clusters as a flat array, including NaN
+    values"""
+    return values[indicator]
+
+
+def member_block(values, indicator):
+    """returns the member values as an array of (max. members x clusters),
+    each column sorted in ascending order and padded with NaN, and the
+    number of member values of each cluster"""
+    clusters, rows = np.nonzero((indicator & ~np.isnan(values)).T)
+    counts = np.bincount(clusters, minlength=indicator.shape[1])
+    # the position of each value within its cluster, clusters are contiguous
+    positions = np.arange(len(rows)) - (np.cumsum(counts) - counts)[clusters]
+    block = np.full((counts.max(initial=0), indicator.shape[1]), np.nan)
+    block[positions, clusters] = values[rows, clusters]
+    block.sort(axis=0)
+    return block, counts
+
+
+class ClusterStats:
+    """Mean, median, trimmed mean and number of the member values of every
+    cluster of a score matrix. Clusters without member values have a
+    count of 0 and NaN statistics"""
+
+    def __init__(self, values, indicator):
+        self.block, self.counts = member_block(values, indicator)
+        self.__positions = np.arange(self.block.shape[0])[:, np.newaxis]
+
+    def __masked_means(self, start, end):
+        """the means of the sorted values in [start, end) of each cluster"""
+        mask = (self.__positions >= start) & (self.__positions < end)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(mask, self.block, 0.0).sum(axis=0) / (end - start)
+
+    def means(self):
+        """the mean member value of each cluster"""
+        return self.__masked_means(0, self.counts)
+
+    def medians(self):
+        """the median member value of each cluster"""
+        if self.block.shape[0] == 0:
+            return np.full(len(self.counts), np.nan)
+        columns = np.arange(len(self.counts))
+        lower = self.block[np.maximum(self.counts - 1, 0) // 2, columns]
+        upper = self.block[self.counts // 2, columns]
+        result = (lower + upper) / 2.0
+        result[self.counts == 0] = np.nan
+        return result
+
+    def trim_means(self, trim):
+        """the mean member value of each cluster without the floor(trim * n)
+        smallest and largest of its n values, the median if trim is 0.5"""
+        if trim == 0.5:
+            return self.medians()
+        num_trimmed = np.floor(trim * self.counts).astype(np.intp)
+        return self.__masked_means(num_trimmed, self.counts - num_trimmed)
+
+
+def trim_mean(values, trim):
+    """returns the mean of values without the floor(trim * n) smallest and
+    largest of the n values, the median if trim is 0.5 and 0 if there are
+    no values. NaN values are ignored. The trimmed values are split off
+    with a partition, so the values are not sorted"""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[~np.isnan(values)]
+    num_values = len(values)
+    if num_values == 0:
+        return 0
+    if trim == 0.5:
+        return np.median(values)
+
+    num_trimmed = int(math.floor(trim * num_values))
+    if num_trimmed > 0:
+        values = np.partition(values, [num_trimmed, num_values - num_trimmed - 1])
+        values = values[num_trimmed:num_values - num_trimmed]
+    return np.mean(values)
+
+
+__all__ = ['ClusterStats', 'member_values', 'trim_mean']
@@ -4,7 +4,6 @@ import shutil
 from datetime import date, datetime
 import json
 import numpy as np
-import gc
 import re
 import logging
 import gzip
@@ -14,11 +13,13 @@ from pkg_resources import Requirement, resource_filename, DistributionNotFound
 from sqlalchemy import and_
 
 import cmonkey.config as config
+import cmonkey.datamatrix as dm
 import cmonkey.microarray as microarray
 import cmonkey.membership as memb
 import cmonkey.meme as meme
 import cmonkey.motif as motif
 import cmonkey.util as util
+import cmonkey.stats as stats
 import cmonkey.rsat as rsat
 import cmonkey.microbes_online as microbes_online
 import cmonkey.organism as org
@@ -66,6 +67,9 @@ class CMonkeyRun:
         self.__membership = None
         self.__organism = None
         self.__session = None
+        self.__pool = None
+        self.__score_arena = None
+        self.__cluster_residuals = None
         self.config_params = args_in
         self.ratios = ratios
         if args_in['resume']:
@@ -76,7 +80,7 @@ class CMonkeyRun:
             else:
                 self.column_seeder = memb.make_db_column_seeder(self.dbsession())
         else:
-            self.row_seeder = memb.make_kmeans_row_seeder(args_in['num_clusters'])
+            self.row_seeder = memb.make_kmeans_row_seeder(args_in['num_clusters'], args_in)
             self.column_seeder = microarray.seed_column_members
 
         today = date.today()
@@ -97,6 +101,41 @@ class CMonkeyRun:
         if self.__session is not None:
             self.__session.close()
             self.__session = None
+        if self.__pool is not None:
+            util.set_run_pool(None)
+            self.__pool.close()
+            self.__pool = None
+        self.__score_arena = None
+        util.release_shared()
+
+    def pool(self):
+        """the worker pool of this run, which is created on first use and
+        shared by all scoring functions until cleanup(). The workers are
+        started with the ratios, all other data is broadcast to them.
+        With use_shared_memory, the ratios and the membership arrays are
+        moved to shared memory, so workers map instead of copy them. The
+        pool is registered before the membership is seeded, so the seeding
+        runs on it, too"""
+        if self.__pool is None and self.config_params['multiprocessing']:
+            use_shared_memory = self.config_params.get('use_shared_memory', False)
+            if use_shared_memory:
+                self.ratios.share_values()
+            self.__pool = util.WorkerPool(self.config_params['num_cores'],
+                                          state={'ratios': self.ratios},
+                                          start_method=self.config_params.get('mp_start_method',
+                                                                              None))
+            util.set_run_pool(self.__pool)
+            if use_shared_memory:
+                self.membership().share_arrays()
+        return self.__pool
+
+    def score_arena(self):
+        """the score matrices of this run, which the scoring functions reuse
+        in every iteration. None if use_score_arena is off, then every
+        result is newly allocated"""
+        if self.__score_arena is None and self.config_params.get('use_score_arena', True):
+            self.__score_arena = dm.ScoreArena()
+        return self.__score_arena
 
     def dbsession(self):
         if self.__session is None:
@@ -125,7 +164,7 @@ class CMonkeyRun:
     def __make_membership(self):
         """returns the seeded membership on demand"""
         if 'random_seed' in self.config_params['debug']:
-            util.r_set_seed(10)
+            stats.set_seed(10)
 
         new_membs = memb.create_membership(self.ratios,
                                self.row_seeder, self.column_seeder,
@@ -409,6 +448,9 @@ class CMonkeyRun:
                  for row_name in self.ratios.row_names]
         self.gene_indexes = {genes[index]: index
                              for index in xrange(len(genes))}
+        # the pipeline seeds the membership, which runs the k-means starts
+        # on the pool
+        self.pool()
         row_scoring, col_scoring = self.__setup_pipeline()
         row_scoring.check_requirements()
         col_scoring.check_requirements()
@@ -448,17 +490,32 @@ class CMonkeyRun:
             matrix = self.ratios.submatrix_by_name(row_names, column_names)
             return matrix.residual()
 
+    def cluster_residuals(self):
+        """the residuals of all clusters like residual_for() computes them.
+        The residuals of clusters whose memberships did not change since
+        the last call are reused"""
+        if self.__cluster_residuals is None:
+            self.__cluster_residuals = dm.ClusterResiduals(self.ratios)
+        row_indicator = self.membership().row_indicator(dense=True)
+        col_indicator = self.membership().col_indicator(dense=True)
+        residuals = self.__cluster_residuals.residuals(row_indicator, col_indicator)
+        small = (row_indicator.sum(axis=0) <= 1) | (col_indicator.sum(axis=0) <= 1)
+        residuals[small] = 1.0
+        return residuals
+
     def write_memberships(self, iteration):
         session = self.dbsession()
+        # the membership has the row and column order of the ratios
+        membership = self.membership()
         for cluster in range(1, self.config_params['num_clusters'] + 1):
-            column_names = self.membership().columns_for_cluster(cluster)
-            column_members = [cm2db.ColumnMember(iteration=iteration, cluster=cluster, order_num=order_num)
-                                  for order_num in self.ratios.column_indexes_for(column_names)]
+            column_members = [cm2db.ColumnMember(iteration=iteration, cluster=cluster,
+                                                 order_num=int(order_num))
+                              for order_num in membership.column_indexes_for_cluster(cluster)]
             session.add_all(column_members)
 
-            row_names = self.membership().rows_for_cluster(cluster)
-            row_members = [cm2db.RowMember(iteration=iteration, cluster=cluster, order_num=order_num)
-                               for order_num in self.ratios.row_indexes_for(row_names)]
+            row_members = [cm2db.RowMember(iteration=iteration, cluster=cluster,
+                                           order_num=int(order_num))
+                           for order_num in membership.row_indexes_for_cluster(cluster)]
             session.add_all(row_members)
         session.commit()
 
@@ -515,17 +572,18 @@ class CMonkeyRun:
         motif_pvalues = iteration_result['motif-pvalue'] if 'motif-pvalue' in iteration_result else {}
         fuzzy_coeff = iteration_result['fuzzy-coeff'] if 'fuzzy-coeff' in iteration_result else 0.0
 
-        residuals = []
         session = self.dbsession()
+        residuals = self.cluster_residuals()
+        num_rows = self.membership().row_indicator(dense=True).sum(axis=0)
+        num_cols = self.membership().col_indicator(dense=True).sum(axis=0)
         for cluster in range(1, self.config_params['num_clusters'] + 1):
-            row_names = self.membership().rows_for_cluster(cluster)
-            column_names = self.membership().columns_for_cluster(cluster)
-            residual = self.residual_for(row_names, column_names)
-            residuals.append(residual)
+            residual = residuals[cluster - 1]
             if np.isnan(residual) or np.isinf(residual):
                 residual = 1.0
-            session.add(cm2db.ClusterStat(iteration=iteration, cluster=cluster, num_rows=len(row_names),
-                                          num_cols=len(column_names), residual=residual))
+            session.add(cm2db.ClusterStat(iteration=iteration, cluster=cluster,
+                                          num_rows=int(num_rows[cluster - 1]),
+                                          num_cols=int(num_cols[cluster - 1]),
+                                          residual=float(residual)))
 
         session.add(cm2db.IterationStat(statstype=1, iteration=iteration, score=fuzzy_coeff))
 
@@ -662,13 +720,12 @@ class CMonkeyRun:
         if self.config_params['interactive']:  # stop here in interactive mode
             return
 
+        # start the workers once for all iterations
+        self.pool()
         for iteration in range(start_iter, num_iter):
             start_time = util.current_millis()
             force = self.config_params['resume'] and iteration == start_iter
             self.run_iteration(iteration, force=force)
-
-            # garbage collection after everything in iteration went out of scope
-            gc.collect()
             elapsed = util.current_millis() - start_time
             logging.debug("performed iteration %d in %f s.", iteration, elapsed / 1000.0)
 
@@ -682,7 +739,9 @@ class CMonkeyRun:
             rscores = self.row_scoring.combine_cached(self.config_params['num_iterations'])
             rd_scores = memb.get_row_density_scores(self.membership(), rscores)
             logging.info("Recomputed combined + density scores.")
-            memb.postadjust(self.membership(), rd_scores)
+            if self.config_params.get('use_shared_memory', False):
+                rd_scores.share_values()
+            memb.postadjust(self.membership(), rd_scores, config_params=self.config_params)
 
             BSCM_obj = self.column_scoring.get_BSCM()
             if not (BSCM_obj is None):
@@ -16,10 +16,12 @@ import logging
 import tempfile
 import json
 import random
+import multiprocessing
 from pkg_resources import Requirement, resource_filename, DistributionNotFound
 
 from cmonkey.schedule import make_schedule
 import cmonkey.util as util
+import cmonkey.stats as stats
 import cmonkey.datamatrix as dm
 import cmonkey.meme_suite as meme
 
@@ -112,6 +114,20 @@ def set_config_general(config, params):
     params['postadjust'] = config.getboolean('General', 'postadjust')
     params['log_subresults'] = config.getboolean('General', 'log_subresults')
     params['add_fuzz'] = config.get('General', 'add_fuzz')
+    params['use_r_rng'] = get_config_boolean(config, 'General', 'use_r_rng', False)
+    params['use_shared_memory'] = get_config_boolean(config, 'General', 'use_shared_memory',
+                                                     False)
+    params['use_score_arena'] = get_config_boolean(config, 'General', 'use_score_arena', True)
+    params['mp_start_method'] = get_config_str(config, 'General', 'mp_start_method', None)
+    if not params['mp_start_method']:
+        params['mp_start_method'] = None
+    elif params['mp_start_method'] not in multiprocessing.get_all_start_methods():
+        raise Exception("unsupported multiprocessing start method '%s'" %
+                        params['mp_start_method'])
+    params['stats_backend'] = get_config_str(config, 'General', 'stats_backend',
+                                             stats.DEFAULT_BACKEND)
+    if params['stats_backend'] not in stats.BACKENDS:
+        raise Exception("unknown stats backend '%s'" % params['stats_backend'])
 
     # python can have large seeds, R, however has a 32 bit limit it seems
     params['random_seed'] = get_config_int(config, 'General', 'random_seed',
@@ -148,6 +164,13 @@ def set_config_membership(config, params):
 
 def set_config_scoring_functions(config, params):
     """processing scoring function specific stuff"""
+    def check_rvec(section, option, rvec):
+        """evaluates the R vector expression, so invalid ones fail here"""
+        try:
+            util.parse_rvec(rvec, params['num_iterations'])
+        except ValueError as e:
+            raise Exception("invalid %s in section '%s': %s" % (option, section, str(e)))
+
     def set_scaling(section):
         try:
             params[section]['scaling'] = ('scaling_const',
@@ -156,9 +179,11 @@ def set_config_scoring_functions(config, params):
         except:
             pass
         try:
-            params[section]['scaling'] = ('scaling_rvec', config.get(section, 'scaling_rvec'))
+            rvec = config.get(section, 'scaling_rvec')
         except:
             raise Exception("no scaling found for section '%s'" % section)
+        check_rvec(section, 'scaling_rvec', rvec)
+        params[section]['scaling'] = ('scaling_rvec', rvec)
 
     ids = [section for section in config.sections()
            if section not in {'General', 'Scoring', 'Membership'}]
@@ -171,6 +196,8 @@ def set_config_scoring_functions(config, params):
             elif option.startswith('scaling_'):
                 set_scaling(id)
             else:
+                if option.endswith('_rvec'):
+                    check_rvec(id, option, value)
                 params[id][option] = value
 
 
@@ -470,7 +497,8 @@ def setup_default(args, config_parser):
     else:
         overrides['memb.clusters_per_col'] = int(round(num_clusters * 2.0 / 3.0))
 
-    params['MEME']['version'] = meme.check_meme_version()
+    params['MEME']['version'] = meme.check_meme_version(
+        args.cachedir if args.cachedir else params['cache_dir'])
     overrides['nomotifs'] = args.nomotifs or not params['MEME']['version']
     overrides['use_string'] = not args.nostring
     overrides['use_operons'] = not args.nooperons
@@ -488,9 +516,10 @@ def setup_default(args, config_parser):
     for key, value in overrides.items():
         params[key] = value
 
+    stats.set_backend(params['stats_backend'])
     if params['random_seed'] is not None:
         random.seed(params['random_seed'])
-        util.r_set_seed(params['random_seed'])
+        stats.set_seed(params['random_seed'])
 
     params['out_database'] = os.path.join(params['output_dir'], params['dbfile_name'])
 
@@ -580,6 +609,11 @@ def write_general_settings(outfile, config_params):
     outfile.write('debug_frequency = %d\n' % config_params['debug_freq'])
     outfile.write('postadjust = %s\n' % str(config_params['postadjust']))
     outfile.write('add_fuzz = %s\n' % str(config_params['add_fuzz']))
+    outfile.write('use_r_rng = %s\n' % str(config_params['use_r_rng']))
+    outfile.write('stats_backend = %s\n' % config_params['stats_backend'])
+    outfile.write('use_shared_memory = %s\n' % str(config_params['use_shared_memory']))
+    outfile.write('use_score_arena = %s\n' % str(config_params['use_score_arena']))
+    outfile.write('mp_start_method = %s\n' % strparam(config_params['mp_start_method']))
     outfile.write('num_clusters = %d\n' % config_params['num_clusters'])
     outfile.write('random_seed = %s\n' % strparam(config_params['random_seed']))
     outfile.write('log_subresults = %s\n' % str(config_params['log_subresults']))
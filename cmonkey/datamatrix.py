@@ -5,6 +5,7 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import scipy
+import scipy.sparse
 import numpy as np
 import operator
 import cmonkey.util as util
@@ -68,6 +69,8 @@ class DataMatrix:
                 self.values.fill(init_value)
 
         self.__row_variance = None
+        self.__row_names_sorted = None
+        self.__column_names_sorted = None
         self.row_indexes = None
         self.column_indexes = None
 
@@ -76,6 +79,38 @@ class DataMatrix:
         self.num_rows = nrows
         self.num_columns = 0 if nrows == 0 else ncols
 
+    @classmethod
+    def from_array(cls, values, row_names, col_names):
+        """wraps an existing two-dimensional numpy array without copying
+        or checking it. The array should not be shared with other matrices
+        unless that is intended"""
+        nrows, ncols = values.shape
+        result = cls(0, 0)
+        result.row_names = row_names
+        result.column_names = col_names
+        result.values = values
+        result.num_rows = nrows
+        result.num_columns = 0 if nrows == 0 else ncols
+        return result
+
+    def share_values(self):
+        """moves the values into a shared memory block. The matrix is then
+        pickled with a reference to the block instead of the values, so
+        worker processes can map them without a copy"""
+        self.values = util.to_shared(self.values)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        ref = util.shared_ref(self.values)
+        if ref is not None:
+            state['values'] = ref
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['values'], util.SharedArrayRef):
+            state['values'] = state['values'].attach()
+        self.__dict__.update(state)
+
     def row_indexes_for(self, row_names):
         """returns the row indexes with the matching names"""
         if self.row_indexes is None:
@@ -90,6 +125,25 @@ class DataMatrix:
         return [self.column_indexes[name] if name in self.column_indexes else -1
                 for name in column_names]
 
+    def row_index_array(self, row_names):
+        """returns the indexes of the rows in row_names that exist in this
+        matrix as a numpy array, ordered by row name"""
+        if self.row_indexes is None:
+            self.row_indexes = {row: index for index, row in enumerate(self.row_names)}
+        if self.__row_names_sorted is None:
+            self.__row_names_sorted = is_sorted(self.row_names)
+        return name_index_array(row_names, self.row_indexes, self.__row_names_sorted)
+
+    def column_index_array(self, column_names):
+        """returns the indexes of the columns in column_names that exist in
+        this matrix as a numpy array, ordered by column name"""
+        if self.column_indexes is None:
+            self.column_indexes = {col: index for index, col in enumerate(self.column_names)}
+        if self.__column_names_sorted is None:
+            self.__column_names_sorted = is_sorted(self.column_names)
+        return name_index_array(column_names, self.column_indexes,
+                                self.__column_names_sorted)
+
     def row_values(self, row):
         """returns the values in the specified row"""
         return self.values[[row]][0]
@@ -109,47 +163,46 @@ class DataMatrix:
                           col_names=self.column_names,
                           values=new_values)
 
-    def submatrix_by_name(self, row_names=None, column_names=None):
+    def submatrix_by_index(self, row_indexes=None, column_indexes=None, view=False):
+        """extract a submatrix with the specified row and column indexes,
+        which are integer numpy arrays (or None to select all rows/columns).
+        The submatrix contains the rows and columns in the order given.
+
+        By default, the submatrix values are a copy. With view=True, the
+        values are shared with this matrix whenever numpy allows it, which
+        is the case for whole dimensions and contiguous ascending index
+        ranges. Other selections are gathered into a copy. Views
+        should be used read-only, since writing to them changes this matrix
+        """
+        rows = as_index_selector(row_indexes, self.num_rows, view)
+        cols = as_index_selector(column_indexes, self.num_columns, view)
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            values = self.values[rows, cols]
+        else:
+            # gathering whole rows first is faster than a combined np.ix_()
+            values = self.values[rows][:, cols]
+        if not view and np.may_share_memory(values, self.values):
+            values = values.copy()
+
+        row_names = (self.row_names if row_indexes is None
+                     else select_names(self.row_names, row_indexes))
+        col_names = (self.column_names if column_indexes is None
+                     else select_names(self.column_names, column_indexes))
+        return DataMatrix.from_array(values, row_names, col_names)
+
+    def submatrix_by_name(self, row_names=None, column_names=None, view=False):
         """extract a submatrix with the specified rows and columns
         Selecting by name is more common than selecting by index
         in cMonkey, because submatrices are often selected based
         on memberships.
+        Names that do not exist in this matrix are ignored and the
+        selected rows and columns are ordered by name.
         Note: Currently, no duplicate row names or column names are
-        supported. Furthermore, the submatrices potentially share
-        the original matrix's values and so, writing to the submatrix
-        will change the original matrix, too. Recommended to use
-        submatrices read-only
+        supported. See submatrix_by_index() for the meaning of view
         """
-        def make_values(row_indexes, column_indexes):
-            """creates an array from the selected rows and columns"""
-            if row_indexes is None and column_indexes is None:
-                return self.values
-            elif row_indexes is None:
-                return self.values[:, column_indexes]
-            elif column_indexes is None:
-                return self.values[row_indexes]
-            else:
-                return self.values[row_indexes][:, column_indexes]
-
-        if row_names is None:
-            row_names = self.row_names
-            row_indexes = None
-        else:
-            row_names = [name for name in sorted(row_names)
-                         if name in set(self.row_names)]
-            row_indexes = self.row_indexes_for(row_names)
-
-        if column_names is None:
-            column_names = self.column_names
-            col_indexes = None
-        else:
-            column_names = [name for name in sorted(column_names)
-                            if name in set(self.column_names)]
-            col_indexes = self.column_indexes_for(column_names)
-
-        new_values = make_values(row_indexes, col_indexes)
-        return DataMatrix(len(row_names), len(column_names), row_names,
-                          column_names, values=new_values)
+        row_indexes = None if row_names is None else self.row_index_array(row_names)
+        col_indexes = None if column_names is None else self.column_index_array(column_names)
+        return self.submatrix_by_index(row_indexes, col_indexes, view)
 
     def sorted_by_row_name(self):
         """returns a version of this table, sorted by row name"""
@@ -228,15 +281,7 @@ class DataMatrix:
         """replaces values < -20 with the smallest value that is >= -20
         replaces all NA/Inf values with the maximum value in the matrix
         """
-        masked = self.values[np.isfinite(self.values)]
-        minval = np.min(masked[masked >= min_value])
-        maxval = np.max(masked)
-
-        self.values[np.isinf(self.values)] = maxval
-        self.values[np.isnan(self.values)] = maxval #Should this actually be 0 or median?
-
-        #01-28-15 reordered to make sure that NAs are removed before this test
-        self.values[self.values < min_value] = np.min(masked[masked >= min_value])
+        fix_extreme_values(self.values, min_value)
 
     def __repr__(self):
         """returns a string representation of this matrix"""
@@ -281,6 +326,166 @@ class DataMatrix:
                 outfile.flush()
 
 
+def is_sorted(names):
+    """returns True if the specified names are in ascending order"""
+    return all(names[i] <= names[i + 1] for i in xrange(len(names) - 1))
+
+
+def name_index_array(names, index_map, names_sorted):
+    """maps the names to their indexes through index_map and returns the
+    indexes of the known names as a numpy array, ordered by name.
+    If the indexed names are sorted, ordering by index is the same as
+    ordering by name, so we can sort the index array instead of the names"""
+    if names_sorted:
+        indexes = np.fromiter((index_map.get(name, -1) for name in names),
+                              dtype=np.intp)
+        indexes = np.sort(indexes[indexes >= 0])
+    else:
+        indexes = np.fromiter((index_map[name] for name in sorted(names)
+                               if name in index_map), dtype=np.intp)
+    return indexes
+
+
+def select_names(names, indexes):
+    """returns the names at the specified indexes"""
+    return [names[index] for index in np.asarray(indexes).tolist()]
+
+
+def as_index_selector(indexes, size, view):
+    """turns an index array into something that can index a numpy axis.
+    None selects the whole axis. In view mode, contiguous ascending
+    ranges are turned into slices, so numpy does not need to copy"""
+    if indexes is None:
+        return slice(None)
+    indexes = np.asarray(indexes, dtype=np.intp)
+    if (view and len(indexes) > 0 and indexes[0] >= 0 and
+        indexes[-1] - indexes[0] == len(indexes) - 1 and
+        (len(indexes) == 1 or np.all(np.diff(indexes) == 1))):
+        return slice(indexes[0], indexes[-1] + 1)
+    return indexes
+
+
+def cluster_residuals(matrix, row_indicator, col_indicator, clusters=None):
+    """computes the residuals of the submatrices of several clusters, the
+    result for a cluster is the same as DataMatrix.residual() of its
+    submatrix.
+
+    row_indicator and col_indicator are the boolean (rows x clusters) and
+    (columns x clusters) membership indicators of the matrix, clusters
+    are the indicator columns to compute, all by default. With X the
+    matrix, M the mask of its defined values, R and C the row and column
+    indicators, the means and counts are indicator products like in
+    microarray.compute_row_scores_batched(): the column means are
+    (R^T X) / (R^T M), the row means (X C) / (M C) and the number of
+    defined cells is the diagonal of R^T M C. The absolute deviations are
+    then summed over the cells of one cluster at a time. Clusters without
+    values have a NaN residual"""
+    if clusters is None:
+        clusters = np.arange(row_indicator.shape[1])
+    col_indicator = col_indicator[:, clusters]
+    num_clusters = len(clusters)
+    # only the member rows of the clusters enter the products
+    member_rows = np.nonzero(row_indicator[:, clusters].any(axis=1))[0]
+    row_indicator = row_indicator[member_rows][:, clusters]
+    values = matrix.values[member_rows]
+    missing = np.isnan(values)
+    xvalues = np.where(missing, 0.0, values)
+    mask = (~missing).astype(np.float64)
+
+    # the members of each cluster, ordered by cluster
+    row_clusters, row_members = np.nonzero(np.ascontiguousarray(row_indicator.T))
+    col_clusters, col_members = np.nonzero(np.ascontiguousarray(col_indicator.T))
+    row_starts = np.searchsorted(row_clusters, np.arange(num_clusters + 1))
+    col_starts = np.searchsorted(col_clusters, np.arange(num_clusters + 1))
+    rows = scipy.sparse.csr_matrix((np.ones(len(row_clusters)), (row_clusters, row_members)),
+                                   shape=(num_clusters, values.shape[0]))
+    cols = col_indicator.astype(np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        col_means = rows.dot(xvalues) / rows.dot(mask)
+        row_counts = mask.dot(cols)
+        row_means = xvalues.dot(cols) / row_counts
+        # the overall mean of a cluster is the mean of its defined row means
+        has_mean = row_indicator & (row_counts > 0)
+        overall_means = (np.where(has_mean, row_means, 0.0).sum(axis=0) /
+                         has_mean.sum(axis=0))
+    counts = np.where(row_indicator, row_counts, 0.0).sum(axis=0)
+
+    sums = np.zeros(num_clusters)
+    for index in xrange(num_clusters):
+        block_rows = row_members[row_starts[index]:row_starts[index + 1]]
+        block_cols = col_members[col_starts[index]:col_starts[index + 1]]
+        deviations = values[np.ix_(block_rows, block_cols)] + overall_means[index]
+        deviations -= row_means[block_rows, index][:, np.newaxis]
+        deviations -= col_means[index, block_cols]
+        sums[index] = np.nansum(np.abs(deviations))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+class ClusterResiduals:
+    """Computes the cluster residuals of a matrix with cluster_residuals()
+    and keeps them for the clusters whose row and column memberships did
+    not change since the last computation"""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.__rows = None
+        self.__cols = None
+        self.__residuals = None
+
+    def residuals(self, row_indicator, col_indicator):
+        """returns the residuals of all indicator columns"""
+        if self.__rows is None or self.__rows.shape != row_indicator.shape:
+            changed = np.arange(row_indicator.shape[1])
+            self.__residuals = np.zeros(row_indicator.shape[1])
+        else:
+            changed = np.nonzero(np.any(self.__rows != row_indicator, axis=0) |
+                                 np.any(self.__cols != col_indicator, axis=0))[0]
+        if len(changed) > 0:
+            self.__residuals[changed] = cluster_residuals(self.matrix, row_indicator,
+                                                          col_indicator, changed)
+        self.__rows = np.array(row_indicator, dtype=bool)
+        self.__cols = np.array(col_indicator, dtype=bool)
+        logging.debug("computed the residuals of %d clusters", len(changed))
+        return self.__residuals.copy()
+
+
+class ScoreArena:
+    """Hands out the score matrices of a run. The values of a matrix are
+    allocated for the first request of a key and reused by all later
+    requests of the same key and shape, so a scoring function's result is
+    overwritten by its next result instead of being allocated again"""
+
+    def __init__(self):
+        self.__buffers = {}
+        self.__column_names = {}
+
+    def values(self, key, shape, fill_value=None):
+        """returns the array of key, which is filled with fill_value unless
+        that is None"""
+        buffer = self.__buffers.get(key, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape)
+            self.__buffers[key] = buffer
+        if fill_value is not None:
+            buffer.fill(fill_value)
+        return buffer
+
+    def matrix(self, key, row_names, num_columns, fill_value=None):
+        """returns a matrix of key with the default column names of a
+        DataMatrix, which wraps the array of key"""
+        if num_columns not in self.__column_names:
+            self.__column_names[num_columns] = ["Col " + str(i) for i in xrange(num_columns)]
+        return DataMatrix.from_array(self.values(key, (len(row_names), num_columns), fill_value),
+                                     row_names, self.__column_names[num_columns])
+
+    def nbytes(self):
+        """the number of bytes held by the arena"""
+        return sum(buffer.nbytes for buffer in self.__buffers.values())
+
+
 FILTER_THRESHOLD = 0.98
 ROW_THRESHOLD = 0.17
 COLUMN_THRESHOLD = 0.1
@@ -383,6 +588,22 @@ def create_from_csv(csvpath, filters=[], sep='\t', quotechar='"', case_sensitive
                       values=df.values)
 
 
+def fix_extreme_values(values, min_value=-20.0):
+    """the in-place version of DataMatrix.fix_extreme_values() for an array:
+    NA/Inf values become the largest finite value, then values < min_value
+    become the smallest finite value that is >= min_value"""
+    finite = np.isfinite(values)
+    maxval = np.max(values, where=finite, initial=-np.inf)
+    minval = np.min(values, where=finite & (values >= min_value), initial=np.inf)
+    if np.isinf(minval):
+        raise ValueError("no finite values >= %f" % min_value)
+
+    values[~finite] = maxval  # Should this actually be 0 or median?
+
+    #01-28-15 reordered to make sure that NAs are removed before this test
+    values[values < min_value] = minval
+
+
 def quantile_normalize_scores(matrices, weights=None):
     """quantile normalize scores against each other"""
 
@@ -432,42 +653,19 @@ def ranks(values):
     return ranks
 
 
-def rank_fun(mat_mean):
-    """ranking function that is run within Pool.map()"""
-    values, row_names, column_names, tmp_mean = mat_mean
-    num_rows, num_cols = values.shape
-    rankvals = util.rrank_matrix(values)
-    values = np.reshape(tmp_mean[rankvals], (num_rows, num_cols))
-    return DataMatrix(num_rows, num_cols, row_names, column_names,
-                      values=values)
-
-
-def qm_result_matrices(matrices, tmp_mean, multiprocessing=True):
+def qm_result_matrices(matrices, tmp_mean):
     """builds the resulting matrices by looking at the rank of their
     original values and retrieving the means at the specified position"""
-    if multiprocessing:
-        # parallelized ranking
-        with util.get_mp_pool() as pool:
-            results = pool.map(rank_fun,
-                               [(matrix.values, matrix.row_names, matrix.column_names, tmp_mean)
-                                for matrix in matrices])
-        return results
-    else:
-        # non-parallelized
-        result = []
-        for i in xrange(len(matrices)):
-            matrix = matrices[i]
-            values = matrix.values
-            num_rows, num_cols = values.shape
-            rankvals = util.rrank_matrix(values)
-            values = np.reshape(tmp_mean[rankvals], (num_rows, num_cols))
-            outmatrix = DataMatrix(num_rows,
-                                   num_cols,
-                                   matrix.row_names,
-                                   matrix.column_names,
-                                   values=values)
-            result.append(outmatrix)
-        return result
+    result = []
+    for matrix in matrices:
+        num_rows, num_cols = matrix.values.shape
+        rankvals = util.rank_matrix(matrix.values)
+        values = tmp_mean[rankvals]
+        values[rankvals < 0] = np.nan
+        result.append(DataMatrix(num_rows, num_cols,
+                                 matrix.row_names, matrix.column_names,
+                                 values=np.reshape(values, (num_rows, num_cols))))
+    return result
 
 
 # Ensemble functionality
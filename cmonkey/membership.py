@@ -7,14 +7,14 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import math
-import random
 import logging
 import sys
 import numpy as np
-import rpy2.robjects as robjects
+import scipy.sparse
 from sqlalchemy import func
 
 import cmonkey.datamatrix as dm
+import cmonkey.stats as stats
 import cmonkey.util as util
 
 # Python2/Python3 compatibility
@@ -60,6 +60,13 @@ class OrigMembership:
                  config_params, row_indexes=None, col_indexes=None):
         """identical constructor to ClusterMembership"""
         self.__config_params = config_params
+        self.__random_generator = None
+
+        # inverted indexes cluster -> member indexes, built on first use and
+        # updated by the modifying methods. An index is rebuilt if its
+        # membership array was replaced
+        self.__row_index = None
+        self.__col_index = None
 
         # table with |genes| rows and the configured number of columns
         num_per_row = config_params['memb.clusters_per_row']
@@ -157,6 +164,47 @@ class OrigMembership:
         """returns the maximum number of rows that should be in a cluster"""
         return self.__config_params[KEY_MAX_CLUSTER_ROWS_ALLOWED]
 
+    def random_generator(self):
+        """returns the NumPy random number generator of this membership,
+        which is seeded with the run's random_seed"""
+        if self.__random_generator is None:
+            self.__random_generator = np.random.default_rng(
+                self.__config_params.get('random_seed'))
+        return self.__random_generator
+
+    def share_arrays(self):
+        """moves the membership arrays into shared memory blocks, so they
+        are pickled as references to the blocks"""
+        self.row_membs = util.to_shared(self.row_membs)
+        self.col_membs = util.to_shared(self.col_membs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['row_membs', 'col_membs']:
+            ref = util.shared_ref(state[key])
+            if ref is not None:
+                state[key] = ref
+        # the indexes are rebuilt on demand from the arrays
+        state['_OrigMembership__row_index'] = None
+        state['_OrigMembership__col_index'] = None
+        return state
+
+    def __setstate__(self, state):
+        for key in ['row_membs', 'col_membs']:
+            if isinstance(state[key], util.SharedArrayRef):
+                state[key] = state[key].attach()
+        self.__dict__.update(state)
+
+    def __row_cluster_index(self):
+        if self.__row_index is None or self.__row_index.source is not self.row_membs:
+            self.__row_index = ClusterIndex(self.row_membs)
+        return self.__row_index
+
+    def __col_cluster_index(self):
+        if self.__col_index is None or self.__col_index.source is not self.col_membs:
+            self.__col_index = ClusterIndex(self.col_membs)
+        return self.__col_index
+
     def min_cluster_columns_allowed(self):
         """returns the minimum number of columns that should be in a cluster"""
         return 0
@@ -179,19 +227,53 @@ class OrigMembership:
         """returns the number of clusters for the column"""
         return len(self.clusters_for_column(column))
 
+    def row_indexes_for_cluster(self, cluster):
+        """returns the sorted indexes of the rows in cluster. The result is
+        readonly and owned by the membership"""
+        return self.__row_cluster_index().members(cluster)
+
+    def column_indexes_for_cluster(self, cluster):
+        """returns the sorted indexes of the columns in cluster. The result is
+        readonly and owned by the membership"""
+        return self.__col_cluster_index().members(cluster)
+
+    def row_indicator(self, dense=False, num_clusters=None):
+        """returns the |rows| x num_clusters membership indicator as a
+        scipy.sparse.csr_matrix of float ones, or as a readonly bool array
+        if dense is True. num_clusters defaults to the configured number.
+        The result is cached until the row memberships change through this
+        membership's methods and must not be modified"""
+        return self.__indicator(self.__row_cluster_index(), dense, num_clusters)
+
+    def col_indicator(self, dense=False, num_clusters=None):
+        """returns the |columns| x num_clusters membership indicator, see
+        row_indicator()"""
+        return self.__indicator(self.__col_cluster_index(), dense, num_clusters)
+
+    def __indicator(self, index, dense, num_clusters):
+        if num_clusters is None:
+            num_clusters = self.num_clusters()
+        key = (dense, num_clusters)
+        if key not in index.indicators:
+            if dense:
+                indicator = membership_indicator(index.source, num_clusters)
+                indicator.flags.writeable = False
+            else:
+                indicator = sparse_membership_indicator(index.source, num_clusters)
+            index.indicators[key] = indicator
+        return index.indicators[key]
+
     def rows_for_cluster(self, cluster):
-        idx = set(np.where(self.row_membs == cluster)[0])
-        return {self.row_names[i] for i in idx}
+        return {self.row_names[i] for i in self.row_indexes_for_cluster(cluster)}
 
     def columns_for_cluster(self, cluster):
-        idx = set(np.where(self.col_membs == cluster)[0])
-        return {self.col_names[i] for i in idx}
+        return {self.col_names[i] for i in self.column_indexes_for_cluster(cluster)}
 
     def num_row_members(self, cluster):
-        return len(self.rows_for_cluster(cluster))
+        return len(self.row_indexes_for_cluster(cluster))
 
     def num_column_members(self, cluster):
-        return len(self.columns_for_cluster(cluster))
+        return len(self.column_indexes_for_cluster(cluster))
 
     def clusters_not_in_row(self, row, clusters):
         return [cluster for cluster in clusters
@@ -215,39 +297,89 @@ class OrigMembership:
 
     def add_cluster_to_row(self, row, cluster, force=False):
         rowidx = self.rowidx[row]
+        index = self.__row_cluster_index()
         free_slots = np.where(self.row_membs[rowidx] == 0)[0]
         if len(free_slots > 0):
-            index = free_slots[0]
-            self.row_membs[rowidx, index] = cluster
+            slot = free_slots[0]
+            self.row_membs[rowidx, slot] = cluster
         elif not force:
             raise Exception(("add_cluster_to_row() - exceeded clusters/row " +
                              "limit for row: '%s'" % str(row)))
         else:
             tmp = np.zeros((self.row_membs.shape[0], self.row_membs.shape[1] + 1), dtype='int32')
             tmp[:, :-1] = self.row_membs
+            if util.shared_ref(self.row_membs) is not None:
+                tmp = util.to_shared(tmp)
             self.row_membs = tmp
             self.row_membs[rowidx][-1] = cluster
+            index.source = self.row_membs
+        index.add(cluster, rowidx)
 
     def add_cluster_to_column(self, col, cluster, force=False):
         colidx = self.colidx[col]
+        index = self.__col_cluster_index()
         free_slots = np.where(self.col_membs[colidx] == 0)[0]
         if len(free_slots) > 0:
-            index = free_slots[0]
-            self.col_membs[colidx, index] = cluster
+            slot = free_slots[0]
+            self.col_membs[colidx, slot] = cluster
         elif not force:
             raise Exception(("add_cluster_to_column() - exceeded clusters/col " +
                              "limit for column: '%s'" % str(col)))
         else:
             tmp = np.zeros((self.col_membs.shape[0], self.col_membs.shape[1] + 1), dtype='int32')
             tmp[:, :-1] = self.col_membs
+            if util.shared_ref(self.col_membs) is not None:
+                tmp = util.to_shared(tmp)
             self.col_membs = tmp
             self.col_membs[colidx][-1] = cluster
+            index.source = self.col_membs
+        index.add(cluster, colidx)
+
+    def remove_cluster_from_row(self, row, cluster):
+        """empties the slots of row that contain cluster"""
+        rowidx = self.rowidx[row]
+        index = self.__row_cluster_index()
+        self.row_membs[rowidx, self.row_membs[rowidx] == cluster] = 0
+        index.remove(cluster, rowidx)
+
+    def remove_cluster_from_column(self, col, cluster):
+        """empties the slots of col that contain cluster"""
+        colidx = self.colidx[col]
+        index = self.__col_cluster_index()
+        self.col_membs[colidx, self.col_membs[colidx] == cluster] = 0
+        index.remove(cluster, colidx)
+
+    def replace_row_memberships(self, row_indexes, membs):
+        """replaces the slots of the rows at row_indexes with the rows of
+        membs. If only a few rows change, the row index is updated,
+        otherwise it is rebuilt on its next use"""
+        self.__row_index = replace_memberships(self.row_membs, self.__row_index,
+                                               row_indexes, membs)
+
+    def replace_column_memberships(self, col_indexes, membs):
+        """replaces the slots of the columns at col_indexes with the rows of
+        membs. If only a few columns change, the column index is updated,
+        otherwise it is rebuilt on its next use"""
+        self.__col_index = replace_memberships(self.col_membs, self.__col_index,
+                                               col_indexes, membs)
 
     def replace_row_cluster(self, row, index, new):
-        self.row_membs[self.rowidx[row], index] = new
+        rowidx = self.rowidx[row]
+        cluster_index = self.__row_cluster_index()
+        old = self.row_membs[rowidx, index]
+        self.row_membs[rowidx, index] = new
+        if old not in self.row_membs[rowidx]:
+            cluster_index.remove(old, rowidx)
+        cluster_index.add(new, rowidx)
 
     def replace_column_cluster(self, col, index, new):
-        self.col_membs[self.colidx[col], index] = new
+        colidx = self.colidx[col]
+        cluster_index = self.__col_cluster_index()
+        old = self.col_membs[colidx, index]
+        self.col_membs[colidx, index] = new
+        if old not in self.col_membs[colidx]:
+            cluster_index.remove(old, colidx)
+        cluster_index.add(new, colidx)
 
     def pickle_path(self):
         """returns the function-specific pickle-path"""
@@ -259,7 +391,8 @@ class OrigMembership:
         start = util.current_millis()
         row_scores, column_scores = fuzzify(self, row_scores, column_scores,
                                             num_iterations, iteration_result,
-                                            self.__config_params['add_fuzz'])
+                                            self.__config_params['add_fuzz'],
+                                            self.__config_params.get('use_r_rng', False))
         elapsed = util.current_millis() - start
         logging.debug("fuzzify took %f s.", elapsed / 1000.0)
 
@@ -293,6 +426,129 @@ class OrigMembership:
         logging.debug("update_for cdscores finished in %f s.", elapsed / 1000.0)
 
 
+def membership_indicator(membs, num_clusters):
+    """builds a boolean (|membs| x num_clusters) indicator matrix from
+    a slot-based membership array like OrigMembership.row_membs or
+    OrigMembership.col_membs. Empty slots (cluster 0) are ignored"""
+    result = np.zeros((membs.shape[0], num_clusters + 1), dtype=bool)
+    result[np.arange(membs.shape[0])[:, np.newaxis], membs] = True
+    return result[:, 1:]
+
+
+def __distinct_clusters(membs):
+    """returns the slots of membs sorted within each member and a mask of
+    the slots that hold a cluster for the first time in their member"""
+    sorted_membs = np.sort(membs, axis=1)
+    distinct = sorted_membs > 0
+    distinct[:, 1:] &= sorted_membs[:, 1:] != sorted_membs[:, :-1]
+    return sorted_membs, distinct
+
+
+def sparse_membership_indicator(membs, num_clusters):
+    """the indicator matrix of membership_indicator() as a
+    scipy.sparse.csr_matrix with float ones for the memberships"""
+    sorted_membs, distinct = __distinct_clusters(membs)
+    indptr = np.zeros(membs.shape[0] + 1, dtype=np.int64)
+    np.cumsum(distinct.sum(axis=1), out=indptr[1:])
+    indices = sorted_membs[distinct] - 1
+    return scipy.sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                   shape=(membs.shape[0], num_clusters))
+
+
+def cluster_sizes(membs, num_clusters):
+    """returns the number of members of the clusters 1..num_clusters in a
+    slot-based membership array. A member that holds a cluster in more
+    than one slot is counted once"""
+    sorted_membs, distinct = __distinct_clusters(membs)
+    return np.bincount(sorted_membs[distinct],
+                       minlength=num_clusters + 1)[1:num_clusters + 1]
+
+
+EMPTY_INDEX = np.zeros(0, dtype='int64')
+EMPTY_INDEX.flags.writeable = False
+
+
+class ClusterIndex:
+    """Inverted index cluster -> sorted member indexes of a slot-based
+    membership array like OrigMembership.row_membs. The index is built
+    in one pass and then kept up to date by add() and remove(). Updated
+    clusters are held as sets and sorted again on their next lookup"""
+
+    def __init__(self, membs):
+        self.source = membs
+        # indicator matrices of source, cleared by add() and remove()
+        self.indicators = {}
+        self.__arrays = {}
+        self.__sets = {}
+        members, slots = np.nonzero(membs)
+        clusters = membs[members, slots].astype('int64')
+        # sort by cluster, then member and drop members that have a cluster twice
+        num_members = max(membs.shape[0], 1)
+        keys = np.unique(clusters * num_members + members)
+        clusters = keys // num_members
+        members = keys - clusters * num_members
+        starts = np.flatnonzero(np.diff(clusters)) + 1
+        if len(keys) > 0:
+            for start, cluster_members in zip(np.r_[0, starts], np.split(members, starts)):
+                cluster_members.flags.writeable = False
+                self.__arrays[int(clusters[start])] = cluster_members
+
+    def members(self, cluster):
+        """returns the sorted, readonly member indexes of cluster"""
+        result = self.__arrays.get(cluster, None)
+        if result is None:
+            if len(self.__sets.get(cluster, ())) == 0:
+                return EMPTY_INDEX
+            result = np.array(sorted(self.__sets[cluster]), dtype='int64')
+            result.flags.writeable = False
+            self.__arrays[cluster] = result
+        return result
+
+    def __members_set(self, cluster):
+        if cluster not in self.__sets:
+            self.__sets[cluster] = set(self.__arrays.get(cluster, EMPTY_INDEX).tolist())
+        self.__arrays.pop(cluster, None)
+        return self.__sets[cluster]
+
+    def add(self, cluster, member):
+        self.indicators.clear()
+        if cluster != 0:
+            self.__members_set(int(cluster)).add(int(member))
+
+    def remove(self, cluster, member):
+        self.indicators.clear()
+        if cluster != 0:
+            self.__members_set(int(cluster)).discard(int(member))
+
+
+# replace_memberships() updates an index member by member if at most this
+# fraction of the members change, otherwise the index is rebuilt
+MAX_INDEX_UPDATE_FRACTION = 0.1
+
+
+def replace_memberships(membs, index, indexes, new_membs):
+    """replaces the slots of membs at indexes with the rows of new_membs and
+    returns the index to keep for membs, None if it needs a rebuild"""
+    indexes = np.asarray(indexes, dtype=np.int64)
+    old_membs = membs[indexes]
+    changed = np.flatnonzero((old_membs != new_membs).any(axis=1))
+    membs[indexes] = new_membs
+    if len(changed) == 0:
+        return index
+    if (index is None or index.source is not membs or
+            len(changed) > MAX_INDEX_UPDATE_FRACTION * membs.shape[0]):
+        return None
+    for member, old, new in zip(indexes[changed].tolist(),
+                                old_membs[changed].tolist(),
+                                np.asarray(new_membs)[changed].tolist()):
+        old, new = set(old), set(new)
+        for cluster in old - new:
+            index.remove(cluster, member)
+        for cluster in new - old:
+            index.add(cluster, member)
+    return index
+
+
 def create_membership(matrix, seed_row_memberships, seed_column_memberships,
                       config_params):
     """create instance of ClusterMembership using
@@ -323,19 +579,87 @@ def create_membership(matrix, seed_row_memberships, seed_column_memberships,
                           config_params, matrix.row_indexes, matrix.column_indexes)
 
 
+def draw_changes(membership, probability, count):
+    """returns a bool array that tells for each of count rows or columns
+    whether it sees a change in this update. The draws are taken from the
+    membership's random generator"""
+    if probability >= 1.0:
+        return np.ones(count, dtype=bool)
+    return membership.random_generator().uniform(0.0, 1.0, count) <= probability
+
+
 def update_for_rows(membership, rd_scores, multiprocessing):
-    """generically updating row memberships according to  rd_scores"""
-    rownames = rd_scores.row_names
+    """generically updating row memberships according to rd_scores. All rows
+    are updated at once, a row only changes its own slots, so the order of
+    the rows does not matter. update_for_rows_reference() is the equivalent
+    row-by-row formulation"""
     # note: for rows, the original version sorts the best clusters by cluster number !!!
     best_clusters = get_best_clusters(rd_scores, membership.num_clusters_per_row(), True)
+    changes = draw_changes(membership, membership.probability_seeing_row_change(),
+                           rd_scores.num_rows)
+    if best_clusters.shape[1] != membership.row_membs.shape[1]:
+        # slots were added with force, the vectorized form assumes that
+        # there is a best cluster for every slot
+        __update_for_rows_loop(membership, rd_scores, best_clusters, changes)
+        return
+    if best_clusters.shape[1] == 0:
+        return
+
+    score_rows = np.flatnonzero(changes)
+    if len(score_rows) == 0:
+        return
+    memb_rows = np.array([membership.rowidx[rd_scores.row_names[index]]
+                          for index in score_rows], dtype=np.int64)
+    best = best_clusters[score_rows]
+    membs = membership.row_membs[memb_rows]
+    scores = rd_scores.values[score_rows]
+    rows = np.arange(len(score_rows))
+
+    for _ in range(membership.max_changes_per_row()):
+        # rows with a free slot take the best cluster at the first free slot
+        free = membs == 0
+        has_free = free.any(axis=1)
+        first_free = free.argmax(axis=1)
+        take = best[rows, first_free]
+        take_ok = has_free & ~(membs == take[:, np.newaxis]).any(axis=1)
+
+        # full rows replace the slot with the largest score gain, slots whose
+        # current cluster is among the best have no gain
+        curr = np.where(has_free[:, np.newaxis], 1, membs)
+        deltas = (np.take_along_axis(scores, best - 1, axis=1) -
+                  np.take_along_axis(scores, curr - 1, axis=1))
+        deltas[(curr[:, :, np.newaxis] == best[:, np.newaxis, :]).any(axis=2)] = 0
+        maxidx = deltas.argmax(axis=1)
+        replacement = best[rows, maxidx]
+        replace_ok = (~has_free & (deltas != 0.0).any(axis=1) &
+                      ~(membs == replacement[:, np.newaxis]).any(axis=1))
+
+        slots = np.where(take_ok, first_free, maxidx)
+        new_clusters = np.where(take_ok, take, replacement)
+        changed = take_ok | replace_ok
+        membs[rows[changed], slots[changed]] = new_clusters[changed]
+
+    membership.replace_row_memberships(memb_rows, membs)
+
+
+def update_for_rows_reference(membership, rd_scores, multiprocessing):
+    """row-by-row formulation of update_for_rows(), which draws the same
+    changes from the random generator"""
+    best_clusters = get_best_clusters(rd_scores, membership.num_clusters_per_row(), True)
+    changes = draw_changes(membership, membership.probability_seeing_row_change(),
+                           rd_scores.num_rows)
+    __update_for_rows_loop(membership, rd_scores, best_clusters, changes)
+
+
+def __update_for_rows_loop(membership, rd_scores, best_clusters, changes):
+    rownames = rd_scores.row_names
     max_changes = membership.max_changes_per_row()
-    change_prob = membership.probability_seeing_row_change()
 
     for index in xrange(rd_scores.num_rows):
         row = rownames[index]
-        clusters = best_clusters[row]
+        clusters = best_clusters[index]
 
-        if seeing_change(change_prob):
+        if changes[index]:
             for _ in range(max_changes):
                 if len(clusters) > 0:
                     free_slots = membership.free_slots_for_row(row)
@@ -372,18 +696,76 @@ def replace_delta_row_member(membership, row, rm, rd_scores):
 
 
 def update_for_cols(membership, cd_scores, multiprocessing):
-    """updating column memberships according to cd_scores"""
-    global UPDATE_MEMBERSHIP
+    """updating column memberships according to cd_scores. All columns are
+    updated at once, update_for_cols_reference() is the equivalent
+    column-by-column formulation"""
+    best_clusters = get_best_clusters(cd_scores, membership.num_clusters_per_column())
+    changes = draw_changes(membership, membership.probability_seeing_col_change(),
+                           cd_scores.num_rows)
+    if best_clusters.shape[1] != membership.col_membs.shape[1]:
+        # the vectorized form assumes that there is a best cluster for every slot
+        __update_for_cols_loop(membership, cd_scores, best_clusters, changes)
+        return
+    if best_clusters.shape[1] == 0:
+        return
+
+    score_rows = np.flatnonzero(changes)
+    if len(score_rows) == 0:
+        return
+    memb_cols = np.array([membership.colidx[cd_scores.row_names[index]]
+                          for index in score_rows], dtype=np.int64)
+    best = best_clusters[score_rows]
+    membs = membership.col_membs[memb_cols]
+    scores = cd_scores.values[score_rows]
+    cols = np.arange(len(score_rows))
+
+    for _ in range(membership.max_changes_per_col()):
+        # columns with a free slot take the best cluster at that slot,
+        # columns allow multiple assignments of the same cluster
+        free = membs == 0
+        has_free = free.any(axis=1)
+        first_free = free.argmax(axis=1)
+        take = best[cols, first_free]
+
+        # full columns first replace the first slot of a cluster that is
+        # assigned more than once with the best cluster at that slot
+        keys = cols[:, np.newaxis] * (membs.max() + 1) + membs
+        multiple = np.bincount(keys.ravel())[keys] > 1
+        has_multiple = multiple.any(axis=1)
+        first_multiple = multiple.argmax(axis=1)
+
+        # otherwise the slot with the largest score gain is replaced
+        deltas = (np.take_along_axis(scores, best - 1, axis=1) -
+                  np.take_along_axis(scores, np.maximum(membs, 1) - 1, axis=1))
+        has_delta = (deltas != 0.0).any(axis=1)
+        maxidx = deltas.argmax(axis=1)
+
+        slots = np.where(has_free, first_free,
+                         np.where(has_multiple, first_multiple, maxidx))
+        changed = has_free | has_multiple | has_delta
+        new_clusters = np.where(has_free, take, best[cols, slots])
+        membs[cols[changed], slots[changed]] = new_clusters[changed]
+
+    membership.replace_column_memberships(memb_cols, membs)
+
+
+def update_for_cols_reference(membership, cd_scores, multiprocessing):
+    """column-by-column formulation of update_for_cols(), which draws the
+    same changes from the random generator"""
+    best_clusters = get_best_clusters(cd_scores, membership.num_clusters_per_column())
+    changes = draw_changes(membership, membership.probability_seeing_col_change(),
+                           cd_scores.num_rows)
+    __update_for_cols_loop(membership, cd_scores, best_clusters, changes)
+
 
+def __update_for_cols_loop(membership, cd_scores, best_clusters, changes):
     colnames = cd_scores.row_names
-    best_clusters = get_best_clusters(cd_scores, membership.num_clusters_per_column())
     max_changes = membership.max_changes_per_col()
-    change_prob = membership.probability_seeing_col_change()
 
     for index in xrange(cd_scores.num_rows):
         col = colnames[index]
-        clusters = best_clusters[col]
-        if seeing_change(change_prob):
+        clusters = best_clusters[index]
+        if changes[index]:
             for c in range(max_changes):
                 if len(clusters) > 0:
                     free_slots = membership.free_slots_for_column(col)
@@ -428,54 +810,69 @@ def replace_delta_column_member(membership, col, cm, cd_scores):
         membership.replace_column_cluster(col, maxidx, cm[maxidx])
 
 
-def postadjust(membership, rowscores, cutoff=0.33, limit=100):
+def postadjust(membership, rowscores, cutoff=0.33, limit=100, config_params=None):
     """adjusting the cluster memberships after the main iterations have been done
-    Returns true if the function changed the membership, false if not"""
-    assign_list = []
-    for cluster in range(1, membership.num_clusters() + 1):
-        assign = adjust_cluster(membership, cluster, rowscores, cutoff, limit)
-        assign_list.append(assign)
+    Returns true if the function changed the membership, false if not.
+    The clusters are adjusted on the run's worker pool if config_params
+    enable multiprocessing"""
+    start_time = util.current_millis()
+    assign_list = util.pool_map(config_params if config_params is not None else {},
+                                compute_cluster_adjustment,
+                                [(cluster, cutoff, limit)
+                                 for cluster in range(1, membership.num_clusters() + 1)],
+                                state={'membership': membership, 'rowscores': rowscores,
+                                       'row_name_ranks': name_ranks(rowscores.row_names)})
 
     for assign in assign_list:
         for row, cluster in assign.items():
             membership.add_cluster_to_row(row, cluster, force=True)
-
-
-def adjust_cluster(membership, cluster, rowscores, cutoff, limit):
-    """adjust a single cluster"""
-    def max_row_in_column(matrix, column):
-        """returns a pair of the maximum row index and score in the given matrix and column"""
-        sm = matrix.submatrix_by_name(wh, [matrix.column_names[column]])
-        sm_values = sm.values
-        max_row = 0
-        max_score = -sys.float_info.max
-        for row in range(sm.num_rows):
-            if sm_values[row][0] > max_score:
-                max_score = sm_values[row, 0]
-                max_row = row
-        return sm.row_names[max_row]
-
-    old_rows = membership.rows_for_cluster(cluster)
-    not_in = [(i, row) for i, row in enumerate(rowscores.row_names)
-              if row not in old_rows]
-    threshold = rowscores.submatrix_by_name(old_rows,
-                                            [rowscores.column_names[cluster - 1]]).quantile(cutoff)
-    wh = []
-    rs_values = rowscores.values
-    for row, row_name in not_in:
-        if rs_values[row, cluster - 1] < threshold:
-            wh.append(row_name)
-    if len(wh) == 0 or len(wh) > limit:
+    elapsed = util.current_millis() - start_time
+    logging.debug("postadjust() finished in %f s.", elapsed / 1000.0)
+
+
+def compute_cluster_adjustment(params):
+    """adjust_cluster() for the membership and row scores in the worker state"""
+    cluster, cutoff, limit = params
+    state = util.worker_state()
+    return adjust_cluster(state['membership'], cluster, state['rowscores'], cutoff, limit,
+                          state['row_name_ranks'])
+
+
+def name_ranks(names):
+    """returns the position of each name in the sorted names"""
+    ranks = np.empty(len(names), dtype=np.int64)
+    ranks[np.argsort(names, kind='stable')] = np.arange(len(names))
+    return ranks
+
+
+def adjust_cluster(membership, cluster, rowscores, cutoff, limit, row_name_ranks=None):
+    """adjust a single cluster: the rows outside of the cluster that score
+    below the cutoff quantile of the cluster members are candidates. If
+    there are at most limit candidates, up to MAX_ADJUST_TRIES of them are
+    assigned to the cluster, starting with the largest score.
+    row_name_ranks can be passed as name_ranks(rowscores.row_names) to
+    avoid sorting the names for every cluster.
+    Returns a dictionary row -> cluster in the order of assignment"""
+    scores = rowscores.values[:, cluster - 1]
+    old_rows = rowscores.row_index_array(membership.rows_for_cluster(cluster))
+    in_cluster = np.zeros(rowscores.num_rows, dtype=bool)
+    in_cluster[old_rows] = True
+    threshold = util.quantile(scores[old_rows], cutoff)
+
+    candidates = np.flatnonzero(~in_cluster & (scores < threshold))
+    if len(candidates) == 0 or len(candidates) > limit:
         return {}  # return unmodified row membership
 
-    tries = 0
-    result = {}
-    while len(wh) > 0 and tries < MAX_ADJUST_TRIES:
-        wh2 = max_row_in_column(rowscores, cluster - 1)
-        result[wh2] = cluster
-        wh.remove(wh2)
-        tries += 1
-    old_num = len(membership.rows_for_cluster(cluster))
+    # candidates are ranked by decreasing score, ties in row name order.
+    # Scores that can not exceed -sys.float_info.max are ranked last
+    if row_name_ranks is None:
+        row_name_ranks = name_ranks(rowscores.row_names)
+    candidate_scores = scores[candidates]
+    keys = np.where(candidate_scores > -sys.float_info.max, -candidate_scores, np.inf)
+    ranked = candidates[np.lexsort((row_name_ranks[candidates], keys))[:MAX_ADJUST_TRIES]]
+    result = {rowscores.row_names[index]: cluster for index in ranked}
+
+    old_num = membership.num_row_members(cluster)
     logging.debug("CLUSTER %d, # ROWS BEFORE: %d, AFTER: %d",
                   cluster, old_num, old_num + len(result))
     return result
@@ -484,23 +881,14 @@ def adjust_cluster(membership, cluster, rowscores, cutoff, limit):
 ### Helpers
 ######################################################################
 
-# Parallelized updating of row and column membership changes
-UPDATE_MEMBERSHIP = None
-
-
-def seeing_change(prob):
-    """returns true if the update is seeing the change"""
-    return prob >= 1.0 or random.uniform(0.0, 1.0) <= prob
-
-
 def get_best_clusters(scores, n, sort=False):
-    """retrieve the n best scored clusters for the given row/column score matrix"""
+    """retrieve the n best scored clusters for the given row/column score matrix.
+    The result is an int array of |rows| x n, where row i contains the
+    cluster numbers for row i of scores"""
+    result = util.order_rows(scores.values, n)
     if sort:
-        return {scores.row_names[row]: sorted(util.rorder(scores.row_values(row), n))
-                for row in xrange(scores.num_rows)}
-    else:
-        return {scores.row_names[row]: util.rorder(scores.row_values(row), n)
-                for row in xrange(scores.num_rows)}
+        result.sort(axis=1)
+    return result
 
 
 def get_row_density_scores(membership, row_scores):
@@ -515,12 +903,15 @@ def get_row_density_scores(membership, row_scores):
     rds_values = rd_scores.values
 
     start_time = util.current_millis()
-    for cluster in xrange(1, num_clusters + 1):
-        # instead of assigning the rr_scores values per row, we can assign to the
-        # transpose and let numpy do the assignment
-        rds_values.T[cluster - 1] = get_rr_scores(membership, row_scores,
-                                                  rowscore_bandwidth,
-                                                  cluster)
+    if stats.use_r():
+        for cluster in xrange(1, num_clusters + 1):
+            # instead of assigning the rr_scores values per row, we can assign to the
+            # transpose and let numpy do the assignment
+            rds_values.T[cluster - 1] = get_rr_scores(membership, row_scores,
+                                                      rowscore_bandwidth,
+                                                      cluster)
+    else:
+        rds_values[:, :] = get_all_rr_scores(membership, row_scores, rowscore_bandwidth)
 
     elapsed = util.current_millis() - start_time
     logging.debug("RR_SCORES IN %f s.", elapsed / 1000.0)
@@ -538,12 +929,15 @@ def get_col_density_scores(membership, col_scores):
     cds_values = cd_scores.values
 
     start_time = util.current_millis()
-    for cluster in xrange(1, num_clusters + 1):
-        # instead of assigning the cc_scores values per row, we can assign to the
-        # transpose and let numpy do the assignment
-        cds_values.T[cluster - 1] = get_cc_scores(membership, col_scores,
-                                                  colscore_bandwidth,
-                                                  cluster)
+    if stats.use_r():
+        for cluster in xrange(1, num_clusters + 1):
+            # instead of assigning the cc_scores values per row, we can assign to the
+            # transpose and let numpy do the assignment
+            cds_values.T[cluster - 1] = get_cc_scores(membership, col_scores,
+                                                      colscore_bandwidth,
+                                                      cluster)
+    else:
+        cds_values[:, :] = get_all_cc_scores(membership, col_scores, colscore_bandwidth)
 
     elapsed = util.current_millis() - start_time
     logging.debug("CC_SCORES IN %f s.", elapsed / 1000.0)
@@ -574,8 +968,8 @@ def get_rr_scores(membership, rowscores, bandwidth, cluster):
         score_indexes = rowscores.row_indexes_for(cluster_rows)
         cluster_scores = [kscores[index] for index in score_indexes]
         cluster_bandwidth = bandwidth * bwscale(len(cluster_rows))
-        return util.density(kscores, cluster_scores, cluster_bandwidth,
-                            np.amin(kscores_finite) - 1,
+        return stats.density(kscores, cluster_scores, cluster_bandwidth,
+                             np.amin(kscores_finite) - 1,
                             np.amax(kscores_finite) + 1)
 
 
@@ -595,53 +989,84 @@ def get_cc_scores(membership, scores, bandwidth, cluster):
     else:
         score_indexes = scores.row_indexes_for(cluster_columns)
         cluster_scores = [kscores[index] for index in score_indexes]
-        return util.density(kscores, cluster_scores, bandwidth,
-                            np.amin(kscores_finite) - 1,
-                            np.amax(kscores_finite) + 1)
+        return stats.density(kscores, cluster_scores, bandwidth,
+                             np.amin(kscores_finite) - 1,
+                             np.amax(kscores_finite) + 1)
+
+
+def get_all_rr_scores(membership, rowscores, bandwidth):
+    """calculate the density scores of all clusters in one call, this
+    computes the same values as get_rr_scores() for each cluster"""
+    num_clusters = membership.num_clusters()
+    members = __aligned_indicator(membership.row_indicator(dense=True), membership.rowidx,
+                                  rowscores.row_names)
+    has_columns = membership.col_indicator(dense=True).any(axis=0)
+    cluster_sizes = members.sum(axis=0)
+    bandwidths = bandwidth * np.exp(-cluster_sizes / 10.0) * 10.0
+    return __density_scores(rowscores.values, members, has_columns, bandwidths)
+
+
+def get_all_cc_scores(membership, scores, bandwidth):
+    """calculate the column density scores of all clusters in one call,
+    this computes the same values as get_cc_scores() for each cluster"""
+    num_clusters = membership.num_clusters()
+    members = __aligned_indicator(membership.col_indicator(dense=True), membership.colidx,
+                                  scores.row_names)
+    has_rows = membership.row_indicator(dense=True).any(axis=0)
+    has_columns = members.sum(axis=0) > 1
+    bandwidths = np.repeat(bandwidth, num_clusters)
+    return __density_scores(scores.values, members, has_rows & has_columns, bandwidths)
+
+
+def aligned_row_indicator(membership, row_names):
+    """the dense row membership indicator of membership with its rows in the
+    order of row_names"""
+    return __aligned_indicator(membership.row_indicator(dense=True), membership.rowidx,
+                               row_names)
+
+
+def __aligned_indicator(indicator, name_indexes, names):
+    """membership indicator with its rows in the order of names"""
+    indexes = np.array([name_indexes[name] for name in names], dtype=np.intp)
+    if np.array_equal(indexes, np.arange(len(indexes))):
+        return indicator
+    return indicator[indexes]
+
+
+def __density_scores(values, members, has_members, bandwidths):
+    """density scores for the score matrix values (items x clusters),
+    clusters that have no members or scores get a uniform score"""
+    finite = np.isfinite(values)
+    scored = has_members & members.any(axis=0) & finite.any(axis=0)
+    result = np.empty(values.shape)
+    result[:, ~scored] = 1.0 / values.shape[0]
+    if scored.any():
+        kvalues = values[:, scored]
+        kfinite = finite[:, scored]
+        dmin = np.where(kfinite, kvalues, np.inf).min(axis=0) - 1
+        dmax = np.where(kfinite, kvalues, -np.inf).max(axis=0) + 1
+        result[:, scored] = util.kde_density(kvalues, kvalues, members[:, scored],
+                                             bandwidths[scored], dmin, dmax)
+    return result
 
 
 def compensate_size(membership, matrix, rd_scores, cd_scores):
-    """size compensation function"""
-    def compensate_dim_size(size, dimsize, clusters_per_dim, num_clusters):
+    """size compensation function, the scores of each cluster are scaled
+    in place by a factor that decreases with the number of its members"""
+    def compensate_dim_size(sizes, dimsize, clusters_per_dim):
         """compensate size for a dimension"""
-        return math.exp(-float(size) / (float(dimsize) *
-                                        float(clusters_per_dim) /
-                                        float(num_clusters)))
-
-    def compensate_row_size(size):
-        """compensation function for row dimension"""
-        return compensate_dim_size(size,
-                                   matrix.num_rows,
-                                   membership.num_clusters_per_row(),
-                                   membership.num_clusters())
-
-    def compensate_column_size(size):
-        """compensation function for column dimension"""
-        return compensate_dim_size(size,
-                                   matrix.num_columns,
-                                   membership.num_clusters_per_column(),
-                                   membership.num_clusters())
-
-    def compensate_rows(cluster):
-        """compensate density scores for row dimension"""
-        num_rowmembers = membership.num_row_members(cluster)
-        rd_scores.multiply_column_by(
-            cluster - 1,
-            compensate_row_size(max(num_rowmembers,
-                                    membership.min_cluster_rows_allowed())))
-
-    def compensate_columns(cluster):
-        """compensate density scores for column dimension"""
-        num_colmembers = membership.num_column_members(cluster)
-        cd_scores.multiply_column_by(
-            cluster - 1,
-            compensate_column_size(max(num_colmembers,
-                                       matrix.num_columns / 10.0)))
+        return np.exp(-sizes / (float(dimsize) * float(clusters_per_dim) /
+                                float(num_clusters)))
 
     num_clusters = membership.num_clusters()
-    for cluster in xrange(1, num_clusters + 1):
-        compensate_rows(cluster)
-        compensate_columns(cluster)
+    row_sizes = np.maximum(cluster_sizes(membership.row_membs, num_clusters),
+                           membership.min_cluster_rows_allowed())
+    col_sizes = np.maximum(cluster_sizes(membership.col_membs, num_clusters),
+                           matrix.num_columns / 10.0)
+    rd_scores.values *= compensate_dim_size(
+        row_sizes, matrix.num_rows, membership.num_clusters_per_row())
+    cd_scores.values *= compensate_dim_size(
+        col_sizes, matrix.num_columns, membership.num_clusters_per_column())
 
 
 def std_fuzzy_coefficient(iteration, num_iterations):
@@ -655,22 +1080,21 @@ def old_fuzzy_coefficient(iteration, num_iterations):
     return 0.75 * math.exp(-iteration/(num_iterations/4.0))
 
 
-def make_kmeans_row_seeder(num_clusters):
-    """creates a row seeding function based on k-means"""
+def make_kmeans_row_seeder(num_clusters, config_params=None):
+    """creates a row seeding function based on k-means, the random seed and
+    the multiprocessing settings are taken from config_params"""
+    if config_params is None:
+        config_params = {}
 
     def seed(row_membership, matrix):
         """uses k-means seeding to seed row membership"""
-        flat_values = matrix.values.flatten()
-        flat_values[np.isnan(flat_values)] = 0.0
-        flat_values[np.isinf(flat_values)] = 0.0
-        flat_values[np.isneginf(flat_values)] = 0.0
-        matrix_values = robjects.r.matrix(
-            robjects.FloatVector(flat_values), nrow=matrix.num_rows, byrow=True)
-        kmeans = robjects.r['kmeans']
-        kwargs = {'centers': num_clusters, 'iter.max': 20, 'nstart': 2}
-        seeding = kmeans(matrix_values, **kwargs)[0]
-        for row in xrange(len(seeding)):
-            row_membership[row][0] = seeding[row]
+        values = np.where(np.isfinite(matrix.values), matrix.values, 0.0)
+        start_time = util.current_millis()
+        clusters = stats.kmeans(values, num_clusters, random_seed=config_params.get('random_seed'),
+                                config_params=config_params)
+        logging.debug("k-means seeding in %f s.", (util.current_millis() - start_time) / 1000.0)
+        for row in xrange(len(clusters)):
+            row_membership[row][0] = int(clusters[row]) + 1
 
     return seed
 
@@ -777,9 +1201,29 @@ def make_db_column_seeder(session):
         return result
     return seed
 
+def __fuzz_values(membership, values, members, fuzzy_coeff, use_r_rng):
+    """normally distributed noise in the shape of values with the standard
+    deviation of the member values scaled by fuzzy_coeff.
+    Note: If there are less than 2 non-NaN member values, the noise is NaN"""
+    # the member values in cluster order, which is the order R sees them in
+    member_values = values.T[members.T]
+    if use_r_rng:
+        noise = stats.sd_rnorm(member_values, values.size, fuzzy_coeff)
+        return np.array(noise).reshape(values.shape)
+
+    member_values = member_values[~np.isnan(member_values)]
+    if len(member_values) < 2:
+        return np.full(values.shape, np.nan)
+    sd = np.std(member_values, ddof=1) * fuzzy_coeff
+    return membership.random_generator().normal(0.0, sd, size=values.shape)
+
+
 def fuzzify(membership, row_scores, column_scores, num_iterations, iteration_result,
-            add_fuzz):
-    """Provide an iteration-specific fuzzification"""
+            add_fuzz, use_r_rng=False):
+    """Provide an iteration-specific fuzzification.
+    The noise is drawn from the membership's NumPy random generator, or
+    from the stats backend's random stream (R's with the 'r' backend) if
+    use_r_rng is True"""
     if add_fuzz == 'none':
         logging.debug('DO NOT FUZZIFY !!')
         return row_scores, column_scores
@@ -795,41 +1239,16 @@ def fuzzify(membership, row_scores, column_scores, num_iterations, iteration_res
     iteration_result['fuzzy-coeff'] = fuzzy_coeff
 
     if fuzz_rows:
-        num_row_fuzzy_values = row_scores.num_rows * row_scores.num_columns
-        row_score_values = row_scores.values
-        row_sd_values = []
-
-        # iterate the row names directly
-        row_names = row_scores.row_names
-        for col in xrange(row_scores.num_columns):
-            cluster_rows = membership.rows_for_cluster(col + 1)
-            for row in xrange(row_scores.num_rows):
-                if row_names[row] in cluster_rows:
-                    row_sd_values.append(row_score_values[row, col])
-
-        # Note: If there are no non-NaN values in row_sd_values, row_rnorm
-        # will have all NaNs
-        row_rnorm = util.sd_rnorm(row_sd_values, num_row_fuzzy_values, fuzzy_coeff)
-        row_score_values += np.array(row_rnorm).reshape(row_scores.num_rows,
-                                                        row_scores.num_columns)
+        members = __aligned_indicator(membership.row_indicator(dense=True),
+                                      membership.rowidx, row_scores.row_names)
+        row_scores.values += __fuzz_values(membership, row_scores.values, members,
+                                           fuzzy_coeff, use_r_rng)
 
     if fuzz_cols:
-        num_col_fuzzy_values = column_scores.num_rows * column_scores.num_columns
-        col_score_values = column_scores.values
-        col_sd_values = []
-        row_names = column_scores.row_names
-        for col in xrange(column_scores.num_columns):
-            cluster_cols = membership.columns_for_cluster(col + 1)
-            for row in xrange(column_scores.num_rows):
-                if row_names[row] in cluster_cols:
-                    col_sd_values.append(col_score_values[row, col])
-
-        # Note: If there are no non-NaN values in col_sd_values, col_rnorm
-        # will have all NaNs
-        col_rnorm = util.sd_rnorm(col_sd_values, num_col_fuzzy_values, fuzzy_coeff)
-        # add fuzzy values to the row/column scores
-        col_score_values += np.array(col_rnorm).reshape(column_scores.num_rows,
-                                                        column_scores.num_columns)
+        members = __aligned_indicator(membership.col_indicator(dense=True),
+                                      membership.colidx, column_scores.row_names)
+        column_scores.values += __fuzz_values(membership, column_scores.values, members,
+                                              fuzzy_coeff, use_r_rng)
 
     #elapsed = util.current_millis() - start_time
     #logging.debug("fuzzify() finished in %f s.", elapsed / 1000.0)
@@ -13,6 +13,7 @@ import os
 import shutil
 import re
 import collections
+import json
 import xml.etree.ElementTree as ET
 from pkg_resources import Requirement, resource_filename, DistributionNotFound
 import multiprocessing
@@ -442,15 +443,55 @@ def is_meme_version_supported(version):
             return False
     return True
 
-def check_meme_version():
+# the detected MEME version is stored in this file in the cache directory
+MEME_VERSION_CACHE_FILE = 'meme_version.json'
+
+
+def check_meme_version(cache_dir=None):
+    """returns the version of the meme in the PATH or None if there is none.
+    Running meme takes a while, so the version is cached in cache_dir
+    together with the path and modification time of the meme binary and
+    meme only runs again after it changed"""
     logging.info('checking MEME...')
+    meme_path = shutil.which('meme')
+    if meme_path is None:
+        logging.error("MEME does not exist in your PATH, please either install or check your PATH variable")
+        return None
+    meme_path = os.path.realpath(meme_path)
+    meme_key = {'path': meme_path, 'mtime': os.path.getmtime(meme_path)}
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, MEME_VERSION_CACHE_FILE)
+        try:
+            with open(cache_path) as infile:
+                cached = json.load(infile)
+            if {key: cached.get(key) for key in meme_key} == meme_key:
+                return cached['version']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    version = run_meme_version(meme_path)
+    if cache_path is not None and version is not None:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(cache_path, 'w') as outfile:
+                json.dump(dict(meme_key, version=version), outfile)
+        except OSError:
+            logging.warn("could not cache the MEME version in '%s'", cache_path)
+    return version
+
+
+def run_meme_version(meme_path='meme'):
+    """runs meme on a test file and returns the version it reports"""
     try:
         test_fasta = resource_filename(Requirement.parse("cmonkey2"), USER_TEST_FASTA_PATH)
     except DistributionNotFound:
         test_fasta = USER_TEST_FASTA_PATH
 
     try:
-        command = ['meme', '-nostatus', '-text', test_fasta]
+        command = [meme_path, '-nostatus', '-text', test_fasta]
         output = subprocess.check_output(command).decode('utf-8').split('\n')
         for line in output:
             if line.startswith('MEME version'):
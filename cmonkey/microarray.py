@@ -7,9 +7,12 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import numpy as np
+import scipy.sparse
 import logging
 import cmonkey.datamatrix as dm
 import cmonkey.util as util
+import cmonkey.stats as stats
+import cmonkey.membership as memb
 import cmonkey.scoring as scoring
 
 try:
@@ -17,12 +20,60 @@ try:
 except NameError:
     xrange = range
 
+# RowScoringFunction recomputes its statistics every this many computations
+DEFAULT_FULL_RECOMPUTE_INTERVAL = 10
+
+# rounding error of the expanded sums of squared deviations, relative to the
+# gene's sum of squared values and the cluster's sum of squared column means
+CANCELLATION_EPS = 1e-12
+
 
 def seed_column_members(data_matrix, row_membership, num_clusters,
                         num_clusters_per_column):
     """Default column membership seeder ('best')
     In case of multiple input ratio matrices, we assume that these
-    matrices have been combined into data_matrix"""
+    matrices have been combined into data_matrix.
+    The column scores of all seeded clusters (the first slot of each row)
+    are computed at once, and each column picks the clusters with the
+    lowest scores, with ties in cluster order and empty clusters last.
+    seed_column_members_reference() is the per-cluster formulation"""
+    start_time = util.current_millis()
+    cscores = seed_column_scores(data_matrix,
+                                 np.array([members[0] for members in row_membership]),
+                                 num_clusters)
+    order = np.argsort(cscores, axis=1, kind='stable')[:, :num_clusters_per_column]
+    column_members = (order + 1).tolist()
+    logging.debug("seed column members in %f s.",
+                  (util.current_millis() - start_time) / 1000.0)
+    return column_members
+
+
+def seed_column_scores(data_matrix, row_clusters, num_clusters):
+    """the column scores of compute_column_scores_submatrix() for the rows
+    of each of the clusters 1..num_clusters, row_clusters holds the cluster
+    of each row, 0 for none. Returns a (columns x clusters) array that is
+    NaN for clusters without values in a column"""
+    values = data_matrix.values
+    missing = np.isnan(values)
+    member = row_clusters > 0
+    indicator = scipy.sparse.csr_matrix(
+        (np.ones(np.count_nonzero(member)),
+         (row_clusters[member] - 1, np.nonzero(member)[0])),
+        shape=(num_clusters, data_matrix.num_rows))
+    counts = indicator.dot((~missing).astype(np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        colmeans = indicator.dot(np.where(missing, 0.0, values)) / counts
+        # the squared deviations from the row's cluster column means
+        deviations = np.square(values - colmeans[np.maximum(row_clusters - 1, 0)])
+        deviations[missing | ~member[:, np.newaxis]] = 0.0
+        result = indicator.dot(deviations) / counts / (np.abs(colmeans) + 0.01)
+    return result.T
+
+
+def seed_column_members_reference(data_matrix, row_membership, num_clusters,
+                                  num_clusters_per_column):
+    """the original per-cluster column seeding, kept as a reference for
+    seed_column_members()"""
     num_rows = data_matrix.num_rows
     num_cols = data_matrix.num_columns
     # create a submatrix for each cluster
@@ -37,73 +88,252 @@ def seed_column_members(data_matrix, row_membership, num_clusters,
         _, scores = scoring.compute_column_scores_submatrix(submatrix)
         cscores.T[cluster_num - 1] = -scores
 
-    start_time = util.current_millis()
-    column_members = [util.rorder(cscores[i], num_clusters_per_column)
-                      for i in xrange(num_cols)]
-    elapsed = util.current_millis() - start_time
-    logging.debug("seed column members in %f s.", elapsed % 1000.0)
-    return column_members
+    return [stats.rorder(cscores[i], num_clusters_per_column)
+            for i in xrange(num_cols)]
 
 
 def compute_row_scores(membership, matrix, num_clusters, config_params):
     """for each cluster 1, 2, .. num_clusters compute the row scores
     for the each row name in the input name matrix"""
     start_time = util.current_millis()
-    cluster_row_scores = __compute_row_scores_for_clusters(
-        membership, matrix, num_clusters, config_params)
+    values = compute_row_scores_batched(membership, matrix, num_clusters)
     # TODO: replace the nan/inf-Values with the quantile-thingy in the R-version
 
-    logging.debug("__compute_row_scores_for_clusters() in %f s.",
+    logging.debug("compute_row_scores_batched() in %f s.",
                   (util.current_millis() - start_time) / 1000.0)
+    return dm.DataMatrix(matrix.num_rows, num_clusters,
+                         row_names=matrix.row_names,
+                         values=values)
+
+
+def compute_row_scores_reference(membership, matrix, num_clusters, config_params):
+    """the original per-cluster row scoring, which computes each cluster's
+    scores on its own submatrices. This is kept as a reference for the
+    batched version"""
+    cluster_row_scores = __compute_row_scores_for_clusters(
+        membership, matrix, num_clusters, config_params)
 
     # rearrange result into a DataMatrix, where rows are indexed by gene
     # and columns represent clusters
-    start_time = util.current_millis()
     values = np.zeros((matrix.num_rows, num_clusters))
 
     # note that cluster is 0 based on a matrix
     for cluster in xrange(num_clusters):
         row_scores = cluster_row_scores[cluster]
         values[:, cluster] = row_scores
-    result = dm.DataMatrix(matrix.num_rows, num_clusters,
-                           row_names=matrix.row_names,
-                           values=values)
-    logging.debug("made result matrix in %f s.",
-                  (util.current_millis() - start_time) / 1000.0)
+    return dm.DataMatrix(matrix.num_rows, num_clusters,
+                         row_names=matrix.row_names,
+                         values=values)
+
+
+def compute_row_scores_batched(membership, matrix, num_clusters):
+    """computes the row scores for all clusters in one pass over the matrix.
+
+    With X the ratios matrix, R the gene x cluster membership indicator and
+    C the condition x cluster membership indicator, the per-cluster column
+    means are mu = (R^T X) / (R^T M), where M is the mask of finite values.
+    The squared deviations are then expanded into
+    sum((x - mu)^2) = X^2 C' - 2 X (C' * mu) + M (C' * mu^2)
+    with C' being C restricted to the columns that have a defined mean,
+    so every term is a single matrix product.
+    Returns a numpy array of (num_rows x num_clusters)"""
+    rows = membership.row_indicator(num_clusters=num_clusters)
+    col_ind = membership.col_indicator(dense=True, num_clusters=num_clusters).T
+
+    values = matrix.values
+    finite = np.isfinite(values)
+    xvalues = np.where(finite, values, 0.0)
+    mask = finite.astype(np.float64)
+
+    # per-cluster column means (clusters x columns), over the member rows only
+    col_sums = rows.T.dot(xvalues)
+    col_counts = rows.T.dot(mask)
+    valid = col_ind & (col_counts > 0)
+    mu = np.zeros(col_sums.shape)
+    np.divide(col_sums, col_counts, out=mu, where=valid)
+    cvalid = valid.astype(np.float64)
+
+    sq_xvalues = np.square(xvalues)
+    sq_sums = (np.dot(sq_xvalues, cvalid.T) -
+               2.0 * np.dot(xvalues, (cvalid * mu).T) +
+               np.dot(mask, (cvalid * np.square(mu)).T))
+    counts = np.dot(mask, cvalid.T)
+
+    # clusters without rows or with at most one column are not scored
+    scored = (rows.getnnz(axis=0) > 0) & (col_ind.sum(axis=1) > 1)
+    return row_scores_from_sums(sq_sums, counts, scored,
+                                cancellation_tolerances(sq_xvalues.sum(axis=1), mu))
+
+
+def cancellation_tolerances(sq_gene_sums, mu, out=None):
+    """the rounding errors of the expanded sums of squared deviations (genes x
+    clusters). Each one is bounded by the gene's sum of squared values and
+    the cluster's sum of squared column means, which are the largest terms
+    the sum is computed from, also when it is updated incrementally"""
+    result = np.add.outer(sq_gene_sums, np.square(mu).sum(axis=1), out=out)
+    result *= CANCELLATION_EPS
+    return result
+
+
+def row_scores_from_sums(sq_sums, counts, scored, tolerances, out=None):
+    """the row scores from the sums of squared deviations, their rounding
+    errors and their counts (genes x clusters). sq_sums is overwritten, the
+    scores are written into out if it is given"""
+    # sums within the rounding error of the expanded form are 0, e.g. the
+    # deviations of the only gene of a cluster
+    sq_sums[sq_sums <= tolerances] = 0.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.divide(sq_sums, counts, out=out)
+    result[counts == 0] = np.nan
+    np.clip(result, 1e-20, 1000.0, out=result)
+    result += 1e-99
+    np.log(result, out=result)
+    result[:, ~scored] = np.nan
     return result
 
-ROW_SCORE_MATRIX = None
-ROW_SCORE_MEMBERSHIP = None
+
+class RowScoreStatistics:
+    """Sufficient statistics of the row scores that are kept up to date
+    with the membership changes between two computations.
+
+    With the notation of compute_row_scores_batched(), the statistics are
+    the per-cluster column sums R^T X and counts R^T M, which change with
+    the cluster rows, and the per-gene terms X^2 C', M C', X (C' * mu) and
+    M (C' * mu^2) over the valid cluster columns C'. Row changes are
+    applied to the column sums and counts and the mean-dependent terms of
+    their clusters are recomputed, column changes are added to or
+    subtracted from the per-gene terms. The per-gene terms are stored as
+    clusters x genes, so the terms of a cluster are contiguous"""
+
+    def __init__(self, matrix, num_clusters):
+        finite = np.isfinite(matrix.values)
+        self.num_clusters = num_clusters
+        self.xvalues = np.where(finite, matrix.values, 0.0)
+        self.sq_xvalues = np.square(self.xvalues)
+        self.sq_gene_sums = self.sq_xvalues.sum(axis=1)
+        self.mask = finite.astype(np.float64)
+        # the membership indicators of the last recompute() or update()
+        self.rows = None
+        self.cols = None
+        # per-cluster column sums and counts (clusters x columns) and the
+        # valid cluster columns
+        self.col_sums = None
+        self.col_counts = None
+        self.valid = None
+        # the per-gene terms (clusters x genes)
+        self.sq_sums = None
+        self.counts = None
+        self.cross_sums = None
+        self.mu_sums = None
+        # the expanded sums of squared deviations and their rounding errors
+        # (clusters x genes)
+        self.__sq_deviations = np.empty((num_clusters, matrix.num_rows))
+        self.__tolerances = np.empty((num_clusters, matrix.num_rows))
+
+    def recompute(self, membership):
+        """computes the statistics from scratch"""
+        self.rows = membership.row_indicator(dense=True, num_clusters=self.num_clusters).copy()
+        self.cols = membership.col_indicator(dense=True, num_clusters=self.num_clusters).T.copy()
+        rows = membership.row_indicator(num_clusters=self.num_clusters)
+        self.col_sums = rows.T.dot(self.xvalues)
+        self.col_counts = rows.T.dot(self.mask)
+        self.valid = self.cols & (self.col_counts > 0)
+        cvalid = self.valid.astype(np.float64)
+        mu = self.__means()
+        self.sq_sums = np.dot(cvalid, self.sq_xvalues.T)
+        self.counts = np.dot(cvalid, self.mask.T)
+        self.cross_sums = np.dot(cvalid * mu, self.xvalues.T)
+        self.mu_sums = np.dot(cvalid * np.square(mu), self.mask.T)
+
+    def update(self, membership):
+        """applies the membership changes since the last recompute() or
+        update() to the statistics"""
+        new_rows = membership.row_indicator(dense=True, num_clusters=self.num_clusters)
+        new_cols = membership.col_indicator(dense=True, num_clusters=self.num_clusters).T
+
+        # cluster rows: column sums and counts change by the added and
+        # removed genes' values
+        genes, clusters = np.nonzero(new_rows != self.rows)
+        if len(genes) > 0:
+            signs = np.where(new_rows[genes, clusters], 1.0, -1.0)
+            delta = scipy.sparse.csr_matrix((signs, (clusters, genes)),
+                                            shape=(self.num_clusters, len(self.rows)))
+            self.col_sums += delta.dot(self.xvalues)
+            self.col_counts += delta.dot(self.mask)
+            self.rows[genes, clusters] = new_rows[genes, clusters]
+        changed_means = np.unique(clusters)
+        self.cols[...] = new_cols
+        mu = self.__means()
+
+        # valid cluster columns: the per-gene terms change by the added
+        # and removed columns. The mean-dependent terms of clusters with
+        # row changes are recomputed below
+        new_valid = new_cols & (self.col_counts > 0)
+        clusters, columns = np.nonzero(new_valid != self.valid)
+        if len(clusters) > 0:
+            signs = np.where(new_valid[clusters, columns], 1.0, -1.0)
+            self.sq_sums += self.__column_delta(signs, clusters, columns, self.sq_xvalues)
+            self.counts += self.__column_delta(signs, clusters, columns, self.mask)
+
+            same_means = ~np.isin(clusters, changed_means)
+            clusters, columns, signs = (clusters[same_means], columns[same_means],
+                                        signs[same_means])
+            means = mu[clusters, columns]
+            self.cross_sums += self.__column_delta(signs * means, clusters, columns,
+                                                   self.xvalues)
+            self.mu_sums += self.__column_delta(signs * np.square(means), clusters, columns,
+                                                self.mask)
+        self.valid = new_valid
+
+        if len(changed_means) > 0:
+            cvalid = self.valid[changed_means].astype(np.float64)
+            cmu = cvalid * mu[changed_means]
+            self.cross_sums[changed_means] = np.dot(cmu, self.xvalues.T)
+            self.mu_sums[changed_means] = np.dot(cmu * mu[changed_means], self.mask.T)
+
+    def __column_delta(self, weights, clusters, columns, values):
+        """the change of the per-gene sums of values (clusters x genes) when
+        the cluster columns are added with the given weights"""
+        delta = scipy.sparse.csr_matrix((weights, (clusters, columns)),
+                                        shape=(self.num_clusters, values.shape[1]))
+        return delta.dot(values.T)
+
+    def __means(self):
+        """the cluster column means, 0 for columns without member values"""
+        mu = np.zeros(self.col_sums.shape)
+        np.divide(self.col_sums, self.col_counts, out=mu, where=self.col_counts > 0)
+        return mu
+
+    def row_scores(self, out=None):
+        """returns the row scores (genes x clusters) of the statistics, which
+        are written into out if it is given"""
+        sq_sums = self.__sq_deviations
+        np.multiply(self.cross_sums, -2.0, out=sq_sums)
+        sq_sums += self.sq_sums
+        sq_sums += self.mu_sums
+        scored = self.rows.any(axis=0) & (self.cols.sum(axis=1) > 1)
+        tolerances = cancellation_tolerances(self.sq_gene_sums,
+                                             np.where(self.valid, self.__means(), 0.0),
+                                             out=self.__tolerances.T)
+        return row_scores_from_sums(sq_sums.T, self.counts.T, scored, tolerances, out)
 
 
 def __compute_row_scores_for_clusters(membership, matrix, num_clusters,
                                       config_params):
     """compute the pure row scores for the specified clusters
     without nowmalization"""
-    # note that we set the data into globals before we fork it off
-    # to save memory and pickling time
-    global ROW_SCORE_MATRIX, ROW_SCORE_MEMBERSHIP
-    ROW_SCORE_MATRIX = matrix
-    ROW_SCORE_MEMBERSHIP = membership
-
-    if config_params['multiprocessing']:
-        with util.get_mp_pool(config_params) as pool:
-            result = pool.map(compute_row_scores_for_cluster, xrange(1, num_clusters + 1))
-    else:
-        result = []
-        for cluster in range(1, num_clusters + 1):
-            result.append(compute_row_scores_for_cluster(cluster))
-    # cleanup
-    ROW_SCORE_MATRIX = None
-    ROW_SCORE_MEMBERSHIP = None
-    return result
+    # the matrix is readonly, so the workers only receive it once per run
+    return util.pool_map(config_params, compute_row_scores_for_cluster,
+                         xrange(1, num_clusters + 1),
+                         state={'membership': membership},
+                         readonly={'ratios': matrix})
 
 
 def compute_row_scores_for_cluster(cluster):
     """This function computes the row score for a cluster"""
-    global ROW_SCORE_MATRIX, ROW_SCORE_MEMBERSHIP
-    membership = ROW_SCORE_MEMBERSHIP
-    matrix = ROW_SCORE_MATRIX
+    state = util.worker_state()
+    membership = state['membership']
+    matrix = state['ratios']
 
     rnames = membership.rows_for_cluster(cluster)
     cnames = membership.columns_for_cluster(cluster)
@@ -140,16 +370,38 @@ class RowScoringFunction(scoring.ScoringFunctionBase):
         scoring.ScoringFunctionBase.__init__(self, function_id, cmrun)
         self.run_log = scoring.RunLog(function_id, cmrun.dbsession(),
                                       cmrun.config_params)
+        # the statistics are updated with the membership changes and
+        # recomputed every full_recompute_interval computations to bound
+        # the accumulated rounding errors
+        self.__statistics = None
+        self.__num_updates = 0
+
+    def full_recompute_interval(self):
+        """returns the number of computations between two recomputations of
+        the row score statistics, 1 recomputes them every time"""
+        settings = self.config_params.get(self.id, {})
+        return int(settings.get('full_recompute_interval', DEFAULT_FULL_RECOMPUTE_INTERVAL))
 
     def do_compute(self, iteration_result, ref_matrix=None):
         """the row scoring function"""
-        return compute_row_scores(self.membership,
-                                  self.ratios,
-                                  self.num_clusters(),
-                                  self.config_params)
+        start_time = util.current_millis()
+        if self.__statistics is None:
+            self.__statistics = RowScoreStatistics(self.ratios, self.num_clusters())
+        if (self.__statistics.rows is None or
+            self.__num_updates + 1 >= self.full_recompute_interval()):
+            self.__statistics.recompute(self.membership)
+            self.__num_updates = 0
+        else:
+            self.__statistics.update(self.membership)
+            self.__num_updates += 1
+        result = self.result_matrix(fill_value=None)
+        self.__statistics.row_scores(out=result.values)
+        logging.debug("row scores from statistics in %f s.",
+                      (util.current_millis() - start_time) / 1000.0)
+        return result
 
     def run_logs(self):
         """return the run logs"""
         return [self.run_log]
 
-__all__ = ['compute_row_scores', 'seed_column_members']
+__all__ = ['compute_row_scores', 'compute_row_scores_batched', 'seed_column_members']
@@ -16,6 +16,8 @@ import subprocess
 
 import cmonkey.scoring as scoring
 import cmonkey.datamatrix as dm
+import cmonkey.membership as memb
+import cmonkey.cluster_stats as cluster_stats
 import cmonkey.weeder as weeder
 import cmonkey.meme_suite as meme
 import cmonkey.seqtools as st
@@ -57,54 +59,60 @@ def unique_filter(seqs, feature_ids):
     return unique_seqs
 
 
-def get_remove_low_complexity_filter(meme_suite):
-    """Factory method that returns a low complexity filter"""
-    def remove_low_complexity(seqs, feature_ids):
-        """low-complexity filter that depends on meme"""
-        return meme_suite.remove_low_complexity(seqs)
-    return remove_low_complexity
+class RemoveLowComplexityFilter:
+    """low-complexity filter that depends on meme. This is a class rather than
+    a closure, so it can be sent to the worker processes"""
+
+    def __init__(self, meme_suite):
+        self.meme_suite = meme_suite
 
+    def __call__(self, seqs, feature_ids):
+        return self.meme_suite.remove_low_complexity(seqs)
 
-def get_remove_atgs_filter(distance):
-    """returns a remove ATG filter"""
-    def remove_atgs_filter(seqs, feature_ids):
-        """a filter removes the ATG's from the sequence, this
-        just masks a window of 4 letters with N's"""
+
+class RemoveATGsFilter:
+    """a filter removes the ATG's from the sequence, this
+    just masks a window of 4 letters with N's"""
+
+    def __init__(self, distance):
+        self.distance = distance
+
+    def __call__(self, seqs, feature_ids):
         for feature_id in seqs:
             chars = [c for c in seqs[feature_id]]
-            chars[distance[1]:distance[1] + 4] = "NNNN"
+            chars[self.distance[1]:self.distance[1] + 4] = "NNNN"
             seqs[feature_id] = "".join(chars)
         return seqs
-    return remove_atgs_filter
+
+
+def get_remove_low_complexity_filter(meme_suite):
+    """Factory method that returns a low complexity filter"""
+    return RemoveLowComplexityFilter(meme_suite)
+
+
+def get_remove_atgs_filter(distance):
+    """returns a remove ATG filter"""
+    return RemoveATGsFilter(distance)
 
 
 def compute_mean_score(pvalue_matrix, membership, organism):
     """cluster-specific mean scores"""
     if pvalue_matrix is None:
         return 0.0
-    values = []
-    pvalues = pvalue_matrix.values
-    for cluster in xrange(1, membership.num_clusters() + 1):
-        cluster_rows = membership.rows_for_cluster(cluster)
-        row_indexes = pvalue_matrix.row_indexes_for(cluster_rows)
-        values.extend(pvalues[row_indexes, cluster - 1])
+    values = cluster_stats.member_values(
+        pvalue_matrix.values, memb.aligned_row_indicator(membership, pvalue_matrix.row_names))
     return np.mean(values)  # median can result in 0 if there are a lot of 0
 
-# Readonly structure to avoid passing it to the forked child processes for efficiency.
-# non-serializable parameters go here, too
-SEQUENCE_FILTERS = None
-ORGANISM = None
-MEMBERSIP = None
-
-
-def pvalues2matrix(all_pvalues, num_clusters, gene_names, reverse_map):
-    """converts a map from {cluster: {feature: pvalue}} to a scoring matrix
+def pvalues2matrix(all_pvalues, num_clusters, gene_names, reverse_map, matrix=None):
+    """converts a map from {cluster: {feature: pvalue}} to a scoring matrix,
+    which is written into matrix if it is given. Its values must be 0
     """
     row_map = {gene: index for index, gene in enumerate(gene_names)}
 
     # convert remapped to an actual scoring matrix
-    matrix = dm.DataMatrix(len(gene_names), num_clusters,
-                           gene_names)
+    if matrix is None:
+        matrix = dm.DataMatrix(len(gene_names), num_clusters,
+                               gene_names)
     mvalues = matrix.values
     for cluster, feature_pvals in all_pvalues.items():
         for feature_id, pval in feature_pvals.items():
@@ -261,7 +269,8 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
             logging.debug("UPDATING MOTIF SCORES in iteration %d with scaling: %f",
                           iteration, self.scaling(iteration))
             self.last_result = pvalues2matrix(self.all_pvalues, self.num_clusters(),
-                                              self.gene_names(), self.reverse_map)
+                                              self.gene_names(), self.reverse_map,
+                                              self.result_matrix())
 
         self.update_log.log(iteration, self.run_in_iteration(iteration),
                             self.scaling(iteration))
@@ -296,8 +305,6 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
         (seqs, feature_ids, distance) -> seqs
         These filters are applied in the order they appear in the list.
         """
-        global SEQUENCE_FILTERS, ORGANISM, MEMBERSHIP
-
         cluster_pvalues = {}
         min_cluster_rows_allowed = self.config_params['memb.min_cluster_rows_allowed']
         max_cluster_rows_allowed = self.config_params['memb.max_cluster_rows_allowed']
@@ -305,21 +312,19 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
                                not self.config_params['MEME'][scoring.KEY_MULTIPROCESSING])
 
         # extract the sequences for each cluster, slow
+        # The membership changes in place between iterations, so it is sent
+        # with every call, the organism only when it changes
         start_time = util.current_millis()
-        SEQUENCE_FILTERS = self.__sequence_filters
-        ORGANISM = self.organism
-        MEMBERSHIP = self.membership
-
-        cluster_seqs_params = [(cluster, self.seqtype) for cluster in xrange(1, self.num_clusters() + 1)]
-        if use_multiprocessing:
-            with util.get_mp_pool(self.config_params) as pool:
-                seqs_list = pool.map(cluster_seqs, cluster_seqs_params)
-        else:
-            seqs_list = [cluster_seqs(p) for p in cluster_seqs_params]
+        cluster_seqs_params = list(xrange(1, self.num_clusters() + 1))
+        seqs_list = util.pool_map({scoring.KEY_MULTIPROCESSING: use_multiprocessing,
+                                   'num_cores': self.config_params['num_cores']},
+                                  cluster_seqs, cluster_seqs_params,
+                                  readonly={'organism': self.organism,
+                                            'sequence_filters:' + self.seqtype:
+                                            self.__sequence_filters},
+                                  state={'membership': self.membership,
+                                         'seqtype': self.seqtype})
 
-        SEQUENCE_FILTERS = None
-        ORGANISM = None
-        MEMBERSHIP = None
         logging.debug("prepared sequences in %d ms.", util.current_millis() - start_time)
 
         # Make the parameters, this is fast enough
@@ -410,13 +415,13 @@ class MotifScoringFunctionBase(scoring.ScoringFunctionBase):
 
 def cluster_seqs(params):
     """Retrieves the sequences for a cluster. Designed to run in in pool.map()"""
-    global SEQUENCE_FILTERS, ORGANISM, MEMBERSHIP
-    cluster, seqtype = params
-    genes = sorted(MEMBERSHIP.rows_for_cluster(cluster))
-    feature_ids = ORGANISM.feature_ids_for(genes)
-    seqs = ORGANISM.sequences_for_genes_search(
-        feature_ids, seqtype=seqtype)
-    for sequence_filter in SEQUENCE_FILTERS:
+    state = util.worker_state()
+    cluster = params
+    genes = sorted(state['membership'].rows_for_cluster(cluster))
+    feature_ids = state['organism'].feature_ids_for(genes)
+    seqs = state['organism'].sequences_for_genes_search(feature_ids,
+                                                        seqtype=state['seqtype'])
+    for sequence_filter in state['sequence_filters:' + state['seqtype']]:
         seqs = sequence_filter(seqs, feature_ids)
     if len(seqs) == 0:
         logging.warn('Cluster %i with %i genes: no sequences!',
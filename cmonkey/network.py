@@ -9,7 +9,6 @@ import logging
 import os.path
 
 import cmonkey.util as util
-import cmonkey.datamatrix as dm
 import cmonkey.scoring as scoring
 
 # Python2/Python3 compatibility
@@ -152,17 +151,13 @@ class Network:
         return Network(name, network_edges, weight, 0)
 
 
-COMPUTE_NETWORK = None
-ALL_GENES = None
-NETWORK_SCORE_MEMBERSHIP = None
-
-
 def compute_network_scores(cluster):
     """Generic method to compute network scores"""
-    global COMPUTE_NETWORK, ALL_GENES, NETWORK_SCORE_MEMBERSHIP
-    network = COMPUTE_NETWORK
+    state = util.worker_state()
+    network = state['network:' + state['network_name']]
+    all_genes = state['all_genes']
 
-    genes = sorted(NETWORK_SCORE_MEMBERSHIP.rows_for_cluster(cluster))
+    genes = sorted(state['membership'].rows_for_cluster(cluster))
     gene_scores = {}
 
     for gene in genes:
@@ -173,7 +168,7 @@ def compute_network_scores(cluster):
             other_gene = edge[0]
             if other_gene == gene:
                 other_gene = edge[1]
-            if other_gene in ALL_GENES:
+            if other_gene in all_genes:
                 if other_gene not in gene_scores:
                     gene_scores[other_gene] = []
                 gene_scores[other_gene].append(edge[2])
@@ -196,6 +191,7 @@ class ScoringFunction(scoring.ScoringFunctionBase):
         """Create scoring function instance"""
         scoring.ScoringFunctionBase.__init__(self, function_id, cmrun)
         self.__networks = None
+        self.__all_genes = None
         self.run_log = scoring.RunLog(function_id, cmrun.dbsession(),
                                       self.config_params)
 
@@ -246,8 +242,7 @@ class ScoringFunction(scoring.ScoringFunctionBase):
     def do_compute(self, iteration_result, ref_matrix=None):
         """compute method, iteration is the 0-based iteration number"""
 
-        matrix = dm.DataMatrix(len(self.gene_names()), self.num_clusters(),
-                               self.gene_names())
+        matrix = self.result_matrix()
         network_scores = {}
         for network in self.networks():
             logging.debug("Compute scores for network '%s', WEIGHT: %f",
@@ -266,29 +261,20 @@ class ScoringFunction(scoring.ScoringFunctionBase):
 
     def __compute_network_cluster_scores(self, network):
         """computes the cluster scores for the given network"""
-        global COMPUTE_NETWORK, ALL_GENES, NETWORK_SCORE_MEMBERSHIP
         result = {}
-        use_multiprocessing = self.config_params[
-            scoring.KEY_MULTIPROCESSING]
-        # Set the huge memory objects into globals
-        # These are readonly anyways, but using Manager.list() or something
-        # similar brings this down to a crawl
-        COMPUTE_NETWORK = network
-        ALL_GENES = set(self.gene_names())  # optimization: O(1) lookup
-        NETWORK_SCORE_MEMBERSHIP = self.membership
-
-        if use_multiprocessing:
-            with util.get_mp_pool(self.config_params) as pool:
-                map_results = pool.map(compute_network_scores, xrange(1, self.num_clusters() + 1))
-            for cluster in xrange(1, self.num_clusters() + 1):
-                result[cluster] = map_results[cluster - 1]
-        else:
-            for cluster in xrange(1, self.num_clusters() + 1):
-                result[cluster] = compute_network_scores(cluster)
-        # cleanup
-        COMPUTE_NETWORK = None
-        ALL_GENES = None
-        NETWORK_SCORE_MEMBERSHIP = None
+        # the networks and the gene set are readonly, so the workers
+        # only receive them once
+        if self.__all_genes is None:
+            self.__all_genes = set(self.gene_names())  # optimization: O(1) lookup
+
+        map_results = util.pool_map(self.config_params, compute_network_scores,
+                                    xrange(1, self.num_clusters() + 1),
+                                    state={'membership': self.membership,
+                                           'network_name': network.name},
+                                    readonly={'network:' + network.name: network,
+                                              'all_genes': self.__all_genes})
+        for cluster in xrange(1, self.num_clusters() + 1):
+            result[cluster] = map_results[cluster - 1]
         return result
 
     def __update_score_matrix(self, matrix, network_score, weight):
@@ -15,9 +15,6 @@ import cmonkey.seqtools as st
 import cmonkey.microbes_online as mo
 import cmonkey.patches as patches
 
-# requires biopython
-from Bio import SeqIO
-
 
 class RsatSpeciesInfo:
     """RSAT description of the organism"""
@@ -261,6 +258,8 @@ class FASTASequenceSource:
     """FASTA file based sequence source"""
 
     def __init__(self, organism, filepath):
+        # requires biopython, which is only imported for FASTA sequence sources
+        from Bio import SeqIO
         self.organism = organism
         self.seqmap = None
         with open(filepath) as infile:
@@ -11,10 +11,11 @@ import os
 from datetime import date
 import cmonkey.datamatrix as dm
 import cmonkey.util as util
+import cmonkey.stats as stats
 import cmonkey.membership as memb
+import cmonkey.cluster_stats as cluster_stats
 import cmonkey.BSCM as BSCM
 import numpy as np
-import gc
 
 import cmonkey.database as cm2db
 
@@ -90,6 +91,10 @@ class ScoringFunctionBase:
         self.config_params = cmrun.config_params
         if self.config_params is None:
             raise Exception('NO CONFIG PARAMS !!!')
+        # the scaling_rvec schedule, which is evaluated on first use
+        self.__scaling_fun = None
+        # the run's score matrices, None if every result is newly allocated
+        self.__arena = cmrun.score_arena()
 
     def check_requirements(self):
         """Give the scoring module an opportunity to check whether the
@@ -179,6 +184,19 @@ class ScoringFunctionBase:
         """returns the number of clusters"""
         return self.membership.num_clusters()
 
+    def result_matrix(self, row_names=None, key=None, fill_value=0.0):
+        """returns a matrix of row_names (default: the genes) x clusters for a
+        result of this function. With an arena, the matrix reuses the values
+        of the previous result of key (default: the function id), which are
+        filled with fill_value unless that is None"""
+        if row_names is None:
+            row_names = self.gene_names()
+        if self.__arena is None:
+            return dm.DataMatrix(len(row_names), self.num_clusters(), row_names,
+                                 init_value=fill_value)
+        return self.__arena.matrix(self.id if key is None else key, row_names,
+                                   self.num_clusters(), fill_value)
+
     def gene_names(self):
         """returns the gene names"""
         return self.ratios.row_names
@@ -194,9 +212,10 @@ class ScoringFunctionBase:
             if scaling[0] == 'scaling_const':
                 return scaling[1]
             elif scaling[0] == 'scaling_rvec':
-                num_iterations = self.config_params['num_iterations']
-                return util.get_rvec_fun(scaling[1].replace('num_iterations',
-                                                            str(num_iterations)))(iteration)
+                if self.__scaling_fun is None:
+                    self.__scaling_fun = util.get_rvec_fun(scaling[1],
+                                                           self.config_params['num_iterations'])
+                return self.__scaling_fun(iteration)
             else:
                 raise Exception("Unknown scaling: '%s'" % scaling[0])
         else:
@@ -229,9 +248,12 @@ class ColumnScoringFunction(ScoringFunctionBase):
 
     def do_compute(self, iteration_result, ref_matrix=None):
         """compute method, iteration is the 0-based iteration number"""
+        result = None
+        if self.BSCM_obj is None:
+            result = self.result_matrix(self.ratios.column_names, fill_value=None)
         return compute_column_scores(self.membership, self.ratios,
                                      self.num_clusters(), self.config_params,
-                                     self.BSCM_obj)
+                                     self.BSCM_obj, result)
 
     def get_BSCM(self):
         """Return the background sampled coherence matrix object"""
@@ -239,8 +261,70 @@ class ColumnScoringFunction(ScoringFunctionBase):
 
 
 def compute_column_scores(membership, matrix, num_clusters,
-                          config_params, BSCM_obj=None):
-    """Computes the column scores for the specified number of clusters"""
+                          config_params, BSCM_obj=None, result=None):
+    """Computes the column scores for the specified number of clusters.
+    The result is a DataMatrix of |conditions| x |clusters|, the scores
+    without BSCM are written into result if it is given"""
+    if BSCM_obj is not None:
+        return compute_column_scores_reference(membership, matrix, num_clusters,
+                                               config_params, BSCM_obj)
+
+    start_time = util.current_millis()
+    values = compute_column_scores_batched(membership, matrix, num_clusters)
+    logging.debug("compute_column_scores_batched() in %f s.",
+                  (util.current_millis() - start_time) / 1000.0)
+    if result is None:
+        result = dm.DataMatrix(matrix.num_columns, num_clusters,
+                               row_names=matrix.column_names,
+                               values=values)
+    else:
+        result.values[:] = values
+    result.fix_extreme_values()
+    return result
+
+
+def compute_column_scores_batched(membership, matrix, num_clusters):
+    """computes the column scores of all clusters in one pass over the matrix.
+
+    With X the ratios matrix, M the mask of its non-NaN values and R the
+    gene x cluster membership indicator, the per-cluster column sums,
+    squared sums and counts are R^T X, R^T X^2 and R^T M. Variances follow
+    from sum((x - mu)^2) = sum(x^2) - sum(x) * mu and are normalized by
+    the mean expression level like in compute_column_scores_submatrix().
+    Clusters with less than 2 rows and missing scores are set to the
+    0.95 quantile of the scores of the clusters' member columns.
+    Returns a numpy array of (num_columns x num_clusters)"""
+    rows = membership.row_indicator(num_clusters=num_clusters)
+    col_ind = membership.col_indicator(dense=True, num_clusters=num_clusters).T
+
+    values = matrix.values
+    missing = np.isnan(values)
+    xvalues = np.where(missing, 0.0, values)
+    mask = (~missing).astype(np.float64)
+
+    # per-cluster column statistics (clusters x columns)
+    sums = rows.T.dot(xvalues)
+    sq_sums = rows.T.dot(np.square(xvalues))
+    counts = rows.T.dot(mask)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        colmeans = sums / counts
+        # the expanded form can come out slightly negative through cancellation
+        variances = np.maximum(sq_sums - sums * colmeans, 0.0) / counts
+        scores = variances / (np.abs(colmeans) + 0.01)
+
+    scored = rows.getnnz(axis=0) > 1
+    scores[~scored] = np.nan
+    substitution = util.quantile(scores[col_ind & scored[:, np.newaxis]], 0.95)
+    scores[np.isnan(scores)] = substitution
+    return scores.T
+
+
+def compute_column_scores_reference(membership, matrix, num_clusters,
+                                    config_params, BSCM_obj=None):
+    """the original per-cluster column scoring, which computes each cluster's
+    scores on its own submatrix. This is kept as a reference for the
+    batched version and is used for the BSCM scores"""
 
     def compute_substitution(cluster_column_scores):
         """calculate substitution value for missing column scores"""
@@ -332,8 +416,12 @@ def compute_column_scores_submatrix(matrix):
     return (matrix.column_names, result)
 
 
-def combine(result_matrices, score_scalings, membership, iteration, config_params):
-    """This is  the combining function, taking n result matrices and scalings"""
+def combine(result_matrices, score_scalings, membership, iteration, config_params,
+            out=None):
+    """This is  the combining function, taking n result matrices and scalings.
+    The weighted sum is accumulated in out if it is an array of the right
+    shape, e.g. the values of the previous result, otherwise in a new array.
+    The result matrix wraps that array without a copy"""
     quantile_normalize = config_params['quantile_normalize']
 
     for i, m in enumerate(result_matrices):
@@ -346,6 +434,13 @@ def combine(result_matrices, score_scalings, membership, iteration, config_param
             funs = config_params['pipeline']['row-scoring']['args']['functions']
             m.write_tsv_file(os.path.join(config_params['output_dir'], 'score-%s-%04d.tsv' % (funs[i]['id'], iteration)), compressed=False)
 
+    if len(result_matrices) == 0:
+        return None
+
+    matrix0 = result_matrices[0]  # as reference for names
+    if out is None or out.shape != matrix0.values.shape:
+        out = np.empty(matrix0.values.shape)
+
     if quantile_normalize:
         if len(result_matrices) > 1:
             start_time = util.current_millis()
@@ -354,70 +449,56 @@ def combine(result_matrices, score_scalings, membership, iteration, config_param
             elapsed = util.current_millis() - start_time
             logging.debug("quantile normalize in %f s.", elapsed / 1000.0)
 
-        in_matrices = [m.values for m in result_matrices]
+        start_time = util.current_millis()
+        np.multiply(result_matrices[0].values, score_scalings[0], out=out)
+        for i in xrange(1, len(result_matrices)):
+            out += result_matrices[i].values * score_scalings[i]
 
     else:
-        in_matrices = []
-        num_clusters = membership.num_clusters()
-        mat = result_matrices[0]
-        index_map = {name: index for index, name in enumerate(mat.row_names)}
         # we assume matrix 0 is always the gene expression score
         # we also assume that the matrices are already extreme value
         # fixed
-        rsm = []
-        for cluster in range(1, num_clusters + 1):
-            row_members = sorted(membership.rows_for_cluster(cluster))
-            rsm.extend([mat.values[index_map[row], cluster - 1] for row in row_members])
-        scale = util.mad(rsm)
+        mat = result_matrices[0]
+        # the scores of the cluster members, MAD and median do not depend
+        # on their order
+        rsm = cluster_stats.member_values(
+            mat.values, memb.aligned_row_indicator(membership, mat.row_names))
+        scale = stats.mad(rsm)
         if scale == 0:  # avoid that we are dividing by 0
             scale = util.r_stddev(rsm)
         if scale != 0:
             median_rsm = util.median(rsm)
-            rsvalues = (mat.values - median_rsm) / scale
-            num_rows, num_cols = rsvalues.shape
-            rscores = dm.DataMatrix(num_rows, num_cols,
-                                    mat.row_names,
-                                    mat.column_names,
-                                    values=rsvalues)
-            rscores.fix_extreme_values()
+            np.subtract(mat.values, median_rsm, out=out)
+            out /= scale
+            dm.fix_extreme_values(out)
         else:
             logging.warn("combiner scaling -> scale == 0 !!!")
-            rscores = mat
-        in_matrices.append(rscores.values)
+            out[:] = mat.values
 
         if len(result_matrices) > 1:
-            rs_quant = util.quantile(rscores.values, 0.01)
+            rs_quant = util.quantile(out, 0.01)
             logging.debug("RS_QUANT = %f", rs_quant)
-            for i in range(1, len(result_matrices)):
-                values = result_matrices[i].values
-                qqq = abs(util.quantile(values, 0.01))
-                if qqq == 0:
-                    logging.debug('SPARSE SCORES - %d attempt 1: pick from sorted values', i)
-                    qqq = sorted(values.ravel())[9]
-                if qqq == 0:
-                    logging.debug('SPARSE SCORES - %d attempt 2: pick minimum value', i)
-                    qqq = abs(values.min())
-                if qqq != 0:
-                    values = values / qqq * abs(rs_quant)
-                else:
-                    logging.debug('SPARSE SCORES - %d not normalizing!', i)
-                in_matrices.append(values)
-
-    if len(result_matrices) > 0:
+
         start_time = util.current_millis()
-        # assuming same format of all matrices
-        combined_score = np.zeros(in_matrices[0].shape)
-        for i in xrange(len(in_matrices)):
-            combined_score += in_matrices[i] * score_scalings[i]
-
-        elapsed = util.current_millis() - start_time
-        logging.debug("combined score in %f s.", elapsed / 1000.0)
-        matrix0 = result_matrices[0]  # as reference for names
-        return dm.DataMatrix(matrix0.num_rows, matrix0.num_columns,
-                             matrix0.row_names, matrix0.column_names,
-                             values=combined_score)
-    else:
-        return None
+        out *= score_scalings[0]
+        for i in range(1, len(result_matrices)):
+            values = result_matrices[i].values
+            qqq = abs(util.quantile(values, 0.01))
+            if qqq == 0:
+                logging.debug('SPARSE SCORES - %d attempt 1: pick from sorted values', i)
+                qqq = np.partition(values.ravel(), 9)[9]
+            if qqq == 0:
+                logging.debug('SPARSE SCORES - %d attempt 2: pick minimum value', i)
+                qqq = abs(values.min())
+            if qqq != 0:
+                out += values * (abs(rs_quant) / qqq * score_scalings[i])
+            else:
+                logging.debug('SPARSE SCORES - %d not normalizing!', i)
+                out += values * score_scalings[i]
+
+    elapsed = util.current_millis() - start_time
+    logging.debug("combined score in %f s.", elapsed / 1000.0)
+    return dm.DataMatrix.from_array(out, matrix0.row_names, matrix0.column_names)
 
 
 class ScoringFunctionCombiner:
@@ -432,6 +513,9 @@ class ScoringFunctionCombiner:
         self.membership = membership
         self.scoring_functions = scoring_functions
         self.config_params = config_params
+        # the values of the last combined scores, which the next combination
+        # overwrites
+        self.__combined = None
 
     def check_requirements(self):
         """Give the scoring module an opportunity to check whether the
@@ -446,9 +530,6 @@ class ScoringFunctionCombiner:
         reference_matrix = ref_matrix
         iteration = iteration_result['iteration']
         for scoring_function in self.scoring_functions:
-            # clean up before doing something complicated
-            gc.collect()
-
             if reference_matrix is None and len(result_matrices) > 0:
                 reference_matrix = result_matrices[0]
 
@@ -459,8 +540,7 @@ class ScoringFunctionCombiner:
 
                 if self.config_params['log_subresults']:
                     self.log_subresult(scoring_function, matrix)
-        return combine(result_matrices, score_scalings, self.membership,
-                       iteration, self.config_params)
+        return self.__combine(result_matrices, score_scalings, iteration)
 
     def compute(self, iteration_result, ref_matrix=None):
         """compute scores for one iteration"""
@@ -469,9 +549,6 @@ class ScoringFunctionCombiner:
         reference_matrix = ref_matrix
         iteration = iteration_result['iteration']
         for scoring_function in self.scoring_functions:
-            # clean up before doing something complicated
-            gc.collect()
-
             # This  is actually a hack in order to propagate
             # a reference matrix to the compute function
             # This could have negative impact on scalability
@@ -486,8 +563,7 @@ class ScoringFunctionCombiner:
                 if self.config_params['log_subresults']:
                     self.log_subresult(scoring_function, matrix)
 
-        return combine(result_matrices, score_scalings, self.membership,
-                       iteration, self.config_params)
+        return self.__combine(result_matrices, score_scalings, iteration)
 
     def combine_cached(self, iteration):
         """Combine the cached results of the contained scoring function.
@@ -500,22 +576,26 @@ class ScoringFunctionCombiner:
                 result_matrices.append(matrix)
                 score_scalings.append(scoring_function.scaling(iteration))
 
-        return combine(result_matrices, score_scalings, self.membership,
-                       iteration, self.config_params)
+        return self.__combine(result_matrices, score_scalings, iteration)
 
+    def __combine(self, result_matrices, score_scalings, iteration):
+        """combines the results into the values of the previous combination,
+        so a result is only valid until the next combination"""
+        result = combine(result_matrices, score_scalings, self.membership,
+                         iteration, self.config_params, out=self.__combined)
+        if result is not None:
+            self.__combined = result.values
+        return result
 
     def log_subresult(self, score_function, matrix):
         """output an accumulated subresult to the log"""
-        scores = []
-        mvalues = matrix.values
-        for cluster in xrange(1, matrix.num_columns + 1):
-            cluster_rows = self.membership.rows_for_cluster(cluster)
-            for row in xrange(matrix.num_rows):
-                if matrix.row_names[row] in cluster_rows:
-                    scores.append(mvalues[row][cluster - 1])
+        if not logging.getLogger().isEnabledFor(logging.DEBUG):
+            return
+        scores = cluster_stats.member_values(
+            matrix.values, memb.aligned_row_indicator(self.membership, matrix.row_names))
         logging.debug("function '%s', trim mean score: %f",
                       score_function.id,
-                      util.trim_mean(scores, 0.05))
+                      cluster_stats.trim_mean(scores, 0.05))
 
     def scaling(self, iteration):
         """returns the scaling for the specified iteration"""
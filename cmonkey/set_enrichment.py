@@ -13,8 +13,8 @@ import multiprocessing as mp
 from collections import defaultdict
 
 import cmonkey.util as util
+import cmonkey.stats as stats
 import cmonkey.scoring as scoring
-import cmonkey.datamatrix as dm
 
 # Python2/Python3 compatibility
 try:
@@ -91,18 +91,6 @@ class SetType:
         return result
 
 
-# global variables that are shared by the child processe
-# when running in multiprocessing. This is an attempt to avoid
-# that the scoring function slows itself down by using to much
-# memory
-SET_MATRIX = None
-SET_MEMBERSHIP = None
-SET_SET_TYPE = None
-SET_SYNONYMS = None
-CANONICAL_ROWNAMES = None
-CANONICAL_ROW_INDEXES = None
-
-
 def read_set_types(config_params, thesaurus, input_genes):
     """Reads sets from a JSON file. We also ensure that genes
     are stored in canonical form in the set, so that set operations based on
@@ -183,6 +171,8 @@ class ScoringFunction(scoring.ScoringFunctionBase):
         scoring.ScoringFunctionBase.__init__(self, function_id, cmrun)
         self.__set_types = read_set_types(self.config_params, self.organism.thesaurus(),
                                           self.ratios.row_names)
+        self.__canonical_rownames = None
+        self.__canonical_row_indexes = None
         self.run_log = scoring.RunLog(function_id, cmrun.dbsession(), self.config_params)
 
     def bonferroni_cutoff(self):
@@ -194,27 +184,22 @@ class ScoringFunction(scoring.ScoringFunctionBase):
         Note: will return None if not computed yet and the result of a previous
         scoring if the function is not supposed to actually run in this iteration
         """
-        global SET_MATRIX, SET_MEMBERSHIP, SET_SET_TYPE, SET_SYNONYMS, CANONICAL_ROWNAMES, CANONICAL_ROW_INDEXES
         logging.info("Compute scores for set enrichment...")
         start_time = util.current_millis()
-        matrix = dm.DataMatrix(len(self.gene_names()), self.num_clusters(),
-                               self.gene_names())
-        use_multiprocessing = self.config_params[scoring.KEY_MULTIPROCESSING]
-        SET_MATRIX = self.ratios
-        SET_MEMBERSHIP = self.membership
-        SET_SYNONYMS = self.organism.thesaurus()
-
-        if CANONICAL_ROWNAMES is None:
-            CANONICAL_ROWNAMES = set(map(lambda n: SET_SYNONYMS[n] if n in SET_SYNONYMS else n,
-                                         self.ratios.row_names))
-
-        if CANONICAL_ROW_INDEXES is None:
-            CANONICAL_ROW_INDEXES = {}
+        matrix = self.result_matrix()
+        synonyms = self.organism.thesaurus()
+
+        if self.__canonical_rownames is None:
+            self.__canonical_rownames = set(map(lambda n: synonyms[n] if n in synonyms else n,
+                                                self.ratios.row_names))
+
+        if self.__canonical_row_indexes is None:
+            self.__canonical_row_indexes = {}
             for index, row in enumerate(self.ratios.row_names):
-                if row in SET_SYNONYMS:
-                    CANONICAL_ROW_INDEXES[SET_SYNONYMS[row]] = index
+                if row in synonyms:
+                    self.__canonical_row_indexes[synonyms[row]] = index
                 else:
-                    CANONICAL_ROW_INDEXES[row] = index
+                    self.__canonical_row_indexes[row] = index
 
         ref_min_score = np.nanpercentile(ref_matrix.values, 10.0)
         logging.info('REF_MIN_SCORE: %f', ref_min_score)
@@ -225,19 +210,21 @@ class ScoringFunction(scoring.ScoringFunctionBase):
                                      'setEnrichment_pvalue.csv')
 
         for set_type in self.__set_types:
-            SET_SET_TYPE = set_type
             logging.info("PROCESSING SET TYPE '%s'", set_type.name)
             start1 = util.current_millis()
             cutoff = self.bonferroni_cutoff()
-            if use_multiprocessing:
-                with util.get_mp_pool(self.config_params) as pool:
-                    results = pool.map(compute_cluster_score,
-                                       [(cluster, cutoff, ref_min_score)
-                                        for cluster in xrange(1, self.num_clusters() + 1)])
-            else:
-                results = []
-                for cluster in xrange(1, self.num_clusters() + 1):
-                    results.append(compute_cluster_score((cluster, cutoff, ref_min_score)))
+            # the matrix, synonyms and set types are readonly, so the
+            # workers only receive them once
+            results = util.pool_map(self.config_params, compute_cluster_score,
+                                    [(cluster, cutoff, ref_min_score)
+                                     for cluster in xrange(1, self.num_clusters() + 1)],
+                                    state={'membership': self.membership,
+                                           'set_type_name': set_type.name},
+                                    readonly={'ratios': self.ratios,
+                                              'synonyms': synonyms,
+                                              'canonical_rownames': self.__canonical_rownames,
+                                              'canonical_row_indexes': self.__canonical_row_indexes,
+                                              'set_type:' + set_type.name: set_type})
 
             elapsed1 = util.current_millis() - start1
             logging.info("ENRICHMENT SCORES COMPUTED in %f s, STORING...",
@@ -269,12 +256,6 @@ class ScoringFunction(scoring.ScoringFunctionBase):
 
         logging.info("SET ENRICHMENT FINISHED IN %f s.\n",
                      (util.current_millis() - start_time) / 1000.0)
-        # cleanup
-        SET_SET_TYPE = None
-        SET_MATRIX = None
-        SET_MEMBERSHIP = None
-        SET_SYNONYMS = None
-
         return matrix
 
     def run_logs(self):
@@ -284,14 +265,17 @@ class ScoringFunction(scoring.ScoringFunctionBase):
 
 def compute_cluster_score(args):
     """Computes the cluster score for a given set type"""
-    global SET_MATRIX, SET_MEMBERSHIP, SET_SET_TYPE, SET_SYNONYMS, CANONICAL_ROWNAMES, CANONICAL_ROW_INDEXES
+    state = util.worker_state()
     cluster, cutoff, ref_min_score = args
-    return compute_cluster_score_plain(cluster, cutoff, ref_min_score, SET_MATRIX, SET_MEMBERSHIP,
-                                       SET_SET_TYPE, SET_SYNONYMS, CANONICAL_ROWNAMES, CANONICAL_ROW_INDEXES)
+    return compute_cluster_score_plain(cluster, cutoff, ref_min_score, state['ratios'],
+                                       state['membership'],
+                                       state['set_type:' + state['set_type_name']],
+                                       state['synonyms'], state['canonical_rownames'],
+                                       state['canonical_row_indexes'])
 
 def compute_cluster_score_plain(cluster, cutoff, ref_min_score, SET_MATRIX, SET_MEMBERSHIP, SET_SET_TYPE,
                                 SET_SYNONYMS, CANONICAL_ROWNAMES, CANONICAL_ROW_INDEXES):
-    """This version is the real implementation, that can be tested without using global variables"""
+    """This version is the real implementation, that can be tested without a worker state"""
     set_type = SET_SET_TYPE
     matrix = SET_MATRIX
     cluster_rows = set()
@@ -322,7 +306,7 @@ def compute_cluster_score_plain(cluster, cutoff, ref_min_score, SET_MATRIX, SET_
         phyper_n = list(np.array([num_genes] * num_sets) - np.array(set_sizes))
         phyper_k = [len(cluster_genes)] * num_sets
 
-        enrichment_pvalues = np.array(util.phyper(overlap_sizes, set_sizes, phyper_n, phyper_k))
+        enrichment_pvalues = np.array(stats.phyper(overlap_sizes, set_sizes, phyper_n, phyper_k))
         min_pvalue = enrichment_pvalues[np.isfinite(enrichment_pvalues)].min()
         min_index = np.where(enrichment_pvalues == min_pvalue)[0][0]
         min_set = set_names[min_index]
@@ -0,0 +1,297 @@
+# vi: sw=4 ts=4 et:
+"""stats.py - statistical primitives of cMonkey
+
+Every primitive is computed by the backend that is selected with the
+stats_backend setting:
+
+  - 'numpy': NumPy and SciPy versions, this is the default
+  - 'r': calls R through rpy2
+
+rpy2 is only imported when the R backend is used for the first time, so
+runs with the NumPy backend do not need R.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import numpy as np
+import scipy.sparse
+
+import cmonkey.util as util
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+BACKENDS = {'numpy', 'r'}
+DEFAULT_BACKEND = 'numpy'
+
+# the backend of this process, util.WorkerPool passes it on to its workers
+BACKEND = DEFAULT_BACKEND
+
+# the scale factor of the median absolute deviation, R's mad() default
+MAD_CONSTANT = 1.4826
+
+KMEANS_STARTS = 2
+KMEANS_MAX_ITERATIONS = 20
+
+# the NumPy backend's random generator, see set_seed()
+RANDOM_GENERATOR = None
+
+
+def set_backend(backend):
+    """selects the backend of this process and of the worker pools that
+    are started afterwards"""
+    global BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("unknown stats backend '%s'" % backend)
+    BACKEND = backend
+
+
+def backend():
+    """returns the selected backend"""
+    return BACKEND
+
+
+def use_r():
+    return backend() == 'r'
+
+
+def set_seed(value):
+    """seeds the random numbers of the backend: R's set.seed() or the
+    NumPy backend's generator"""
+    global RANDOM_GENERATOR
+    if use_r():
+        util.robjects().r['set.seed'](value)
+    else:
+        RANDOM_GENERATOR = np.random.default_rng(value)
+
+
+def random_generator():
+    """the NumPy backend's random generator, which is seeded by set_seed()"""
+    global RANDOM_GENERATOR
+    if RANDOM_GENERATOR is None:
+        RANDOM_GENERATOR = np.random.default_rng()
+    return RANDOM_GENERATOR
+
+
+def runif(num_values):
+    """num_values uniformly distributed values in [0, 1)"""
+    if use_r():
+        return np.array(util.robjects().r['runif'](num_values))
+    return random_generator().uniform(0.0, 1.0, num_values)
+
+
+def rnorm(num_values, std_deviation):
+    """num_values normally distributed values with mean 0"""
+    if use_r():
+        return np.array(util.robjects().r['rnorm'](num_values, sd=std_deviation))
+    return random_generator().normal(0.0, std_deviation, num_values)
+
+
+def sd_rnorm(values, num_rnorm_values, fuzzy_coeff):
+    """computes the standard deviation of values without NaNs and returns
+    num_rnorm_values normally distributed values with that standard
+    deviation scaled by fuzzy_coeff. Fewer than 2 values result in NaNs"""
+    if use_r():
+        robjects = util.robjects()
+        func = robjects.r("""
+          sd_rnorm <- function(values, num_out_values, fuzzy_coeff) {
+            sdval <- sd(values, na.rm=T) * fuzzy_coeff
+            rnorm(num_out_values, sd=sdval)
+          }
+          sd_rnorm
+        """)
+        return np.array(func(robjects.FloatVector(values), num_rnorm_values, fuzzy_coeff))
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return np.full(num_rnorm_values, np.nan)
+    return random_generator().normal(0.0, np.std(values, ddof=1) * fuzzy_coeff,
+                                     num_rnorm_values)
+
+
+def density(kvalues, cluster_values, bandwidth, dmin, dmax):
+    """R's density(cluster_values, bw=bandwidth, adjust=2, from=dmin,
+    to=dmax, n=256, na.rm=TRUE), with the upper tail cumulative sums
+    interpolated at kvalues and normalized. util.kde_density() is the
+    NumPy version for many clusters"""
+    if use_r():
+        robjects = util.robjects()
+        kwargs = {'bw': bandwidth, 'adjust': 2, 'from': dmin,
+                  'to': dmax, 'n': 256, 'na.rm': True}
+        rdens = robjects.r("""
+        rdens <- function(cluster_values, kvalues, ...) {
+          d <- density(cluster_values, ...);
+          p <- approx(d$x, rev(cumsum(rev(d$y))), kvalues)$y
+          p / sum(p, na.rm=T)
+        }
+        rdens
+        """)
+        return np.array(rdens(robjects.FloatVector(cluster_values),
+                              robjects.FloatVector(kvalues), **kwargs))
+    cluster_values = np.asarray(cluster_values, dtype=np.float64)[:, np.newaxis]
+    return util.kde_density(np.asarray(kvalues, dtype=np.float64)[:, np.newaxis],
+                            cluster_values, np.ones(cluster_values.shape, dtype=bool),
+                            [bandwidth], [dmin], [dmax])[:, 0]
+
+
+def phyper(q, m, n, k, lower_tail=False):
+    """R's phyper(q, m, n, k, lower.tail=lower_tail): the hypergeometric
+    distribution of the white balls in k draws from an urn with m white
+    and n black balls"""
+    if use_r():
+        robjects = util.robjects()
+        kwargs = {'lower.tail': lower_tail}
+        return np.array(robjects.r['phyper'](robjects.FloatVector(q), robjects.FloatVector(m),
+                                             robjects.FloatVector(n), robjects.FloatVector(k),
+                                             **kwargs))
+    # scipy.stats takes a while to import and is only needed here
+    import scipy.stats
+    q, m, n, k = [np.asarray(values, dtype=np.float64) for values in (q, m, n, k)]
+    if lower_tail:
+        return scipy.stats.hypergeom.cdf(q, m + n, m, k)
+    return scipy.stats.hypergeom.sf(q, m + n, m, k)
+
+
+def rrank(values):
+    """R's rank(values, ties='min', na='keep') as a float array"""
+    if use_r():
+        robjects = util.robjects()
+        kwargs = {'ties': 'min', 'na': 'keep'}
+        return np.array(robjects.r['rank'](robjects.FloatVector(values), **kwargs))
+    return util.rank_min(values)
+
+
+def rrank_matrix(npmatrix):
+    """the 0-based ranks of all values in npmatrix like rank(ties='min') in
+    row-major order as an int32 array"""
+    if use_r():
+        robjects = util.robjects()
+        func = robjects.r("""
+          rank_mat <- function(values, nrow, ncol) {
+            xr <- t(matrix(values, nrow=nrow, ncol=ncol, byrow=T))
+            return (rank(xr, ties='min', na='keep') - 1)
+          }
+          rank_mat
+        """)
+        num_rows, num_cols = npmatrix.shape
+        res = func(robjects.FloatVector(npmatrix.ravel()), num_rows, num_cols)
+        # Converting the result to an NumPy in array results in a
+        # surprisingly nice speedup
+        return np.array(res, dtype=np.int32)
+    return util.rank_matrix(npmatrix)
+
+
+def mad(values):
+    """R's mad(values, na.rm=FALSE): the median absolute deviation scaled
+    by MAD_CONSTANT, NaN if values contains NaN"""
+    if use_r():
+        robjects = util.robjects()
+        kwargs = {'na.rm': False}
+        return float(robjects.r['mad'](robjects.FloatVector(values), **kwargs)[0])
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0 or np.isnan(values).any():
+        return np.nan
+    return MAD_CONSTANT * float(np.median(np.abs(values - np.median(values))))
+
+
+def rorder(values, result_size):
+    """R's order(values, decreasing=TRUE): the 1-based indexes of the
+    result_size largest values, ties in their original order and NaN last"""
+    if use_r():
+        robjects = util.robjects()
+        res = robjects.r['order'](robjects.FloatVector(values), decreasing=True)
+        return np.array(res[:result_size], dtype=np.intp)
+    return util.order_rows(np.asarray(values, dtype=np.float64)[np.newaxis],
+                           result_size)[0]
+
+
+def kmeans(values, num_clusters, num_starts=KMEANS_STARTS,
+           max_iterations=KMEANS_MAX_ITERATIONS, random_seed=None, config_params=None):
+    """clusters the rows of values and returns the 0-based cluster of each
+    row from the start with the smallest within-cluster sum of squares.
+
+    The NumPy backend runs Lloyd's algorithm from k-means++ initial
+    centers. If multiprocessing is enabled and the run has a worker pool,
+    the starts run in parallel on it. Otherwise, they run in this process.
+    Each start draws its initial centers from its own child of
+    random_seed's SeedSequence, so the result does not depend on where
+    the starts run. The R backend calls kmeans(), which draws from R's
+    random stream (see set_seed())"""
+    if use_r():
+        return __kmeans_r(values, num_clusters, num_starts, max_iterations)
+    # forking a temporary pool for a few starts costs more than it saves
+    if config_params is None or util.RUN_POOL is None:
+        config_params = {}
+    seeds = np.random.SeedSequence(random_seed).spawn(num_starts)
+    results = util.pool_map(config_params,
+                            compute_kmeans_start,
+                            [(seed, num_clusters, max_iterations) for seed in seeds],
+                            state={'kmeans_values': values})
+    best = int(np.argmin([within_ss for within_ss, _ in results]))
+    return results[best][1]
+
+
+def __kmeans_r(values, num_clusters, num_starts, max_iterations):
+    robjects = util.robjects()
+    matrix_values = robjects.r.matrix(robjects.FloatVector(values.ravel()),
+                                      nrow=values.shape[0], byrow=True)
+    kwargs = {'centers': num_clusters, 'iter.max': max_iterations, 'nstart': num_starts}
+    return np.array(robjects.r['kmeans'](matrix_values, **kwargs)[0], dtype=np.intp) - 1
+
+
+def compute_kmeans_start(args):
+    """runs one k-means start on the worker state's kmeans_values and
+    returns the within-cluster sum of squares and the clusters"""
+    seed, num_clusters, max_iterations = args
+    values = util.worker_state()['kmeans_values']
+    num_rows = values.shape[0]
+    rng = np.random.default_rng(seed)
+    sq_norms = np.einsum('ij,ij->i', values, values)
+    centers = kmeans_plusplus_centers(values, sq_norms, num_clusters, rng)
+    clusters = None
+    for _ in xrange(max_iterations):
+        distances = np.dot(values, -2.0 * centers.T)
+        distances += np.einsum('ij,ij->i', centers, centers)
+        new_clusters = distances.argmin(axis=1)
+        if clusters is not None and np.array_equal(clusters, new_clusters):
+            break
+        clusters = new_clusters
+        indicator = scipy.sparse.csr_matrix((np.ones(num_rows), (clusters, np.arange(num_rows))),
+                                            shape=(num_clusters, num_rows))
+        sizes = np.bincount(clusters, minlength=num_clusters)
+        centers = indicator.dot(values) / np.maximum(sizes, 1)[:, np.newaxis]
+
+        # an empty cluster moves to one of the rows that are farthest from
+        # their centers
+        empty = np.nonzero(sizes == 0)[0]
+        if len(empty) > 0:
+            min_distances = distances[np.arange(num_rows), clusters] + sq_norms
+            centers[empty] = values[np.argsort(-min_distances, kind='stable')[:len(empty)]]
+
+    within_ss = np.sum(np.square(values - centers[clusters]))
+    return within_ss, clusters
+
+
+def kmeans_plusplus_centers(values, sq_norms, num_clusters, rng):
+    """draws the initial k-means centers from the rows of values: the first
+    one uniformly, each further one with a probability proportional to the
+    squared distance of a row to its nearest center (k-means++)"""
+    def sq_distances(center):
+        return np.maximum(sq_norms - 2.0 * np.dot(values, center) + np.dot(center, center), 0.0)
+
+    num_rows = values.shape[0]
+    centers = np.empty((num_clusters, values.shape[1]))
+    centers[0] = values[rng.integers(num_rows)]
+    min_distances = sq_distances(centers[0])
+    for center in xrange(1, num_clusters):
+        cumulative = np.cumsum(min_distances)
+        if cumulative[-1] > 0.0:
+            row = min(np.searchsorted(cumulative, rng.uniform(0.0, cumulative[-1]),
+                                      side='right'), num_rows - 1)
+        else:
+            row = rng.integers(num_rows)
+        centers[center] = values[row]
+        np.minimum(min_distances, sq_distances(centers[center]), out=min_distances)
+    return centers
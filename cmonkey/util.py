@@ -4,12 +4,14 @@
 This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
+import ast
 import operator
 import collections
 from collections import defaultdict
 import math
 import numpy as np
-import scipy.stats
+
+import cmonkey.cluster_stats as cluster_stats
 
 # Python2 - Python3 compatibility
 try:
@@ -24,20 +26,13 @@ except NameError:
 
 
 import os
-import rpy2.robjects as robjects
-from rpy2.robjects import numpy2ri
-from rpy2.robjects import default_converter
 import gzip
 import shelve
 import time
 import logging
 import multiprocessing as mp
+import threading
 
-np_cv_rules = default_converter + numpy2ri.converter
-
-# RSAT organism finding is an optional feature, which we can skip in case that
-# the user imports all the features through own text files
-import bs4
 
 # this tuple structure holds data of a delimited file
 DelimitedFile = collections.namedtuple('DelimitedFile', ['lines', 'header'])
@@ -146,6 +141,9 @@ RankedAnchor = collections.namedtuple('RankedAnchor', ['score', 'anchor'])
 def best_matching_links(search_string, html):
     """given a search string and an HTML text, extract the best matching
     href"""
+    # RSAT organism finding is an optional feature, which we can skip in case that
+    # the user imports all the features through own text files
+    import bs4
     try:
         soup = bs4.BeautifulSoup(html, "lxml")
     except:
@@ -171,10 +169,18 @@ def quantile(values, probability):
     values a list of numeric values
     probability a value in the range between 0 and 1
     """
-    values = np.array(values)
+    values = np.asarray(values)
     values = values[np.isfinite(values)]
     if len(values):
-        return scipy.stats.scoreatpercentile(values, probability * 100)
+        # the linear interpolation of scipy.stats.scoreatpercentile(), with
+        # the same rounding, but without importing scipy.stats
+        index = probability * 100 / 100.0 * (len(values) - 1)
+        lower = int(index)
+        if lower == index:
+            return np.partition(values, lower)[lower]
+        values = np.partition(values, [lower, lower + 1])[lower:lower + 2]
+        weights = np.array([(lower + 1) - index, index - lower])
+        return np.add.reduce(values * weights) / weights.sum()
     else:
         return np.nan
 
@@ -255,8 +261,10 @@ def read_url_cached(url, cache_filename):
         cache_dir = os.path.dirname(cache_filename)
         if not os.path.isdir(cache_dir):
             os.makedirs(cache_dir)
+        # download first, a failed download must not leave an empty file
+        content = read_url(url)
         with open(cache_filename, 'wb') as outfile:
-            outfile.write(read_url(url))
+            outfile.write(content)
     with open(cache_filename, 'rb') as cached_file:
         return cached_file.read()
 
@@ -265,8 +273,9 @@ def get_url_cached(url, cache_filename):
     """convenience method to read a document from a URL using the
     CMonkeyURLopener, cached version, the file is only downloaded"""
     if not os.path.exists(cache_filename):
+        content = read_url(url)
         with open(cache_filename, 'wb') as outfile:
-            outfile.write(read_url(url))
+            outfile.write(content)
 
 
 class ThesaurusBasedMap:  # pylint: disable-msg=R0903
@@ -318,112 +327,230 @@ def kcombinations(alist, k):
 
 
 def trim_mean(values, trim):
-    """returns the trim mean"""
-    if not values or len(values) == 0:
-        return 0
+    """returns the trim mean, see cluster_stats.trim_mean()"""
+    return cluster_stats.trim_mean(values, trim)
+
+
+def rank_min(values):
+    """does the same as R's rank(values, ties='min', na='keep'): tied
+    values all get the smallest rank of their group, NaN values keep NaN.
+    The ranks are 1-based and returned as a float array"""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    result = np.full(len(values), np.nan)
+    ranks = rank_matrix(values) + 1
+    valid = ~np.isnan(values)
+    result[valid] = ranks[valid]
+    return result
+
+
+def rank_matrix(npmatrix):
+    """NumPy version of stats.rrank_matrix(): ranks all values in npmatrix
+    like rank(ties='min') and returns the 0-based ranks in row-major order.
+    NaN values are ranked -1"""
+    values = np.asarray(npmatrix, dtype=np.float64).ravel()
+    # tied values all get the same rank, so the sort does not need to be stable
+    order = np.argsort(values)
+    sorted_values = values[order]
+    num_valid = len(values) - np.count_nonzero(np.isnan(values))
+
+    # the rank of each value is the position where its tie group starts
+    positions = np.arange(num_valid)
+    group_start = np.empty(num_valid, dtype=bool)
+    group_start[:1] = True
+    np.not_equal(sorted_values[1:num_valid], sorted_values[:num_valid - 1],
+                 out=group_start[1:])
+    ranks = np.full(len(values), -1, dtype=np.int32)
+    ranks[order[:num_valid]] = np.maximum.accumulate(np.where(group_start, positions, 0))
+    return ranks
+
+
+# up to this result size, order_rows() selects the columns by repeated argmax
+ORDER_ROWS_MAX_ARGMAX = 4
+
+
+def order_rows(matrix, result_size):
+    """does the same as calling stats.rorder() on each row of matrix, but for
+    the whole matrix at once. Returns an int array of (num_rows x result_size)
+    that contains the 1-based column indexes of the largest values in
+    each row in decreasing order. Like R's order(), ties are kept in their
+    original order and NaN values come last"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    num_rows, num_cols = matrix.shape
+    result_size = min(result_size, num_cols)
+    if result_size == 0:
+        return np.zeros((num_rows, 0), dtype=np.int64)
+    rows = np.arange(num_rows)[:, np.newaxis]
+    # NaN propagates through min(), so this is one pass for both checks
+    lowest = matrix.min() if matrix.size > 0 else 0.0
+
+    if np.isnan(lowest):
+        # NaN values come after everything else, including -Inf
+        nans = np.isnan(matrix)
+        keys = np.where(nans, np.inf, -matrix)
+        order = np.lexsort((keys, nans), axis=1)
+        return order[:, :result_size] + 1
+
+    if result_size <= ORDER_ROWS_MAX_ARGMAX and lowest > -np.inf:
+        # for few results, repeatedly taking the first maximum is faster
+        # than partitioning and keeps ties in column order as well
+        remaining = matrix.copy()
+        result = np.empty((num_rows, result_size), dtype=np.int64)
+        for i in range(result_size):
+            result[:, i] = remaining.argmax(axis=1)
+            remaining[rows[:, 0], result[:, i]] = -np.inf
+        return result + 1
+
+    keys = -matrix
+    if result_size < num_cols:
+        # the result_size-th smallest key in each row is the threshold, ties
+        # at the threshold are selected in column order to stay stable
+        threshold = np.partition(keys, result_size - 1, axis=1)[:, result_size - 1:result_size]
+        below = keys < threshold
+        ties = keys == threshold
+        num_ties = result_size - below.sum(axis=1)[:, np.newaxis]
+        selected = below | (ties & (np.cumsum(ties, axis=1) <= num_ties))
+        candidates = np.nonzero(selected)[1].reshape(num_rows, result_size)
+    else:
+        candidates = np.broadcast_to(np.arange(num_cols), (num_rows, num_cols))
+    order = np.argsort(keys[rows, candidates], axis=1, kind='mergesort')
+    return candidates[rows, order] + 1
 
-    values = sorted(values, reverse=True)
-    if trim == 0.5:
-        return np.median(values)
 
-    k_floor = int(math.floor(trim * len(values)))
-    trim_values_floor = values[k_floor:len(values) - k_floor]
-    return np.mean(np.ma.masked_array(trim_values_floor,
-                                      np.isnan(trim_values_floor)))
+######################################################################
+### Kernel density estimation
+######################################################################
+# R's density() evaluates on a grid of at least 512 points and returns
+# the number of points that was requested
+DENSITY_FFT_POINTS = 512
+DENSITY_POINTS = 256
+DENSITY_ADJUST = 2
+
+
+def bw_nrd0(values):
+    """R's bw.nrd0() rule-of-thumb bandwidth for a gaussian kernel"""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        raise ValueError("need at least 2 data points")
+    hi = np.std(values, ddof=1)
+    q75, q25 = np.percentile(values, [75, 25])
+    lo = min(hi, (q75 - q25) / 1.34)
+    if not lo:
+        lo = hi or abs(values[0]) or 1.0
+    return 0.9 * lo * len(values) ** -0.2
+
+
+def interpolate_rows(xgrid, ygrid, values):
+    """R's approx() for many ascending, evenly spaced grids at once.
+    Row i of values is interpolated on the grid in row i of xgrid/ygrid,
+    values outside the grid or NaN result in NaN"""
+    num_points = xgrid.shape[1]
+    rows = np.arange(xgrid.shape[0])[:, np.newaxis]
+    first = xgrid[:, :1]
+    last = xgrid[:, -1:]
+    inside = (values >= first) & (values <= last)
+    with np.errstate(invalid='ignore'):
+        pos = (np.where(inside, values, first) - first) / (last - first) * (num_points - 1)
+    idx = np.clip(pos.astype(np.intp), 0, num_points - 2)
+
+    # the computed position can be off by one from the grid interval
+    # that R's binary search finds, so we correct it
+    idx -= (values < xgrid[rows, idx]) & (idx > 0)
+    idx += (values >= xgrid[rows, idx + 1]) & (idx < num_points - 2)
+
+    xi = xgrid[rows, idx]
+    xj = xgrid[rows, idx + 1]
+    yi = ygrid[rows, idx]
+    yj = ygrid[rows, idx + 1]
+    with np.errstate(invalid='ignore'):
+        result = yi + (yj - yi) * ((values - xi) / (xj - xi))
+    result = np.where(values == xj, yj, result)
+    result[~inside] = np.nan
+    return result
+
+
+def kde_density(kvalues, cluster_values, cluster_mask, bandwidths, dmin, dmax):
+    """NumPy version of density() for many clusters in one call.
+    Column j of the result contains the densities of the values in
+    column j of kvalues, estimated from the values in column j of
+    cluster_values that are selected by cluster_mask, using bandwidths[j]
+    and the range dmin[j], dmax[j].
+
+    This follows R's density(bw, adjust=2, from, to, n=256, na.rm=TRUE):
+    the cluster values are linearly binned, convolved with a gaussian
+    kernel through FFT, and the upper tail cumulative sums of the
+    densities are interpolated at kvalues and normalized"""
+    num_fft = DENSITY_FFT_POINTS
+    cluster_values = np.asarray(cluster_values, dtype=np.float64)
+    cluster_mask = np.asarray(cluster_mask, dtype=bool)
+    kvalues = np.asarray(kvalues, dtype=np.float64).T
+    num_clusters = kvalues.shape[0]
+    bws = DENSITY_ADJUST * np.asarray(bandwidths, dtype=np.float64)
+    dmin = np.asarray(dmin, dtype=np.float64)
+    dmax = np.asarray(dmax, dtype=np.float64)
+    lo = dmin - 4.0 * bws
+    up = dmax + 4.0 * bws
+
+    # linear binning of the cluster values (R's BinDist()), every value
+    # has the weight 1 / number of non-NA values
+    counts = (cluster_mask & ~np.isnan(cluster_values)).sum(axis=0)
+    vrows, vclusters = np.nonzero(cluster_mask & np.isfinite(cluster_values))
+    with np.errstate(divide='ignore'):
+        weights = (1.0 / counts)[vclusters]
+    xdelta = (up - lo) / (num_fft - 1)
+    xpos = (cluster_values[vrows, vclusters] - lo[vclusters]) / xdelta[vclusters]
+    ix = np.floor(xpos)
+    fx = xpos - ix
+    ix = ix.astype(np.intp)
+    offsets = vclusters * 2 * num_fft
+    lower = (ix >= 0) & (ix <= num_fft - 1)
+    upper = (ix >= -1) & (ix <= num_fft - 2)
+    binned = (np.bincount(offsets[lower] + ix[lower],
+                          weights=(weights * (1.0 - fx))[lower],
+                          minlength=num_clusters * 2 * num_fft) +
+              np.bincount(offsets[upper] + ix[upper] + 1,
+                          weights=(weights * fx)[upper],
+                          minlength=num_clusters * 2 * num_fft))
+    binned = binned.reshape(num_clusters, 2 * num_fft)
+    binned[counts == 0] = np.nan
+
+    # the gaussian kernel on the wrapped-around grid
+    kords = (np.arange(2 * num_fft) *
+             (2.0 * (up - lo) / (2 * num_fft - 1))[:, np.newaxis])
+    kords[:, -1] = 2.0 * (up - lo)
+    kords[:, num_fft + 1:] = -kords[:, num_fft - 1:0:-1]
+    kords /= bws[:, np.newaxis]
+    kords = np.exp(-0.5 * kords * kords) / (math.sqrt(2.0 * math.pi) * bws[:, np.newaxis])
+
+    dens = np.fft.irfft(np.fft.rfft(binned, axis=1) *
+                        np.conj(np.fft.rfft(kords, axis=1)),
+                        2 * num_fft, axis=1)[:, :num_fft]
+    np.maximum(dens, 0.0, out=dens)
+
+    xords = np.linspace(lo, up, num_fft, axis=1)
+    xuser = np.linspace(dmin, dmax, DENSITY_POINTS, axis=1)
+    yuser = interpolate_rows(xords, dens, xuser)
+    tails = np.cumsum(yuser[:, ::-1], axis=1)[:, ::-1]
+    result = interpolate_rows(xuser, tails, kvalues)
+    result /= np.nansum(result, axis=1)[:, np.newaxis]
+    return result.T
 
 
 ######################################################################
 ### RPY2 abstraction
 ######################################################################
-def density(kvalues, cluster_values, bandwidth, dmin, dmax):
-    """generic function to compute density scores"""
-    with np_cv_rules.context():
-        kwargs = {'bw': bandwidth, 'adjust': 2, 'from': dmin,
-                  'to': dmax, 'n': 256, 'na.rm': True}
-        rdens = robjects.r("""
-        rdens <- function(cluster_values, kvalues, ...) {
-          d <- density(cluster_values, ...);
-          p <- approx(d$x, rev(cumsum(rev(d$y))), kvalues)$y
-          p / sum(p, na.rm=T)
-        }
-        rdens
-        """)
-        return rdens(robjects.FloatVector(cluster_values),
-                     robjects.FloatVector(kvalues), **kwargs)
-
-
-def r_set_seed(value):
-    """calls R's set.seed()"""
-    set_seed = robjects.r['set.seed']
-    set_seed(value)
-
-
-def r_runif(value):
-    """calls R's set.seed()"""
-    runif = robjects.r['runif']
-    return runif(value)
-
-
-def rnorm(num_values, std_deviation):
-    """returns the result of R's rnorm function"""
-    r_rnorm = robjects.r['rnorm']
-    kwargs = {'sd': std_deviation}
-    return r_rnorm(num_values, **kwargs)
-
-
-def phyper(q, m, n, k, lower_tail=False):
-    """calls the R function phyper"""
-    r_phyper = robjects.r['phyper']
-    kwargs = {'lower.tail': lower_tail}
-    return r_phyper(robjects.FloatVector(q),
-                    robjects.FloatVector(m),
-                    robjects.FloatVector(n),
-                    robjects.FloatVector(k), **kwargs)
-
-
-def rrank(values):
-    """invokes the R function rank"""
-    r_rank = robjects.r['rank']
-    kwargs = {'ties': 'min', 'na': 'keep'}
-    return r_rank(robjects.FloatVector(values), **kwargs)
-
-
-def mad(values):
-    """invokes the R function mad"""
-    r_mad = robjects.r['mad']
-    kwargs = {'na.rm': False}
-    return r_mad(robjects.FloatVector(values), **kwargs)
-
-
-def sd_rnorm(values, num_rnorm_values, fuzzy_coeff):
-    """computes standard deviation on values and then calls rnorm to
-    generate the num_rnorm_values. This combines stddev and rnorm
-    in one function for reducing rpy2 call overhead"""
-    func = robjects.r("""
-      sd_rnorm <- function(values, num_out_values, fuzzy_coeff) {
-        sdval <- sd(values, na.rm=T) * fuzzy_coeff
-        rnorm(num_out_values, sd=sdval)
-      }
-      sd_rnorm
-    """)
-    return func(robjects.FloatVector(values), num_rnorm_values,
-                fuzzy_coeff)
-
-
-def rrank_matrix(npmatrix):
-    func = robjects.r("""
-      rank_mat <- function(values, nrow, ncol) {
-        xr <- t(matrix(values, nrow=nrow, ncol=ncol, byrow=T))
-        return (rank(xr, ties='min', na='keep') - 1)
-      }
-      rank_mat
-    """)
-    num_rows, num_cols = npmatrix.shape
-    xvec = robjects.FloatVector(npmatrix.ravel())
-    res = func(xvec, num_rows, num_cols)
-    # Converting the result to an NumPy in array results in a
-    # surprisingly nice speedup
-    return np.array(res, dtype=np.int32)
+# rpy2.robjects, which is imported on first use, see robjects()
+ROBJECTS = None
+
+
+def robjects():
+    """returns the rpy2.robjects module. rpy2 and R are only loaded by the
+    first call, so code that does not use R does not need them. The
+    statistical primitives that can use R are in cmonkey.stats"""
+    global ROBJECTS
+    if ROBJECTS is None:
+        import rpy2.robjects
+        ROBJECTS = rpy2.robjects
+    return ROBJECTS
 
 
 def order_fast(values, result_size, reverse=True):
@@ -432,18 +559,168 @@ def order_fast(values, result_size, reverse=True):
     return [ranked[i][1] for i in xrange(result_size)]
 
 
-def rorder(values, result_size):
-    """call the R version of order"""
-    r_order = robjects.r['order']
-    kwargs = {'decreasing': True}
-    res = r_order(robjects.FloatVector(values), **kwargs)
-    return res[:result_size]
+######################################################################
+### R vector expressions
+######################################################################
+# the functions that can be used in the R vector expressions of the
+# scaling_rvec and nmotifs_rvec settings
+RVEC_FUNCTIONS = {'c', 'seq', 'rep'}
+
+# the argument names of seq() and rep(), in their positional order;
+# 'length' and 'len' are R's partial matches of length.out
+RVEC_ARGUMENTS = {
+    'seq': ['from', 'to', 'by', 'length_out'],
+    'rep': ['x', 'times', 'length_out', 'each']
+}
+RVEC_ARGUMENT_ALIASES = {'length': 'length_out', 'len': 'length_out'}
+
+RVEC_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+                  ast.Div: np.true_divide, ast.Pow: np.power}
+
+
+def parse_rvec(rvecstr, num_iterations=None):
+    """evaluates the R vector expression rvecstr to a float array like R
+    would. Supported are numbers, num_iterations, the arithmetic operators
+    and the functions c(), seq() and rep(), e.g.
+    "c(rep(1e-5, 100), seq(1e-5, 1, length=num_iterations*3/4))".
+    Raises a ValueError for any other expression or an empty result"""
+    # R's ^ becomes Python's **, which has the same precedence, also over
+    # the unary minus
+    expression = rvecstr.strip().replace('length.out', 'length_out').replace('^', '**')
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        raise ValueError("can not parse R vector expression '%s'" % rvecstr)
+    try:
+        values = __eval_rvec(tree.body, num_iterations)
+    except ValueError as e:
+        raise ValueError("can not evaluate R vector expression '%s': %s" % (rvecstr, e))
+    if len(values) == 0:
+        raise ValueError("R vector expression '%s' is empty" % rvecstr)
+    return values
+
+
+def __rvec_number(node):
+    """the value of a number literal, None for any other node. Number
+    literals are ast.Num nodes before Python 3.8 and ast.Constant after"""
+    if type(node).__name__ == 'Num':
+        return node.n
+    if type(node).__name__ == 'Constant' and type(node.value) in (int, float):
+        return node.value
+    return None
+
+
+def __eval_rvec(node, num_iterations):
+    number = __rvec_number(node)
+    if number is not None:
+        return np.array([number], dtype=np.float64)
+    elif isinstance(node, ast.Name) and node.id == 'num_iterations':
+        if num_iterations is None:
+            raise ValueError('num_iterations is not known')
+        return np.array([num_iterations], dtype=np.float64)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = __eval_rvec(node.operand, num_iterations)
+        return -operand if isinstance(node.op, ast.USub) else operand
+    elif isinstance(node, ast.BinOp) and type(node.op) in RVEC_OPERATORS:
+        left = __eval_rvec(node.left, num_iterations)
+        right = __eval_rvec(node.right, num_iterations)
+        if len(left) != len(right) and len(left) != 1 and len(right) != 1:
+            raise ValueError('operands of different lengths')
+        return RVEC_OPERATORS[type(node.op)](left, right)
+    elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+          node.func.id in RVEC_FUNCTIONS):
+        args = [__eval_rvec(arg, num_iterations) for arg in node.args]
+        kwargs = {keyword.arg: __eval_rvec(keyword.value, num_iterations)
+                  for keyword in node.keywords}
+        if node.func.id == 'c':
+            if kwargs:
+                raise ValueError('c() does not take named arguments')
+            return np.concatenate(args) if args else np.zeros(0)
+        return __RVEC_EVALUATORS[node.func.id](__rvec_arguments(node.func.id, args, kwargs))
+    raise ValueError("unsupported element %s at column %d" % (type(node).__name__,
+                                                               node.col_offset + 1))
+
+
+def __rvec_arguments(function, args, kwargs):
+    """maps the positional and named arguments of function to its argument names"""
+    names = RVEC_ARGUMENTS[function]
+    if len(args) > len(names):
+        raise ValueError('too many arguments to %s()' % function)
+    result = dict(zip(names, args))
+    for name, value in kwargs.items():
+        name = RVEC_ARGUMENT_ALIASES.get(name, name)
+        if name not in names or name in result:
+            raise ValueError("invalid argument '%s' to %s()" % (name, function))
+        result[name] = value
+    return result
+
+
+def __scalar(args, name, default=None):
+    if name not in args:
+        return default
+    if len(args[name]) != 1:
+        raise ValueError("'%s' must be a single number" % name)
+    return args[name][0]
+
+
+def __rvec_seq(args):
+    """R's seq(from, to, by, length.out)"""
+    start = __scalar(args, 'from', 1.0)
+    end = __scalar(args, 'to')
+    step = __scalar(args, 'by')
+    length = __scalar(args, 'length_out')
+    if length is not None:
+        if length < 0:
+            raise ValueError("'length.out' must be non-negative")
+        length = int(math.ceil(length))
+        if step is not None and end is not None:
+            raise ValueError('too many arguments to seq()')
+        if step is not None:
+            return start + np.arange(length) * step
+        if end is None:
+            end = start + length - 1
+        return np.linspace(start, end, length)
+    if end is None:
+        if 'from' not in args or step is not None:
+            raise ValueError("seq() needs 'to' or 'length.out'")
+        start, end = 1.0, start
+    if step is None:
+        step = 1.0 if end >= start else -1.0
+    if step == 0.0 or (end - start) / step < 0.0:
+        raise ValueError("wrong sign in 'by'")
+    # R allows for a little rounding error in the number of steps
+    return start + np.arange(int(math.floor((end - start) / step + 1e-10)) + 1) * step
+
+
+def __rvec_rep(args):
+    """R's rep(x, times, length.out, each), non-integer counts are truncated"""
+    if 'x' not in args:
+        raise ValueError("rep() needs 'x'")
+    values = np.repeat(args['x'], int(__scalar(args, 'each', 1.0)))
+    times = args.get('times', np.ones(1))
+    if np.any(times < 0):
+        raise ValueError("invalid 'times' argument")
+    if len(times) == 1:
+        values = np.tile(values, int(times[0]))
+    elif len(times) == len(values):
+        values = np.repeat(values, times.astype(int))
+    else:
+        raise ValueError("invalid 'times' argument")
+    length = __scalar(args, 'length_out')
+    if length is not None:
+        values = np.resize(values, int(length)) if len(values) > 0 else values
+    return values
+
+
+__RVEC_EVALUATORS = {'seq': __rvec_seq, 'rep': __rvec_rep}
+
 
+def get_rvec_fun(rvecstr, num_iterations=None):
+    """make scaling function based on an R vector expression string. The
+    expression is evaluated once, iterations past its end get its last value"""
+    rvec = parse_rvec(rvecstr, num_iterations)
 
-def get_rvec_fun(rvecstr):
-    """make scaling function based on an R vector expression string"""
     def scale(iteration):
-        rvec = robjects.r(rvecstr)
         if iteration > len(rvec):
             return rvec[-1]
         else:
@@ -453,16 +730,12 @@ def get_rvec_fun(rvecstr):
 
 def get_iter_fun(params, prefix, num_iterations):
     """returns an iteration function for the given prefix from the configuration parameters"""
-    try:
+    if prefix + '_const' in params:
         constval = params[prefix + '_const']
         return lambda i: constval
-    except:
-        pass
-    try:
-        rvec = params[prefix + '_rvec']
-        return get_rvec_fun(rvec.replace('num_iterations', str(num_iterations)))
-    except:
-        raise Exception("no rvec found for prefix '%s'" % prefix)
+    if prefix + '_rvec' in params:
+        return get_rvec_fun(params[prefix + '_rvec'], num_iterations)
+    raise Exception("no rvec found for prefix '%s'" % prefix)
 
 ######################################################################
 ### Misc functionality
@@ -500,22 +773,225 @@ def which_multiple(elems):
     return {elem for elem, count in result.items() if count > 1}
 
 
+######################################################################
+# Worker pool
+#
+# The worker pool lives for the whole run instead of being forked for every
+# map() call. Since the workers are not forked again, the data a worker
+# function needs is not inherited from module globals, but installed into
+# each worker's WORKER_STATE through WorkerPool.broadcast().
+######################################################################
+
+WORKER_STATE = {}
+WORKER_BARRIER = None
+RUN_POOL = None
+
+# seconds a worker waits for the other workers to take their broadcast task
+BROADCAST_TIMEOUT = 60
+
+
+def worker_state():
+    """returns the state dictionary of the current worker process"""
+    return WORKER_STATE
+
+
+def init_worker(barrier, state, stats_backend):
+    """pool initializer, installs the initial state and the stats backend
+    of the parent into the new worker"""
+    # stats imports this module, so it can only be imported here
+    import cmonkey.stats as stats
+    global WORKER_BARRIER
+    WORKER_BARRIER = barrier
+    WORKER_STATE.clear()
+    if state is not None:
+        WORKER_STATE.update(state)
+    stats.set_backend(stats_backend)
+
+
+def install_worker_state(state):
+    """updates the worker state. Every worker waits on the barrier, so each
+    of them receives exactly one of the broadcast tasks. If a worker does
+    not arrive in time, the barrier breaks in all workers"""
+    WORKER_STATE.update(state)
+    WORKER_BARRIER.wait(BROADCAST_TIMEOUT)
+
+
+class WorkerPool:
+    """A persistent process pool. State is passed to the workers
+    explicitly: initial state through the pool initializer and everything
+    else through broadcast(). Readonly state is only sent to the workers
+    when the object changes."""
+
+    def __init__(self, num_cores=None, state=None, start_method=None):
+        """start_method selects 'fork', 'forkserver' or 'spawn', None is
+        the platform default. The workers use the current stats backend"""
+        import cmonkey.stats as stats
+        context = mp.get_context(start_method)
+        # forked workers inherit the resource tracker only if it is already
+        # running. Otherwise a worker that maps a shared block starts its own
+        # tracker, which removes the block when the worker exits. Before
+        # Python 3.8, there are neither shared blocks nor the tracker
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        except ImportError:
+            pass
+        self.num_workers = num_cores if num_cores else mp.cpu_count()
+        barrier = context.Barrier(self.num_workers)
+        self.__pool = context.Pool(self.num_workers, initializer=init_worker,
+                                   initargs=(barrier, state, stats.backend()))
+        self.__readonly = dict(state) if state is not None else {}
+
+    def broadcast(self, state=None, readonly=None):
+        """installs state in all workers. The entries in readonly are
+        skipped if the workers already have the same object"""
+        update = dict(state) if state is not None else {}
+        if readonly is not None:
+            for key, value in readonly.items():
+                if key not in self.__readonly or self.__readonly[key] is not value:
+                    self.__readonly[key] = value
+                    update[key] = value
+        if len(update) > 0:
+            try:
+                self.__pool.map(install_worker_state, [update] * self.num_workers,
+                                chunksize=1)
+            except threading.BrokenBarrierError:
+                raise Exception("broadcast failed: not all %d workers took the state "
+                                "within %d seconds, the worker pool can not be used "
+                                "anymore" % (self.num_workers, BROADCAST_TIMEOUT))
+
+    def map(self, fun, iterable):
+        return self.__pool.map(fun, iterable)
+
+    def close(self):
+        self.__pool.close()
+        self.__pool.join()
+
+
+def set_run_pool(pool):
+    """registers the pool that get_mp_pool() hands out, None to unregister"""
+    global RUN_POOL
+    RUN_POOL = pool
+
+
 class get_mp_pool:
-    """pool manager"""
+    """pool manager, returns the run's pool if there is one, otherwise
+    a temporary pool that is closed on exit"""
     def __init__(self, config_params={}):
         """use the configuration to return a pool with user-defined number of cores
         if possible"""
-        if 'num_cores' in config_params:
-            self.pool = mp.Pool(config_params['num_cores'])
+        if RUN_POOL is not None:
+            self.pool = RUN_POOL
+            self.__owned = False
         else:
-            self.pool = mp.Pool()
+            self.pool = WorkerPool(config_params.get('num_cores', None),
+                                   start_method=config_params.get('mp_start_method', None))
+            self.__owned = True
 
     def __enter__(self):
         return self.pool
 
     def __exit__(self, type, value, tb):
-        self.pool.close()
-        self.pool.join()
+        if self.__owned:
+            self.pool.close()
+
+
+def pool_map(config_params, fun, iterable, state=None, readonly=None):
+    """maps fun over iterable. fun reads its input data from worker_state(),
+    which contains the entries in state and readonly. If multiprocessing is
+    enabled, this runs in the worker pool, otherwise in this process"""
+    if config_params.get('multiprocessing', False):
+        with get_mp_pool(config_params) as pool:
+            pool.broadcast(state, readonly)
+            return pool.map(fun, iterable)
+
+    saved_state = dict(WORKER_STATE)
+    if readonly is not None:
+        WORKER_STATE.update(readonly)
+    if state is not None:
+        WORKER_STATE.update(state)
+    try:
+        return [fun(elem) for elem in iterable]
+    finally:
+        WORKER_STATE.clear()
+        WORKER_STATE.update(saved_state)
+
+
+######################################################################
+# Shared memory arrays
+#
+# Large readonly arrays can be moved into shared memory blocks. They are
+# pickled as a SharedArrayRef, so a worker maps the block by its name
+# instead of receiving a copy, independent of the start method.
+# multiprocessing.shared_memory needs Python 3.8, it is imported where the
+# blocks are created or mapped.
+######################################################################
+
+SHARED_BLOCKS = {}
+SHARED_ADDRESSES = {}
+OWNED_SHARED_BLOCKS = set()
+RELEASED_SHARED_BLOCKS = []
+
+
+class SharedArrayRef:
+    """a picklable reference to an array in a shared memory block"""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self):
+        """returns a view on the referenced array, the block is mapped on
+        first use"""
+        if self.name not in SHARED_BLOCKS:
+            from multiprocessing import shared_memory
+            register_shared_block(shared_memory.SharedMemory(name=self.name))
+        return np.ndarray(self.shape, dtype=self.dtype,
+                          buffer=SHARED_BLOCKS[self.name].buf)
+
+
+def register_shared_block(block):
+    """makes block known to shared_ref() and release_shared()"""
+    SHARED_BLOCKS[block.name] = block
+    address = np.frombuffer(block.buf, dtype=np.uint8).ctypes.data
+    SHARED_ADDRESSES[address] = block.name
+
+
+def to_shared(array):
+    """copies array into a new shared memory block and returns the view
+    on the block. The block lives until release_shared() is called"""
+    from multiprocessing import shared_memory
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    register_shared_block(block)
+    OWNED_SHARED_BLOCKS.add(block.name)
+    result = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    result[...] = array
+    return result
+
+
+def shared_ref(array):
+    """returns a SharedArrayRef if array starts at the beginning of a shared
+    memory block and is contiguous, None otherwise"""
+    if not isinstance(array, np.ndarray) or not array.flags.c_contiguous:
+        return None
+    name = SHARED_ADDRESSES.get(array.__array_interface__['data'][0], None)
+    if name is None:
+        return None
+    return SharedArrayRef(name, array.shape, array.dtype)
+
+
+def release_shared():
+    """removes the shared blocks that were created by this process. Arrays on
+    the blocks stay valid: the blocks are not unmapped, because unmapping
+    them under a live array would crash the process, they go away with it"""
+    for name in OWNED_SHARED_BLOCKS:
+        SHARED_BLOCKS[name].unlink()
+    RELEASED_SHARED_BLOCKS.extend(SHARED_BLOCKS.values())
+    SHARED_BLOCKS.clear()
+    SHARED_ADDRESSES.clear()
+    OWNED_SHARED_BLOCKS.clear()
 
 __all__ = ['DelimitedFile', 'best_matching_links', 'quantile',
            'DocumentNotFound', 'CMonkeyURLopener', 'read_url',
@@ -11,6 +11,8 @@ import xmlrunner
 import orig_membership_test as omembtest
 import datamatrix_test as dmtest
 import util_test as ut
+import stats_test as stt_test
+import cluster_stats_test as cst
 import organism_test as ot
 import seqtools_test as stt
 import thesaurus_test as tht
@@ -29,6 +31,7 @@ import microbes_online_test as mo_test
 import iteration_test
 import postproc_test
 import setenrichment_test as se_test
+import startup_test
 
 # pylint: disable-msg=C0301
 if __name__ == '__main__':
@@ -38,12 +41,20 @@ if __name__ == '__main__':
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.NoChangeFilterTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.CenterScaleFilterTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.QuantileNormalizeTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.ScoreArenaTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.DelimitedFileTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.UtilsTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.LevenshteinDistanceTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.BestMatchingLinksTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.Order2StringTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.RVecTest))
+
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(stt_test.NumpyStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(stt_test.KMeansPoolTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(cst.ClusterStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(cst.TrimMeanTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(stt_test.RStatsTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ot.MicrobeTest))
 
@@ -62,9 +73,11 @@ if __name__ == '__main__':
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(mat.ComputeArrayScoresTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(met.MemeTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(met.MemeVersionTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(pt.PssmTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ct.CombinerTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ct.CombineRecordedTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(rwt.ReadWeeTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(se_test.DiscreteEnrichmentSetTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(se_test.CutoffEnrichmentSetTest))
@@ -89,6 +102,10 @@ if __name__ == '__main__':
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(
         postproc_test.PostprocTest))
 
+    # startup_test
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(
+        startup_test.StartupTest))
+
     if len(sys.argv) > 1 and sys.argv[1] == 'xml':
       xmlrunner.XMLTestRunner(output='test-reports').run(unittest.TestSuite(SUITE))
     else:
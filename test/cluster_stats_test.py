@@ -0,0 +1,108 @@
+"""cluster_stats_test.py - test classes for cluster_stats module
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import unittest
+import numpy as np
+import cmonkey.cluster_stats as cs
+
+
+def make_scores(num_rows=40, num_clusters=7, seed=13):
+    """random scores with NaN values and a membership indicator with an
+    empty cluster, a cluster of one and a cluster of only NaN values"""
+    rng = np.random.RandomState(seed)
+    values = rng.normal(size=(num_rows, num_clusters))
+    values[rng.uniform(size=values.shape) < 0.1] = np.nan
+    indicator = rng.uniform(size=values.shape) < 0.3
+    indicator[:, 0] = False
+    indicator[:, 1] = False
+    indicator[5, 1] = True
+    values[indicator[:, 2], 2] = np.nan
+    return values, indicator
+
+
+def cluster_values(values, indicator, cluster):
+    """the non-NaN member values of a cluster"""
+    result = values[indicator[:, cluster], cluster]
+    return result[~np.isnan(result)]
+
+
+class ClusterStatsTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for ClusterStats"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        self.values, self.indicator = make_scores()
+        self.stats = cs.ClusterStats(self.values, self.indicator)
+
+    def __check(self, result, fun):
+        """compares result with fun applied to each cluster's values"""
+        for cluster in range(self.indicator.shape[1]):
+            expected = cluster_values(self.values, self.indicator, cluster)
+            if len(expected) == 0:
+                self.assertTrue(np.isnan(result[cluster]))
+            else:
+                self.assertAlmostEquals(fun(expected), result[cluster])
+
+    def test_counts(self):
+        """the number of non-NaN member values"""
+        self.assertEquals([len(cluster_values(self.values, self.indicator, cluster))
+                           for cluster in range(self.indicator.shape[1])],
+                          self.stats.counts.tolist())
+        self.assertEquals([0, 1, 0], self.stats.counts[:3].tolist())
+
+    def test_means(self):
+        """the means of the member values"""
+        self.__check(self.stats.means(), np.mean)
+
+    def test_medians(self):
+        """the medians of the member values"""
+        self.__check(self.stats.medians(), np.median)
+
+    def test_trim_means(self):
+        """the trimmed means of the member values"""
+        for trim in [0.0, 0.05, 0.1, 0.25, 0.5]:
+            self.__check(self.stats.trim_means(trim),
+                         lambda values: cs.trim_mean(values, trim))
+
+    def test_no_members(self):
+        """clusters without members have NaN statistics"""
+        stats = cs.ClusterStats(self.values, np.zeros(self.values.shape, dtype=bool))
+        self.assertEquals([0] * 7, stats.counts.tolist())
+        self.assertTrue(np.all(np.isnan(stats.means())))
+        self.assertTrue(np.all(np.isnan(stats.medians())))
+
+    def test_member_values(self):
+        """all member values, including NaN values"""
+        self.assertEquals(int(self.indicator.sum()),
+                          len(cs.member_values(self.values, self.indicator)))
+
+
+class TrimMeanTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for trim_mean()"""
+
+    def test_trim_mean(self):
+        """the mean of the sorted values without the trimmed ends"""
+        rng = np.random.RandomState(7)
+        for num_values in [1, 2, 19, 20, 101]:
+            values = rng.normal(size=num_values)
+            for trim in [0.0, 0.05, 0.1, 0.3]:
+                k = int(np.floor(trim * num_values))
+                expected = np.mean(np.sort(values)[k:num_values - k])
+                self.assertAlmostEquals(expected, cs.trim_mean(values, trim))
+
+    def test_trim_mean_nans(self):
+        """NaN values are ignored"""
+        self.assertAlmostEquals(2.0, cs.trim_mean([1.0, np.nan, 2.0, 3.0], 0.05))
+        self.assertEquals(0, cs.trim_mean([np.nan], 0.05))
+
+    def test_trim_mean_median(self):
+        """the median for trim 0.5"""
+        self.assertAlmostEquals(2.5, cs.trim_mean([4.0, 1.0, 2.0, 3.0], 0.5))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ClusterStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(TrimMeanTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
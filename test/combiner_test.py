@@ -4,8 +4,43 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import unittest
+import numpy as np
 import cmonkey.datamatrix as dm
+import cmonkey.membership as memb
 import cmonkey.scoring as s
+import cmonkey.util as util
+
+
+def read_matrix(filename):
+    """reads a matrix file"""
+    return dm.create_from_csv(filename, filters=[]).sorted_by_row_name()
+
+
+def read_members(filename):
+    """reads the cluster memberships of the R reference run"""
+    members = {}
+    with open(filename) as infile:
+        for line in infile:
+            row = line.strip().split(' ')
+            members.setdefault(row[0].replace('"', ''), []).extend(
+                [int(cluster) for cluster in row[1:]])
+    return members
+
+
+class ScoresFunction:
+    """returns a copy of the scores in a file, like a scoring function
+    returns a new result"""
+    def __init__(self, filename, scaling):
+        self.scores = read_matrix(filename)
+        self.scaling_value = scaling
+
+    def compute(self, iteration_result, ref_matrix=None):
+        return dm.DataMatrix.from_array(self.scores.values.copy(), self.scores.row_names,
+                                        self.scores.column_names)
+
+    def scaling(self, iteration):
+        return self.scaling_value
+
 
 class CombinerTest(unittest.TestCase):  # pylint: disable-msg=R0904
     """Test class for Pssm"""
@@ -15,3 +50,58 @@ class CombinerTest(unittest.TestCase):  # pylint: disable-msg=R0904
         m = dm.DataMatrix(2, 2, [[0.1, 0.2], [0.1, 0.2]])
         result = s.combine([m], [1.0], None, 1, {'quantile_normalize': True, 'debug': {},
                                                  'num_clusters': 42})
+
+
+class CombineRecordedTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """combines the halo row, motif and network scores of iteration 51 and
+    compares with the results that were recorded before combine() was
+    rewritten"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        self.config_params = {'memb.min_cluster_rows_allowed': 3,
+                              'memb.max_cluster_rows_allowed': 70,
+                              'memb.clusters_per_row': 2, 'memb.clusters_per_col': 29,
+                              'num_clusters': 43, 'multiprocessing': False,
+                              'log_subresults': False, 'debug': {},
+                              'quantile_normalize': False}
+        rows = read_members('testdata/row_memb-49.tsv')
+        cols = read_members('testdata/col_memb-49.tsv')
+        self.membership = memb.OrigMembership(sorted(rows), sorted(cols), rows, cols,
+                                              self.config_params)
+        self.functions = [
+            ScoresFunction('testdata/rowscores_fixed.tsv', 6.0),
+            ScoresFunction('testdata/motscores_fixed.tsv',
+                           util.get_rvec_fun('seq(0, 1, length=num_iterations*3/4)', 2000)(51)),
+            ScoresFunction('testdata/netscores_fixed.tsv',
+                           util.get_rvec_fun('seq(1e-5, 0.5, length=num_iterations*3/4)', 2000)(51))]
+
+    def __combine(self):
+        return s.combine([fun.compute(None) for fun in self.functions],
+                         [fun.scaling(51) for fun in self.functions],
+                         self.membership, 51, self.config_params)
+
+    def test_combine_mad(self):
+        """the scores are scaled by the MAD of the cluster members"""
+        ref_scores = read_matrix('testdata/combiner_mad_scores.tsv')
+        result = self.__combine()
+        self.assertEquals(ref_scores.row_names, result.row_names)
+        self.assertTrue(np.allclose(ref_scores.values, result.values, rtol=0, atol=1e-12))
+
+    def test_combine_quantile_normalize(self):
+        """the scores are quantile normalized"""
+        self.config_params['quantile_normalize'] = True
+        ref_scores = read_matrix('testdata/combiner_qnorm_scores.tsv')
+        result = self.__combine()
+        self.assertTrue(np.allclose(ref_scores.values, result.values, rtol=0, atol=1e-12))
+
+    def test_combiner_reuses_values(self):
+        """the combiner writes each result into the values of the previous one"""
+        combiner = s.ScoringFunctionCombiner(None, self.membership, self.functions,
+                                             self.config_params)
+        first = combiner.compute({'iteration': 51})
+        first_values = first.values.copy()
+        second = combiner.compute({'iteration': 51})
+        self.assertTrue(first.values is second.values)
+        self.assertTrue(np.array_equal(first_values, second.values))
+        ref_scores = read_matrix('testdata/combiner_mad_scores.tsv')
+        self.assertTrue(np.allclose(ref_scores.values, second.values, rtol=0, atol=1e-12))
@@ -5,6 +5,7 @@ more information and licensing details.
 """
 import unittest
 import copy
+import pickle
 import cmonkey.datamatrix as dm
 import numpy as np
 import cmonkey.util as util
@@ -160,6 +161,60 @@ class DataMatrixTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertEquals(submatrix.column_names, ['C0', 'C1'])
         self.assertTrue((submatrix.values == [[3, 4], [7, 8]]).all())
 
+    def test_submatrix_by_index(self):
+        """test creating sub matrices by row/column index arrays"""
+        matrix = dm.DataMatrix(4, 4,
+                               row_names=['R0', 'R1', 'R2', 'R3'],
+                               col_names=['C0', 'C1', 'C2', 'C3'],
+                               values=[[1, 2, 3, 4],
+                                       [4, 5, 6, 7],
+                                       [8, 9, 10, 11],
+                                       [12, 13, 14, 15]])
+        submatrix = matrix.submatrix_by_index(np.array([0, 2]), np.array([1, 3]))
+        self.assertEquals(submatrix.row_names, ['R0', 'R2'])
+        self.assertEquals(submatrix.column_names, ['C1', 'C3'])
+        self.assertEquals(2, submatrix.num_rows)
+        self.assertEquals(2, submatrix.num_columns)
+        self.assertTrue((submatrix.values == [[2, 4],
+                                              [9, 11]]).all())
+        submatrix.values[0, 0] = 42
+        self.assertEquals(2, matrix.values[0, 1])
+
+    def test_submatrix_by_index_view(self):
+        """contiguous selections in view mode share the values"""
+        matrix = dm.DataMatrix(4, 4,
+                               row_names=['R0', 'R1', 'R2', 'R3'],
+                               col_names=['C0', 'C1', 'C2', 'C3'],
+                               values=[[1, 2, 3, 4],
+                                       [4, 5, 6, 7],
+                                       [8, 9, 10, 11],
+                                       [12, 13, 14, 15]])
+        submatrix = matrix.submatrix_by_index(np.array([1, 2]), None, view=True)
+        self.assertEquals(submatrix.row_names, ['R1', 'R2'])
+        self.assertEquals(submatrix.column_names, ['C0', 'C1', 'C2', 'C3'])
+        self.assertTrue((submatrix.values == [[4, 5, 6, 7],
+                                              [8, 9, 10, 11]]).all())
+        submatrix.values[0, 0] = 42
+        self.assertEquals(42, matrix.values[1, 0])
+
+        # non-contiguous selections can not be views
+        submatrix = matrix.submatrix_by_index(np.array([0, 2]), np.array([0, 3]), view=True)
+        self.assertTrue((submatrix.values == [[1, 4], [8, 11]]).all())
+
+    def test_submatrix_by_name_unsorted_names(self):
+        """the selection is ordered by name, even if the matrix is not"""
+        matrix = dm.DataMatrix(3, 2,
+                               row_names=['R2', 'R0', 'R1'],
+                               col_names=['C1', 'C0'],
+                               values=[[1, 2],
+                                       [3, 4],
+                                       [5, 6]])
+        submatrix = matrix.submatrix_by_name(row_names={'R2', 'R1', 'R5'},
+                                             column_names=['C0', 'C1'])
+        self.assertEquals(submatrix.row_names, ['R1', 'R2'])
+        self.assertEquals(submatrix.column_names, ['C0', 'C1'])
+        self.assertTrue((submatrix.values == [[6, 5], [2, 1]]).all())
+
     def test_sorted_by_rowname(self):
         matrix = dm.DataMatrix(3, 3,
                                row_names=['R0', 'R2', 'R1'],
@@ -301,6 +356,21 @@ class DataMatrixTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertAlmostEquals(matrix.values[2, 0], 0.0)
         self.assertAlmostEquals(matrix.values[2, 1], 0.0)
 
+    def test_share_values(self):
+        """a matrix with shared values is pickled as a reference to the block"""
+        matrix = dm.DataMatrix(300, 20, values=np.arange(6000.0).reshape(300, 20))
+        try:
+            matrix.share_values()
+            self.assertTrue(len(pickle.dumps(matrix)) < 6000 * 8)
+            copied = pickle.loads(pickle.dumps(matrix))
+            self.assertTrue((copied.values == np.arange(6000.0).reshape(300, 20)).all())
+            matrix.values[0, 0] = -1.0
+            self.assertEquals(-1.0, copied.values[0, 0])
+            self.assertEquals(matrix.row_names, copied.row_names)
+        finally:
+            util.release_shared()
+        # after the release, matrices are pickled with their values again
+        self.assertTrue(len(pickle.dumps(matrix)) > 6000 * 8)
 
 
 class MockDelimitedFile:  # pylint: disable-msg=R0903
@@ -447,6 +517,13 @@ class QuantileNormalizeTest(unittest.TestCase): # pylint: disable-msg=R0904
         self.assertTrue((qm1.values == [[2, 1], [3, 4]]).all())
         self.assertTrue((qm2.values == [[4, 3], [2, 1]]).all())
 
+    def test_qm_result_matrices_ties(self):
+        """tied values get the mean at the smallest rank of their group"""
+        m1 = dm.DataMatrix(2, 2, values=[[0, 0], [0, -1]])
+        tmp_mean = np.array([1.0, 2.0, 3.0, 4.0])
+        result = dm.qm_result_matrices([m1], tmp_mean)
+        self.assertTrue((result[0].values == [[2, 2], [2, 1]]).all())
+
     def test_quantile_normalize_scores_with_all_defined_weights(self):
         """happy path for quantile normalization"""
         m1 = dm.DataMatrix(2, 2, values=[[1, 3], [2, 4]])
@@ -502,6 +579,115 @@ class QuantileNormalizeTest(unittest.TestCase): # pylint: disable-msg=R0904
         self.assertAlmostEqual(3.0, outmatrix2[1][1])
 
 
+class ClusterResidualsTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for cluster_residuals() and ClusterResiduals"""
+
+    def __read_ratios(self):
+        ratios = dm.create_from_csv('testdata/row_scores_testratios.tsv', filters=[],
+                                    case_sensitive=True)
+        ratios.values[::13, 2] = np.nan
+        return ratios
+
+    def __read_indicators(self, ratios):
+        """the halo sample memberships as (rows x 43) and (columns x 43)
+        indicators in the order of the ratios"""
+        rows = np.zeros((ratios.num_rows, 43), dtype=bool)
+        row_indexes = {name: index for index, name in enumerate(ratios.row_names)}
+        with open('testdata/row_membership.tsv') as infile:
+            for line in infile:
+                row = line.strip().split('\t')
+                rows[row_indexes[row[0]], int(row[1]) - 1] = True
+        cols = np.zeros((ratios.num_columns, 43), dtype=bool)
+        col_indexes = {name: index for index, name in enumerate(ratios.column_names)}
+        with open('testdata/column_membership.tsv') as infile:
+            for line in infile:
+                row = line.strip().split('\t')
+                for cluster in row[1].split(':'):
+                    cols[col_indexes[row[0]], int(cluster) - 1] = True
+        return rows, cols
+
+    def __check_residuals(self, ratios, rows, cols, residuals):
+        for cluster in range(rows.shape[1]):
+            row_names = dm.select_names(ratios.row_names, np.nonzero(rows[:, cluster])[0])
+            col_names = dm.select_names(ratios.column_names, np.nonzero(cols[:, cluster])[0])
+            if len(row_names) == 0 or len(col_names) == 0:
+                self.assertTrue(np.isnan(residuals[cluster]))
+            else:
+                refresidual = ratios.submatrix_by_name(row_names, col_names).residual()
+                self.assertTrue(abs(refresidual - residuals[cluster]) < 1e-10)
+
+    def test_cluster_residuals(self):
+        """the batched residuals are the residuals of the submatrices"""
+        ratios = self.__read_ratios()
+        rows, cols = self.__read_indicators(ratios)
+        self.__check_residuals(ratios, rows, cols, dm.cluster_residuals(ratios, rows, cols))
+
+    def test_cluster_residuals_subset(self):
+        """the residuals of selected clusters are the same as of all clusters"""
+        ratios = self.__read_ratios()
+        rows, cols = self.__read_indicators(ratios)
+        residuals = dm.cluster_residuals(ratios, rows, cols)
+        self.assertTrue(np.allclose(residuals[[4, 9]],
+                                    dm.cluster_residuals(ratios, rows, cols, [4, 9]),
+                                    rtol=0.0, atol=1e-12))
+
+    def test_cluster_residuals_cached(self):
+        """only the changed clusters are recomputed"""
+        ratios = self.__read_ratios()
+        rows, cols = self.__read_indicators(ratios)
+        cache = dm.ClusterResiduals(ratios)
+        cache.residuals(rows, cols)
+        rows[np.nonzero(rows[:, 0])[0][0], 0] = False
+        rows[0, 5] = True
+        cols[1, 7] = not cols[1, 7]
+        rows[:, 42] = False
+        compute = dm.cluster_residuals
+        computed = []
+
+        def record(matrix, row_indicator, col_indicator, clusters=None):
+            computed.extend(clusters)
+            return compute(matrix, row_indicator, col_indicator, clusters)
+        try:
+            dm.cluster_residuals = record
+            residuals = cache.residuals(rows, cols)
+        finally:
+            dm.cluster_residuals = compute
+        self.assertEquals([0, 5, 7, 42], sorted(computed))
+        self.__check_residuals(ratios, rows, cols, residuals)
+
+
+class ScoreArenaTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for ScoreArena"""
+
+    def test_values_reused(self):
+        """the same key and shape return the same array"""
+        arena = dm.ScoreArena()
+        values = arena.values('Rows', (3, 2), 0.0)
+        values[1, 1] = 4.0
+        self.assertTrue(values is arena.values('Rows', (3, 2)))
+        self.assertEquals(4.0, values[1, 1])
+        self.assertEquals(0.0, arena.values('Rows', (3, 2), 0.0)[1, 1])
+        self.assertFalse(values is arena.values('Networks', (3, 2)))
+        self.assertEquals(96, arena.nbytes())
+
+    def test_values_reallocated(self):
+        """a new shape replaces the array of the key"""
+        arena = dm.ScoreArena()
+        values = arena.values('Rows', (3, 2))
+        self.assertEquals((4, 2), arena.values('Rows', (4, 2)).shape)
+        self.assertFalse(values is arena.values('Rows', (3, 2)))
+        self.assertEquals(48, arena.nbytes())
+
+    def test_matrix(self):
+        """matrices wrap the arena values and have the default column names"""
+        arena = dm.ScoreArena()
+        matrix = arena.matrix('Rows', ['R1', 'R2'], 3, 1.5)
+        self.assertEquals(['R1', 'R2'], matrix.row_names)
+        self.assertEquals(dm.DataMatrix(2, 3).column_names, matrix.column_names)
+        self.assertEquals([[1.5, 1.5, 1.5], [1.5, 1.5, 1.5]], matrix.values.tolist())
+        self.assertTrue(matrix.values is arena.matrix('Rows', ['R1', 'R2'], 3).values)
+
+
 if __name__ == '__main__':
     SUITE = []
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(QuantileNormalizeTest))
@@ -509,4 +695,6 @@ if __name__ == '__main__':
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(DataMatrixReadWriteTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CenterScaleFilterTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(NoChangeFilterTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ClusterResidualsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ScoreArenaTest))
     unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -14,6 +14,7 @@ import cmonkey.microbes_online as microbes_online
 import cmonkey.stringdb as stringdb
 import cmonkey.datamatrix as dm
 import cmonkey.membership as memb
+import cmonkey.stats as stats
 import cmonkey.microarray as microarray
 import cmonkey.scoring as scoring
 import cmonkey.network as nw
@@ -199,6 +200,21 @@ class IterationTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertTrue(check_matrix_values(rds, ref_rowscores, eps=1e-11))
         self.assertTrue(check_matrix_values(cds, ref_colscores, eps=1e-11))
 
+    def test_density_scores_r(self):
+        # density score computation with the R backend
+        self.membership = self.__read_members()
+        row_scores = read_matrix('testdata/combined_scores.tsv')
+        col_scores = read_matrix('testdata/combined_colscores.tsv')
+        ref_rowscores = read_matrix('testdata/density_rowscores.tsv')
+        ref_colscores = read_matrix('testdata/density_colscores.tsv')
+        stats.set_backend('r')
+        try:
+            rds, cds = memb.get_density_scores(self.membership, row_scores, col_scores)
+        finally:
+            stats.set_backend(stats.DEFAULT_BACKEND)
+        self.assertTrue(check_matrix_values(rds, ref_rowscores, eps=1e-11))
+        self.assertTrue(check_matrix_values(cds, ref_colscores, eps=1e-11))
+
     def test_size_compensation(self):
         # tests the size compensation
         row_scores = read_matrix('testdata/density_rowscores.tsv')
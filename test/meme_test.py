@@ -6,7 +6,11 @@ more information and licensing details.
 """
 import cmonkey.meme.meme as meme
 import cmonkey.meme.mast as mast
+import cmonkey.meme_suite as meme_suite
 import unittest
+import os
+import shutil
+import tempfile
 
 
 class MemeTest(unittest.TestCase):  # pylint: disable-msg=R0904
@@ -177,5 +181,53 @@ class MemeTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertTrue('NP_280363.1' in annotations)
 
 
+# a meme replacement that reports its version and counts its runs
+FAKE_MEME = """#!/bin/sh
+echo run >> "$(dirname "$0")/runs"
+echo "MEME version %s (Release date: today)"
+"""
+
+
+class MemeVersionTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for check_meme_version()"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        self.bin_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.bin_dir, 'cache')
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.bin_dir + os.pathsep + self.path
+        self.__write_meme('5.1.1', 1000)
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.bin_dir)
+
+    def __write_meme(self, version, mtime):
+        meme_path = os.path.join(self.bin_dir, 'meme')
+        with open(meme_path, 'w') as outfile:
+            outfile.write(FAKE_MEME % version)
+        os.chmod(meme_path, 0o755)
+        os.utime(meme_path, (mtime, mtime))
+
+    def __num_runs(self):
+        with open(os.path.join(self.bin_dir, 'runs')) as infile:
+            return len(infile.readlines())
+
+    def test_cached_version(self):
+        """meme only runs again after the binary changed"""
+        self.assertEqual('5.1.1', meme_suite.check_meme_version(self.cache_dir))
+        self.assertEqual('5.1.1', meme_suite.check_meme_version(self.cache_dir))
+        self.assertEqual(1, self.__num_runs())
+        self.__write_meme('5.3.0', 2000)
+        self.assertEqual('5.3.0', meme_suite.check_meme_version(self.cache_dir))
+        self.assertEqual(2, self.__num_runs())
+
+    def test_no_cache_dir(self):
+        """without a cache directory meme runs every time"""
+        meme_suite.check_meme_version()
+        self.assertEqual('5.1.1', meme_suite.check_meme_version())
+        self.assertEqual(2, self.__num_runs())
+
+
 if __name__ == '__main__':
     unittest.main()
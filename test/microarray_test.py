@@ -12,6 +12,29 @@ import cmonkey.scoring as scoring
 import numpy
 
 
+class ScoringRun:
+    """the parts of a CMonkeyRun that the scoring functions use"""
+    def __init__(self, ratios, membership, arena):
+        self.ratios = ratios
+        self.config_params = {'Rows': {'schedule': lambda i: True},
+                              'Columns': {'schedule': lambda i: True},
+                              'use_BSCM': False, 'use_chi2': False}
+        self.__membership = membership
+        self.__arena = arena
+
+    def organism(self):
+        return None
+
+    def membership(self):
+        return self.__membership
+
+    def dbsession(self):
+        return None
+
+    def score_arena(self):
+        return self.__arena
+
+
 class ComputeArrayScoresTest(unittest.TestCase):
     """compute_row_scores"""
     def __read_members(self):
@@ -32,7 +55,7 @@ class ComputeArrayScoresTest(unittest.TestCase):
         return memb.OrigMembership(sorted(row_members.keys()),
                                    sorted(column_members.keys()),
                                    row_members, column_members,
-                                   {'memb.num_clusters': 43,
+                                   {'memb.num_clusters': 43, 'num_clusters': 43,
                                     'memb.clusters_per_row': 2,
                                     'memb.clusters_per_col': 29 })
 
@@ -77,6 +100,158 @@ class ComputeArrayScoresTest(unittest.TestCase):
                                                {'multiprocessing': True, 'num_cores': None})
         self.__compare_with_refresult(refresult, result)
 
+    def test_compute_row_scores_batched(self):
+        """the batched kernel reproduces the per-cluster computation"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        result = ma.compute_row_scores_batched(membership, ratios, 43)
+        refresult = ma.compute_row_scores_reference(membership, ratios, 43,
+                                                    {'multiprocessing': False})
+        self.__compare_exact(refresult.values, result)
+
+    def test_compute_row_scores_batched_with_nans(self):
+        """the batched kernel reproduces the per-cluster computation on
+        a matrix with missing values"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        values = ratios.values
+        values[::7, 1] = numpy.nan
+        values[::11, 3] = numpy.nan
+        values[5] = numpy.nan
+        result = ma.compute_row_scores_batched(membership, ratios, 43)
+        refresult = ma.compute_row_scores_reference(membership, ratios, 43,
+                                                    {'multiprocessing': False})
+        self.__compare_exact(refresult.values, result)
+
+    def test_compute_column_scores_batched(self):
+        """the batched column scores reproduce the per-cluster computation"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        result = scoring.compute_column_scores(membership, ratios, 43,
+                                               {'multiprocessing': False})
+        refresult = scoring.compute_column_scores_reference(membership, ratios, 43,
+                                                            {'multiprocessing': False})
+        self.assertEquals(refresult.row_names, result.row_names)
+        self.__compare_exact(refresult.values, result.values)
+
+    def test_compute_column_scores_batched_with_nans(self):
+        """the batched column scores reproduce the per-cluster computation on
+        a matrix with missing values"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        values = ratios.values
+        values[::7, 1] = numpy.nan
+        values[::5, 3] = numpy.nan
+        values[:, 4] = numpy.nan
+        result = scoring.compute_column_scores_batched(membership, ratios, 43)
+        refresult = scoring.compute_column_scores_reference(membership, ratios, 43,
+                                                            {'multiprocessing': False})
+        self.__compare_exact(refresult.values, result)
+
+    def test_compute_row_scores_batched_large_values(self):
+        """the small deviations of the other genes are kept next to a gene
+        with very large values"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        ratios.values[0] *= 1.0e6
+        result = ma.compute_row_scores_batched(membership, ratios, 43)
+        refresult = ma.compute_row_scores_reference(membership, ratios, 43,
+                                                    {'multiprocessing': False})
+        self.__compare_exact(refresult.values[1:], result[1:])
+
+    def test_row_score_statistics_replay(self):
+        """the incrementally updated row score statistics match a full
+        recompute within 1e-8 over 50 iterations of membership changes"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        values = ratios.values
+        values[::7, 1] = numpy.nan
+        values[::11, 3] = numpy.nan
+        statistics = ma.RowScoreStatistics(ratios, 43)
+        statistics.recompute(membership)
+        random = numpy.random.RandomState(17)
+        for iteration in range(50):
+            for _ in range(random.randint(1, 30)):
+                row = membership.row_names[random.randint(0, len(membership.row_names))]
+                membership.replace_row_cluster(row, random.randint(0, 2),
+                                               random.randint(0, 44))
+            for _ in range(random.randint(0, 10)):
+                col = membership.col_names[random.randint(0, len(membership.col_names))]
+                membership.replace_column_cluster(col, random.randint(0, 29),
+                                                  random.randint(0, 44))
+            if iteration % 10 == 5:
+                # a cluster loses all rows
+                cluster = random.randint(1, 44)
+                for row in membership.rows_for_cluster(cluster):
+                    membership.remove_cluster_from_row(row, cluster)
+            statistics.update(membership)
+            self.__compare_exact(ma.compute_row_scores_batched(membership, ratios, 43),
+                                 statistics.row_scores(), eps=1e-8)
+
+    def test_row_score_statistics_out(self):
+        """the row scores are written into the given array"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        statistics = ma.RowScoreStatistics(ratios, 43)
+        statistics.recompute(membership)
+        out = numpy.zeros((ratios.num_rows, 43))
+        self.assertTrue(out is statistics.row_scores(out=out))
+        self.assertTrue(numpy.array_equal(statistics.row_scores(), out, equal_nan=True))
+        self.__compare_exact(ma.compute_row_scores_batched(membership, ratios, 43), out)
+
+    def test_scoring_functions_arena(self):
+        """with an arena, the row and column scoring functions reuse the
+        values of their previous results and compute the same scores"""
+        membership = self.__read_members()
+        ratios = self.__read_ratios()
+        results = []
+        for arena in [None, dm.ScoreArena()]:
+            run = ScoringRun(ratios, membership, arena)
+            row_scoring = ma.RowScoringFunction('Rows', run)
+            col_scoring = scoring.ColumnScoringFunction('Columns', run)
+            first = [row_scoring.do_compute({}), col_scoring.do_compute({})]
+            second = [row_scoring.do_compute({}), col_scoring.do_compute({})]
+            for first_result, second_result in zip(first, second):
+                self.assertEquals(arena is not None,
+                                  first_result.values is second_result.values)
+            results.append(second)
+        for result, arena_result in zip(*results):
+            self.assertEquals(result.row_names, arena_result.row_names)
+            self.assertEquals(result.column_names, arena_result.column_names)
+            self.assertTrue(numpy.array_equal(result.values, arena_result.values,
+                                              equal_nan=True))
+
+    def test_seed_column_members(self):
+        """the column scores of the seeded clusters match the per-cluster
+        submatrix scores and each column picks the lowest ones"""
+        ratios = self.__read_ratios()
+        ratios.values[::9, 1] = numpy.nan
+        random = numpy.random.RandomState(11)
+        # cluster 43 has no rows
+        row_membership = [[int(cluster), 0] for cluster in random.randint(1, 43, ratios.num_rows)]
+        cscores = ma.seed_column_scores(ratios, numpy.array([slots[0] for slots in row_membership]),
+                                        43)
+        for cluster in range(1, 44):
+            rows = [ratios.row_names[i] for i in range(ratios.num_rows)
+                    if row_membership[i][0] == cluster]
+            _, scores = scoring.compute_column_scores_submatrix(
+                ratios.submatrix_by_name(row_names=rows))
+            self.assertTrue(numpy.allclose(scores, cscores[:, cluster - 1],
+                                           rtol=1e-12, atol=0.0, equal_nan=True))
+        self.assertTrue(numpy.all(numpy.isnan(cscores[:, 42])))
+
+        column_members = ma.seed_column_members(ratios, row_membership, 43, 29)
+        for col in range(ratios.num_columns):
+            self.assertEquals(29, len(column_members[col]))
+            self.assertEquals(sorted(cscores[col])[:29],
+                              sorted(cscores[col, numpy.array(column_members[col]) - 1]))
+
+    def __compare_exact(self, refvalues, values, eps=1e-9):
+        self.assertEquals(refvalues.shape, values.shape)
+        self.assertTrue((numpy.isnan(refvalues) == numpy.isnan(values)).all())
+        finite = numpy.isfinite(refvalues)
+        self.assertTrue(numpy.all(numpy.abs(refvalues[finite] - values[finite]) < eps))
+
     def __compare_with_refresult(self, refresult, result):
         self.assertEquals(refresult.num_rows, result.num_rows)
         self.assertEquals(refresult.num_columns, result.num_columns)
@@ -4,7 +4,12 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import unittest
+import math
+import numpy as np
+import pickle
+import cmonkey.util as util
 import cmonkey.membership as memb
+import cmonkey.stats as stats
 import cmonkey.datamatrix as dm
 import cmonkey.microarray as ma
 import cmonkey.scoring
@@ -198,6 +203,365 @@ class OrigMembershipTest(unittest.TestCase):
         self.assertEquals(0, len(m.free_slots_for_column('C2')))
         self.assertEquals(4, len(m.free_slots_for_column('C1')))
 
+    def test_get_best_clusters(self):
+        """the best clusters are returned as an int array in row order"""
+        scores = dm.DataMatrix(2, 4, ['R1', 'R2'], ['1', '2', '3', '4'],
+                               values=[[0.1, 0.7, 0.2, 0.7], [0.5, 0.1, 0.9, 0.3]])
+        self.assertEquals([[2, 4], [3, 1]],
+                          memb.get_best_clusters(scores, 2).tolist())
+        self.assertEquals([[2, 4], [1, 3]],
+                          memb.get_best_clusters(scores, 2, sort=True).tolist())
+
+    def __make_fuzzify_input(self, seed):
+        config_params = dict(CONFIG_PARAMS)
+        config_params['random_seed'] = seed
+        row_names = ['R%d' % i for i in range(200)]
+        m = memb.OrigMembership(row_names, ['C1', 'C2'],
+                                {name: [i % 43 + 1, (i + 7) % 43 + 1]
+                                 for i, name in enumerate(row_names)},
+                                {'C1': [1, 2], 'C2': [3]}, config_params)
+        rand = np.random.RandomState(11)
+        row_scores = dm.DataMatrix(200, 43, row_names, values=rand.normal(size=(200, 43)))
+        col_scores = dm.DataMatrix(2, 43, ['C1', 'C2'], values=rand.normal(size=(2, 43)))
+        return m, row_scores, col_scores
+
+    def test_fuzzify_seeded(self):
+        """the fuzz is drawn from a generator seeded by random_seed"""
+        m1, rscores1, cscores1 = self.__make_fuzzify_input(42)
+        m2, rscores2, cscores2 = self.__make_fuzzify_input(42)
+        m3, rscores3, cscores3 = self.__make_fuzzify_input(43)
+        orig_rvalues = rscores1.values.copy()
+        orig_cvalues = cscores1.values.copy()
+        iteration_result = {'iteration': 1}
+        memb.fuzzify(m1, rscores1, cscores1, 2000, iteration_result, 'rows')
+        memb.fuzzify(m2, rscores2, cscores2, 2000, {'iteration': 1}, 'rows')
+        memb.fuzzify(m3, rscores3, cscores3, 2000, {'iteration': 1}, 'rows')
+        self.assertTrue((rscores1.values == rscores2.values).all())
+        self.assertFalse((rscores1.values == rscores3.values).all())
+        self.assertFalse((rscores1.values == orig_rvalues).any())
+        self.assertTrue((cscores1.values == orig_cvalues).all())
+        self.assertAlmostEqual(memb.old_fuzzy_coefficient(1, 2000),
+                               iteration_result['fuzzy-coeff'])
+
+    def test_fuzzify_sd(self):
+        """the noise has the standard deviation of the member scores
+        scaled by the fuzzy coefficient"""
+        m, rscores, cscores = self.__make_fuzzify_input(42)
+        orig_values = rscores.values.copy()
+        members = np.zeros((200, 43), dtype=bool)
+        for i in range(200):
+            members[i, [i % 43, (i + 7) % 43]] = True
+        expected_sd = np.std(orig_values[members], ddof=1) * memb.old_fuzzy_coefficient(1, 2000)
+        memb.fuzzify(m, rscores, cscores, 2000, {'iteration': 1}, 'both')
+        self.assertAlmostEqual(expected_sd, np.std(rscores.values - orig_values), delta=expected_sd * 0.05)
+        # only C1 in cluster 1 and 2, C2 in cluster 3: 3 member values
+        self.assertFalse(np.isnan(cscores.values).any())
+
+    def test_share_arrays(self):
+        """shared membership arrays are pickled as references, changes
+        in the original arrays are seen by the copy"""
+        m = memb.OrigMembership(['R1', 'R2'], ['C1', 'C2'],
+                                {'R1': [1, 5], 'R2': []}, {'C1': [3], 'C2': []},
+                                CONFIG_PARAMS)
+        try:
+            m.share_arrays()
+            copied = pickle.loads(pickle.dumps(m))
+            self.assertEquals({'R1'}, copied.rows_for_cluster(1))
+            m.add_cluster_to_row('R2', 1)
+            self.assertEquals([1, 0], copied.row_membs[1].tolist())
+            self.assertEquals({'R1', 'R2'}, pickle.loads(pickle.dumps(m)).rows_for_cluster(1))
+            # growing the arrays keeps them shared
+            m.add_cluster_to_row('R1', 7, force=True)
+            self.assertEquals({'R1'}, pickle.loads(pickle.dumps(m)).rows_for_cluster(7))
+            self.assertIsNotNone(util.shared_ref(m.row_membs))
+        finally:
+            util.release_shared()
+
+    def __check_index(self, m, seed):
+        """compares the incremental indexes with a brute-force rebuild"""
+        for cluster in range(0, 45):
+            expected = sorted(set(np.where(m.row_membs == cluster)[0])) if cluster > 0 else []
+            self.assertEquals(expected, m.row_indexes_for_cluster(cluster).tolist(),
+                              'seed %d, row cluster %d' % (seed, cluster))
+            expected = sorted(set(np.where(m.col_membs == cluster)[0])) if cluster > 0 else []
+            self.assertEquals(expected, m.column_indexes_for_cluster(cluster).tolist(),
+                              'seed %d, column cluster %d' % (seed, cluster))
+            self.assertEquals(len(expected), m.num_column_members(cluster))
+
+    def __check_indicators(self, m, seed):
+        """compares the indicator matrices with the name-based queries"""
+        for indicator, dense, names, members_of in [
+                (m.row_indicator(), m.row_indicator(dense=True), m.row_names, m.rows_for_cluster),
+                (m.col_indicator(), m.col_indicator(dense=True), m.col_names,
+                 m.columns_for_cluster)]:
+            self.assertEquals((len(names), 43), indicator.shape)
+            self.assertEquals(dense.tolist(), (indicator.toarray() == 1.0).tolist())
+            self.assertEquals(indicator.nnz, int(indicator.sum()))
+            for cluster in range(1, 44):
+                self.assertEquals(members_of(cluster),
+                                  {names[i] for i in np.flatnonzero(dense[:, cluster - 1])},
+                                  'seed %d, cluster %d' % (seed, cluster))
+
+    def test_cluster_index_random_updates(self):
+        """the cluster indexes stay equal to a rebuild from the membership
+        arrays under random sequences of updates"""
+        row_names = ['R%d' % i for i in range(30)]
+        col_names = ['C%d' % i for i in range(8)]
+        for seed in range(20):
+            random = np.random.RandomState(seed)
+            m = memb.OrigMembership(row_names, col_names,
+                                    {row: list(random.randint(1, 44, 2)) for row in row_names},
+                                    {col: list(random.randint(1, 44, 3)) for col in col_names},
+                                    CONFIG_PARAMS)
+            for _ in range(100):
+                op = random.randint(0, 8)
+                row = row_names[random.randint(0, len(row_names))]
+                col = col_names[random.randint(0, len(col_names))]
+                cluster = int(random.randint(1, 44))
+                force = random.rand() < 0.1
+                if op == 0 and (force or len(m.free_slots_for_row(row)) > 0):
+                    m.add_cluster_to_row(row, cluster, force=force)
+                elif op == 1 and (force or len(m.free_slots_for_column(col)) > 0):
+                    m.add_cluster_to_column(col, cluster, force=force)
+                elif op == 2:
+                    m.replace_row_cluster(row, random.randint(0, m.row_membs.shape[1]), cluster)
+                elif op == 3:
+                    m.replace_column_cluster(col, random.randint(0, m.col_membs.shape[1]), cluster)
+                elif op == 4:
+                    m.remove_cluster_from_row(row, m.row_membs[m.rowidx[row], 0])
+                elif op == 5:
+                    m.remove_cluster_from_column(col, m.col_membs[m.colidx[col], 0])
+                elif op == 6:
+                    m.replace_row_cluster(row, random.randint(0, m.row_membs.shape[1]), 0)
+                else:
+                    m.rows_for_cluster(cluster)
+                if random.rand() < 0.1:
+                    self.__check_index(m, seed)
+                    self.__check_indicators(m, seed)
+            self.__check_index(m, seed)
+            self.__check_indicators(m, seed)
+
+    def test_cluster_index_replaced_array(self):
+        """replacing a membership array rebuilds the index"""
+        m = memb.OrigMembership(['R1', 'R2'], ['C1', 'C2'],
+                                {'R1': [1, 5], 'R2': []}, {'C1': [3], 'C2': []},
+                                CONFIG_PARAMS)
+        self.assertEquals([0], m.row_indexes_for_cluster(1).tolist())
+        m.row_membs = np.array([[2, 0], [1, 5]], dtype='int32')
+        self.assertEquals([1], m.row_indexes_for_cluster(1).tolist())
+        self.assertEquals({'R1'}, m.rows_for_cluster(2))
+
+    def test_replace_memberships_incremental(self):
+        """replacing the slots of a few rows updates the index, replacing
+        many rows rebuilds it"""
+        row_names = ['R%d' % i for i in range(30)]
+        m = memb.OrigMembership(row_names, ['C1'],
+                                {row: [1 + i % 5, 6 + i % 7] for i, row in enumerate(row_names)},
+                                {}, CONFIG_PARAMS)
+        unchanged = m.row_indexes_for_cluster(12)
+        indicator = m.row_indicator()
+        m.replace_row_memberships(np.array([0, 1, 2]),
+                                  np.array([[1, 6], [2, 20], [0, 0]], dtype='int32'))
+        self.assertTrue(unchanged is m.row_indexes_for_cluster(12))
+        self.assertFalse(indicator is m.row_indicator())
+        self.assertEquals([1], m.row_indexes_for_cluster(20).tolist())
+        self.assertEquals([7, 12, 17, 22, 27], m.row_indexes_for_cluster(3).tolist())
+        self.__check_index(m, 0)
+        self.__check_indicators(m, 0)
+
+        m.replace_row_memberships(np.arange(10), np.full((10, 2), 43, dtype='int32'))
+        self.assertFalse(unchanged is m.row_indexes_for_cluster(12))
+        self.assertEquals(list(range(10)), m.row_indexes_for_cluster(43).tolist())
+        self.__check_index(m, 0)
+        self.__check_indicators(m, 0)
+
+    def test_indicator_cache(self):
+        """the indicators are cached until the memberships change"""
+        m = memb.OrigMembership(['R1', 'R2'], ['C1', 'C2'],
+                                {'R1': [1, 5], 'R2': []}, {'C1': [3], 'C2': []},
+                                CONFIG_PARAMS)
+        sparse = m.row_indicator()
+        dense = m.row_indicator(dense=True)
+        self.assertTrue(sparse is m.row_indicator())
+        self.assertTrue(dense is m.row_indicator(dense=True))
+        self.assertFalse(dense.flags.writeable)
+        self.assertEquals([1, 5], (sparse.indices + 1).tolist())
+
+        m.add_cluster_to_row('R2', 5)
+        self.assertFalse(sparse is m.row_indicator())
+        self.assertEquals([0, 1], np.flatnonzero(m.row_indicator(dense=True)[:, 4]).tolist())
+        col_sparse = m.col_indicator()
+        m.replace_column_memberships(np.array([1]), np.array([[2, 2, 0, 0, 0]]))
+        self.assertFalse(col_sparse is m.col_indicator())
+        self.assertEquals([[0.0, 1.0], [1.0, 0.0], [0.0, 0.0]],
+                          m.col_indicator()[:, 1:4].T.toarray().tolist())
+
+    def test_update_for_rows_equals_reference(self):
+        """the vectorized row update produces the same memberships as the
+        row-by-row reference under a fixed seed"""
+        row_names = ['R%d' % i for i in range(200)]
+        col_names = ['C%d' % i for i in range(4)]
+        for seed in range(10):
+            random = np.random.RandomState(seed)
+            params = dict(CONFIG_PARAMS)
+            params['random_seed'] = seed
+            params['memb.max_changes_per_row'] = 1 + seed % 3
+            row_members = {row: list(random.choice(43, random.randint(0, 3), replace=False) + 1)
+                           for row in row_names}
+            memberships = [memb.OrigMembership(row_names, col_names, row_members, {}, params)
+                           for _ in range(2)]
+            for iteration in range(5):
+                # rounded scores produce ties and deltas of 0
+                values = np.round(random.uniform(0, 1, (len(row_names), 43)), 1)
+                rd_scores = dm.DataMatrix(len(row_names), 43, row_names,
+                                          ['%d' % i for i in range(1, 44)], values=values)
+                memb.update_for_rows(memberships[0], rd_scores, False)
+                memb.update_for_rows_reference(memberships[1], rd_scores, False)
+                self.assertEquals(memberships[1].row_membs.tolist(),
+                                  memberships[0].row_membs.tolist(),
+                                  'seed %d, iteration %d' % (seed, iteration))
+            self.__check_index(memberships[0], seed)
+
+    def test_update_for_cols(self):
+        """a full column replaces duplicate clusters first, then the slot
+        with the largest score gain"""
+        params = dict(CONFIG_PARAMS)
+        params['memb.clusters_per_col'] = 3
+        params['memb.max_changes_per_col'] = 2
+        m = memb.OrigMembership(['R1'], ['C1', 'C2', 'C3'], {'R1': [1]},
+                                {'C1': [2, 2, 3], 'C2': [1], 'C3': [1, 2, 3]}, params)
+        values = np.zeros((3, 43))
+        values[:, 3] = [3.0, 3.0, 3.0]
+        values[:, 4] = [2.0, 2.0, 2.0]
+        values[:, 5] = [1.0, 1.0, 1.0]
+        values[2, 0:3] = [0.0, 2.5, 0.5]
+        cd_scores = dm.DataMatrix(3, 43, ['C1', 'C2', 'C3'],
+                                  ['%d' % i for i in range(1, 44)], values=values)
+        memb.update_for_cols(m, cd_scores, False)
+        self.assertEquals([[4, 5, 3], [1, 5, 6], [4, 2, 5]], m.col_membs.tolist())
+        self.assertEquals(['C1', 'C2', 'C3'], sorted(m.columns_for_cluster(5)))
+
+    def test_update_for_cols_replay(self):
+        """replaying a sequence of column score matrices produces the same
+        memberships in the vectorized and the reference update"""
+        row_names = ['R%d' % i for i in range(10)]
+        col_names = ['C%d' % i for i in range(60)]
+        for seed in range(10):
+            random = np.random.RandomState(seed)
+            params = dict(CONFIG_PARAMS)
+            params['random_seed'] = seed
+            params['memb.prob_col_change'] = [1.0, 0.5][seed % 2]
+            params['memb.max_changes_per_col'] = 1 + seed % 5
+            # columns can contain a cluster more than once
+            col_members = {col: list(random.randint(1, 8, random.randint(0, 6)))
+                           for col in col_names}
+            memberships = [memb.OrigMembership(row_names, col_names, {}, col_members, params)
+                           for _ in range(2)]
+            score_sequence = [np.round(random.uniform(0, 1, (len(col_names), 43)), 1)
+                              for _ in range(8)]
+            for iteration, values in enumerate(score_sequence):
+                cd_scores = dm.DataMatrix(len(col_names), 43, col_names,
+                                          ['%d' % i for i in range(1, 44)], values=values)
+                memb.update_for_cols(memberships[0], cd_scores, False)
+                memb.update_for_cols_reference(memberships[1], cd_scores, False)
+                self.assertEquals(memberships[1].col_membs.tolist(),
+                                  memberships[0].col_membs.tolist(),
+                                  'seed %d, iteration %d' % (seed, iteration))
+            self.__check_index(memberships[0], seed)
+
+    def test_cluster_sizes(self):
+        """members that hold a cluster in several slots are counted once"""
+        membs = np.array([[1, 3, 3], [0, 0, 2], [3, 1, 0]], dtype='int32')
+        self.assertEquals([2, 1, 2, 0], memb.cluster_sizes(membs, 4).tolist())
+
+    def test_compensate_size(self):
+        """the broadcast size compensation reproduces the per-cluster
+        scaling of the scores"""
+        random = np.random.RandomState(7)
+        row_names = ['R%d' % i for i in range(50)]
+        col_names = ['C%d' % i for i in range(30)]
+        m = memb.OrigMembership(row_names, col_names,
+                                {row: list(random.randint(1, 44, 2)) for row in row_names},
+                                {col: list(random.randint(1, 44, 5)) for col in col_names},
+                                CONFIG_PARAMS)
+        ratios = dm.DataMatrix(50, 30, row_names, col_names)
+        clusters = ['%d' % i for i in range(1, 44)]
+        rd_values = random.uniform(0, 1, (50, 43))
+        cd_values = random.uniform(0, 1, (30, 43))
+        rd_scores = dm.DataMatrix(50, 43, row_names, clusters, values=rd_values.copy())
+        cd_scores = dm.DataMatrix(30, 43, col_names, clusters, values=cd_values.copy())
+        memb.compensate_size(m, ratios, rd_scores, cd_scores)
+
+        for cluster in range(1, 44):
+            row_size = max(m.num_row_members(cluster), m.min_cluster_rows_allowed())
+            col_size = max(m.num_column_members(cluster), 30 / 10.0)
+            row_factor = math.exp(-float(row_size) / (50.0 * 2 / 43.0))
+            col_factor = math.exp(-float(col_size) / (30.0 * 5 / 43.0))
+            self.assertTrue(np.allclose(rd_values[:, cluster - 1] * row_factor,
+                                        rd_scores.values[:, cluster - 1],
+                                        rtol=1e-14, atol=0.0))
+            self.assertTrue(np.allclose(cd_values[:, cluster - 1] * col_factor,
+                                        cd_scores.values[:, cluster - 1],
+                                        rtol=1e-14, atol=0.0))
+
+    def test_adjust_cluster(self):
+        """rows below the cutoff quantile of the cluster are added in
+        decreasing score order, ties in row name order, -Inf last"""
+        row_names = ['R5', 'R1', 'R4', 'R2', 'R3', 'R6', 'R7', 'R8']
+        m = memb.OrigMembership(row_names, ['C1'],
+                                {'R7': [1], 'R8': [1]}, {}, CONFIG_PARAMS)
+        values = np.zeros((8, 43))
+        values[:, 0] = [0.5, 0.5, -np.inf, 0.7, 0.9, 2.0, 1.0, 3.0]
+        rowscores = dm.DataMatrix(8, 43, row_names, ['%d' % i for i in range(1, 44)],
+                                  values=values)
+        result = memb.adjust_cluster(m, 1, rowscores, 0.33, 100)
+        self.assertEquals(['R3', 'R2', 'R1', 'R5', 'R4'], list(result.keys()))
+        self.assertEquals({1}, set(result.values()))
+        self.assertEquals({}, memb.adjust_cluster(m, 1, rowscores, 0.33, 4))
+        self.assertEquals({}, memb.adjust_cluster(m, 2, rowscores, 0.33, 100))
+
+        memb.postadjust(m, rowscores)
+        self.assertEquals({'R1', 'R2', 'R3', 'R4', 'R5', 'R7', 'R8'}, m.rows_for_cluster(1))
+
+    def __make_blobs(self, seed):
+        """60 rows around 4 well separated centers, 15 rows per center"""
+        random = np.random.RandomState(seed)
+        centers = random.uniform(-10.0, 10.0, (4, 5)) * 5
+        truth = np.repeat(np.arange(4), 15)
+        return centers[truth] + random.normal(0.0, 0.1, (60, 5)), truth
+
+    def test_kmeans(self):
+        """the clusters of well separated blobs are found and the result
+        only depends on the random seed"""
+        values, truth = self.__make_blobs(3)
+        clusters = stats.kmeans(values, 4, num_starts=4, random_seed=42)
+        # the same partition, up to the cluster numbers
+        pairs = set(zip(truth.tolist(), clusters.tolist()))
+        self.assertEquals(4, len(pairs))
+        self.assertEquals(4, len({cluster for _, cluster in pairs}))
+        self.assertEquals(clusters.tolist(),
+                          stats.kmeans(values, 4, num_starts=4, random_seed=42).tolist())
+
+    def test_kmeans_multiprocessing(self):
+        """the starts give the same result on the worker pool"""
+        values = np.random.RandomState(5).normal(size=(200, 6))
+        serial = stats.kmeans(values, 12, num_starts=3, random_seed=7)
+        pooled = stats.kmeans(values, 12, num_starts=3, random_seed=7,
+                              config_params={'multiprocessing': True, 'num_cores': 2})
+        self.assertEquals(serial.tolist(), pooled.tolist())
+        self.assertEquals(12, len(set(serial.tolist())))
+
+    def test_kmeans_row_seeder(self):
+        """the numpy seeder fills the first slot with 1-based clusters"""
+        values, _ = self.__make_blobs(4)
+        values[3, 2] = np.nan
+        matrix = dm.DataMatrix(60, 5, ['R%d' % i for i in range(60)],
+                               ['C%d' % i for i in range(5)], values=values)
+        row_membership = [[0, 0] for _ in range(60)]
+        memb.make_kmeans_row_seeder(4, {'random_seed': 42})(row_membership, matrix)
+        self.assertEquals({1, 2, 3, 4}, {slots[0] for slots in row_membership})
+        self.assertEquals({0}, {slots[1] for slots in row_membership})
+
 if __name__ == '__main__':
     SUITE = []
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(OrigMembershipTest))
@@ -9,6 +9,8 @@ import xmlrunner
 import orig_membership_test as omembtest
 import datamatrix_test as dmtest
 import util_test as ut
+import stats_test as stt_test
+import cluster_stats_test as cst
 import organism_test as ot
 import seqtools_test as stt
 import thesaurus_test as tht
@@ -31,12 +33,19 @@ if __name__ == '__main__':
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.NoChangeFilterTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.CenterScaleFilterTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.QuantileNormalizeTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(dmtest.ScoreArenaTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.DelimitedFileTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.UtilsTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.LevenshteinDistanceTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.BestMatchingLinksTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.Order2StringTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ut.RVecTest))
+
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(stt_test.NumpyStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(stt_test.KMeansPoolTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(cst.ClusterStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(cst.TrimMeanTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ot.MicrobeTest))
 
@@ -58,6 +67,7 @@ if __name__ == '__main__':
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(pt.PssmTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ct.CombinerTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ct.CombineRecordedTest))
 
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(rwt.ReadWeeTest))
     SUITE.append(unittest.TestLoader().loadTestsFromTestCase(se_test.DiscreteEnrichmentSetTest))
@@ -0,0 +1,66 @@
+"""startup_test.py - import time budget of the cmonkey2 entry point
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import unittest
+import os
+import subprocess
+import sys
+
+# the modules that bin/cmonkey2 imports before the configuration is read
+ENTRY_MODULES = ['cmonkey.cmonkey_run', 'cmonkey.config', 'cmonkey.meme_suite',
+                 'cmonkey.scoring']
+
+# optional or rarely used packages, they are imported where they are used
+DEFERRED_MODULES = ['rpy2', 'bs4', 'lxml', 'Bio', 'scipy.stats']
+
+# the cumulative import time of the entry modules in seconds, about twice
+# the time on a development machine
+IMPORT_TIME_BUDGET = 2.0
+NUM_RUNS = 3
+
+
+def import_times(modules):
+    """imports modules in a fresh interpreter with -X importtime and returns
+    the cumulative import times in seconds by module name and the total
+    time of the cmonkey modules that were imported at the top level"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.getcwd()] + [path for path in
+                                        env.get('PYTHONPATH', '').split(os.pathsep) if path])
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % ', '.join(modules)],
+        stderr=subprocess.STDOUT, env=env).decode('utf-8')
+    result = {}
+    total = 0.0
+    for line in output.split('\n'):
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                result[name.strip()] = int(cumulative) / 1.0e6
+                # nested imports are indented and part of their parent's time
+                if name.startswith(' cmonkey'):
+                    total += result[name.strip()]
+    return result, total
+
+
+class StartupTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the cold start of cmonkey2"""
+
+    def test_deferred_imports(self):
+        """the entry modules do not import the deferred packages"""
+        times, _ = import_times(ENTRY_MODULES)
+        for module in DEFERRED_MODULES:
+            self.assertFalse(module in times, "'%s' is imported at startup" % module)
+
+    def test_import_time_budget(self):
+        """the fastest of a few imports of the entry modules is within budget"""
+        elapsed = min(import_times(ENTRY_MODULES)[1] for _ in range(NUM_RUNS))
+        self.assertTrue(elapsed < IMPORT_TIME_BUDGET,
+                        "import took %.2f s, the budget is %.2f s" % (elapsed, IMPORT_TIME_BUDGET))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(StartupTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,148 @@
+"""stats_test.py - test classes for stats module
+
+The expected values were recorded with R, so every backend is tested
+against the same inputs and results.
+
+This file is part of cMonkey Python. Please see README and LICENSE for
+more information and licensing details.
+"""
+import unittest
+import numpy as np
+import cmonkey.stats as stats
+import cmonkey.util as util
+
+
+class NumpyStatsTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the statistical primitives of the NumPy backend"""
+    BACKEND = 'numpy'
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        self.previous_backend = stats.backend()
+        stats.set_backend(self.BACKEND)
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        stats.set_backend(self.previous_backend)
+
+    def test_density(self):
+        """R's density() interpolated at kvalues"""
+        kvalues = [3.4268700450682301, 3.3655160468930152, -8.0654569044842539,
+                   2.0762815314005487, 4.8537715329554203, 1.2374476248622075]
+        cluster_values = [-3.5923001345962162, 0.77069901513184735,
+                           -4.942909785931378, -3.1580950032999096]
+        bandwidth = 2.69474878768
+        dmin = -13.8848342423
+        dmax = 12.6744452247
+        result = stats.density(kvalues, cluster_values, bandwidth, dmin, dmax)
+        self.assertAlmostEquals(0.08663036966690765, result[0])
+        self.assertAlmostEquals(0.08809242907902183, result[1])
+        self.assertAlmostEquals(0.49712338305039777, result[2])
+        self.assertAlmostEquals(0.12248549621579163, result[3])
+        self.assertAlmostEquals(0.05708884005243133, result[4])
+        self.assertAlmostEquals(0.14857948193544993, result[5])
+
+    def test_sd_rnorm(self):
+        """the right number of values with roughly the right deviation"""
+        stats.set_seed(42)
+        result = stats.sd_rnorm([1.3, 1.6, 1.2, 1.05], 9, 0.748951)
+        self.assertEquals(9, len(result))
+        result = stats.sd_rnorm([1.0, 3.0, np.nan, 5.0], 20000, 0.5)
+        self.assertAlmostEquals(1.0, np.std(result), places=1)
+
+    def test_set_seed(self):
+        """the same seed gives the same random numbers"""
+        stats.set_seed(13)
+        first = stats.runif(5)
+        stats.set_seed(13)
+        self.assertEquals(first.tolist(), stats.runif(5).tolist())
+        self.assertTrue(np.all((first >= 0.0) & (first < 1.0)))
+
+    def test_phyper(self):
+        """phyper(c(1, 0, 3), c(10, 5, 4), c(20, 5, 6), c(5, 3, 7),
+        lower.tail=F) and lower.tail=T"""
+        result = stats.phyper([1, 0, 3], [10, 5, 4], [20, 5, 6], [5, 3, 7])
+        self.assertAlmostEquals(0.5512188960, result[0])
+        self.assertAlmostEquals(0.9166666667, result[1])
+        self.assertAlmostEquals(0.1666666667, result[2])
+        result = stats.phyper([1], [10], [20], [5], lower_tail=True)
+        self.assertAlmostEquals(0.4487811040, result[0])
+
+    def test_mad(self):
+        """mad(c(1, 2, 3, 4, 100)), mad(c(1, 2, 4, 8)) and mad() with NA"""
+        self.assertAlmostEquals(1.4826, stats.mad([1.0, 2.0, 3.0, 4.0, 100.0]))
+        self.assertAlmostEquals(2.2239, stats.mad([1.0, 2.0, 4.0, 8.0]))
+        self.assertTrue(np.isnan(stats.mad([1.0, np.nan, 3.0])))
+
+    def test_rrank(self):
+        """rank(c(3, 1, 3, NA, 2, 1), ties='min', na='keep')"""
+        result = stats.rrank([3.0, 1.0, 3.0, np.nan, 2.0, 1.0])
+        self.assertEquals([4.0, 1.0, 4.0], result[:3].tolist())
+        self.assertTrue(np.isnan(result[3]))
+        self.assertEquals([3.0, 1.0], result[4:].tolist())
+
+    def test_rrank_matrix(self):
+        """the 0-based ranks of a matrix in row-major order"""
+        result = stats.rrank_matrix(np.array([[0.5, 0.1], [0.5, 0.9], [0.2, 0.3]]))
+        self.assertEquals([3, 0, 3, 5, 1, 2], result.tolist())
+
+    def test_rorder(self):
+        """order(c(0.2, 0.9, 0.5, 0.9, 0.1), decreasing=T)[1:3]"""
+        result = stats.rorder([0.2, 0.9, 0.5, 0.9, 0.1], 3)
+        self.assertEquals([2, 4, 3], list(result))
+
+    def test_kmeans(self):
+        """two well separated groups of rows are found"""
+        values = np.array([[0.0, 0.1], [0.1, 0.0], [0.05, 0.05],
+                           [10.0, 10.1], [10.1, 10.0], [10.05, 10.05]])
+        stats.set_seed(17)
+        clusters = stats.kmeans(values, 2, random_seed=17)
+        self.assertEquals(1, len(set(clusters[:3].tolist())))
+        self.assertEquals(1, len(set(clusters[3:].tolist())))
+        self.assertEquals([0, 1], sorted(set(clusters.tolist())))
+
+    def test_set_backend(self):
+        """unknown backends are rejected"""
+        self.assertRaises(ValueError, stats.set_backend, 'matlab')
+        self.assertEquals(self.BACKEND, stats.backend())
+
+
+class RStatsTest(NumpyStatsTest):  # pylint: disable-msg=R0904
+    """Runs the same tests with the R backend, this needs R and rpy2"""
+    BACKEND = 'r'
+
+
+class KMeansPoolTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the k-means starts with multiprocessing"""
+
+    def setUp(self):  # pylint; disable-msg=C0103
+        self.previous_backend = stats.backend()
+        stats.set_backend('numpy')
+        self.values = np.random.RandomState(5).normal(size=(60, 4))
+
+    def tearDown(self):  # pylint; disable-msg=C0103
+        stats.set_backend(self.previous_backend)
+
+    def test_kmeans_run_pool(self):
+        """the starts give the same clusters on the run pool, and in this
+        process if there is no run pool"""
+        config_params = {'multiprocessing': True, 'num_cores': 2}
+        expected = stats.kmeans(self.values, 5, num_starts=4, random_seed=3)
+        self.assertEquals(expected.tolist(),
+                          stats.kmeans(self.values, 5, num_starts=4, random_seed=3,
+                                       config_params=config_params).tolist())
+        pool = util.WorkerPool(2)
+        util.set_run_pool(pool)
+        try:
+            self.assertEquals(expected.tolist(),
+                              stats.kmeans(self.values, 5, num_starts=4, random_seed=3,
+                                           config_params=config_params).tolist())
+        finally:
+            util.set_run_pool(None)
+            pool.close()
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(NumpyStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(RStatsTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(KMeansPoolTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
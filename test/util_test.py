@@ -4,7 +4,13 @@ This file is part of cMonkey Python. Please see README and LICENSE for
 more information and licensing details.
 """
 import unittest
+import os
+import shutil
+import tempfile
+import configparser
 import cmonkey.util as util
+import cmonkey.datamatrix as dm
+import cmonkey.stats as stats
 import operator
 import numpy as np
 
@@ -218,27 +224,114 @@ class UtilsTest(unittest.TestCase):  # pylint: disable-msg=R0904
         result = util.median(array)
         self.assertAlmostEqual(2.0, result)
 
-    def test_density(self):
+    def test_rank_min(self):
+        """rank_min() behaves like R's rank(ties='min', na='keep')"""
+        result = util.rank_min([3.0, 1.0, 3.0, np.nan, 2.0, 1.0])
+        self.assertEquals([4.0, 1.0, 4.0, 3.0, 1.0],
+                          result[[0, 1, 2, 4, 5]].tolist())
+        self.assertTrue(np.isnan(result[3]))
+
+    def test_rank_matrix_heavy_ties(self):
+        """ranks of a mostly zero-filled matrix (like network scores)
+        compared against the definition of the minimum rank: 1 + the
+        number of smaller values"""
+        values = np.zeros((300, 43))
+        rand = np.random.RandomState(5)
+        nonzero = rand.rand(300, 43) < 0.1
+        values[nonzero] = -rand.randint(1, 20, size=np.count_nonzero(nonzero)) / 10.0
+        ranks = util.rank_matrix(values)
+        flat = values.ravel()
+        expected = np.array([np.count_nonzero(flat < value) for value in flat])
+        self.assertEquals(np.int32, ranks.dtype)
+        self.assertTrue((expected == ranks).all())
+        self.assertEquals(np.count_nonzero(flat < 0), ranks[flat == 0][0])
+        self.assertEquals(0, util.rank_matrix(np.zeros((5, 5))).max())
+
+    def test_rank_matrix_row_major(self):
+        """ranks are returned in row-major order like from rrank_matrix()"""
+        ranks = util.rank_matrix(np.array([[4.0, 1.0], [1.0, np.nan], [2.0, 4.0]]))
+        self.assertEquals([3, 0, 0, -1, 2, 3], ranks.tolist())
+
+    def test_order_rows(self):
+        """order_rows() keeps ties in their original order like R's order()"""
+        matrix = np.array([[0.1, 0.5, 0.5, 0.2, 0.5],
+                           [0.3, 0.3, 0.3, 0.3, 0.3],
+                           [1.0, 2.0, 3.0, 4.0, 5.0],
+                           [2.0, 1.0, 2.0, 1.0, 2.0]])
+        result = util.order_rows(matrix, 2)
+        self.assertEquals(result.dtype.kind, 'i')
+        self.assertEquals([[2, 3], [1, 2], [5, 4], [1, 3]], result.tolist())
+        self.assertEquals([[2, 3, 5, 4, 1], [1, 2, 3, 4, 5], [5, 4, 3, 2, 1],
+                           [1, 3, 5, 2, 4]],
+                          util.order_rows(matrix, 7).tolist())
+
+    def test_order_rows_nans(self):
+        """NaN values are ordered last, after -Inf"""
+        matrix = np.array([[np.nan, 0.5, -np.inf, 0.5],
+                           [1.0, np.nan, np.nan, 2.0]])
+        self.assertEquals([[2, 4, 3], [4, 1, 2]], util.order_rows(matrix, 3).tolist())
+
+    def test_order_rows_neginf(self):
+        """-Inf values are ordered by column like other ties"""
+        matrix = np.array([[-np.inf, 0.5, -np.inf, 0.25],
+                           [-np.inf, -np.inf, -np.inf, 2.0]])
+        self.assertEquals([[2, 4, 1], [4, 1, 2]], util.order_rows(matrix, 3).tolist())
+
+    def test_order_rows_random_ties(self):
+        """compare against a stable decreasing sort on data with many ties"""
+        matrix = np.random.RandomState(3).randint(0, 5, size=(200, 43)).astype(np.float64)
+        for size in [1, 2, 4, 5, 29, 43]:
+            result = util.order_rows(matrix, size)
+            for row in range(matrix.shape[0]):
+                expected = sorted(range(43), key=lambda i: -matrix[row, i])[:size]
+                self.assertEquals([i + 1 for i in expected], result[row].tolist())
+
+    def test_kde_density(self):
+        """the NumPy density estimation reproduces the recorded R results
+        from test_density()"""
         kvalues = [3.4268700450682301, 3.3655160468930152, -8.0654569044842539,
                    2.0762815314005487, 4.8537715329554203, 1.2374476248622075]
         cluster_values = [-3.5923001345962162, 0.77069901513184735,
                            -4.942909785931378, -3.1580950032999096]
-        bandwidth = 2.69474878768
-        dmin = -13.8848342423
-        dmax = 12.6744452247
-        result = util.density(kvalues, cluster_values, bandwidth, dmin, dmax)
-        self.assertAlmostEquals(0.08663036966690765, result[0])
-        self.assertAlmostEquals(0.08809242907902183, result[1])
-        self.assertAlmostEquals(0.49712338305039777, result[2])
-        self.assertAlmostEquals(0.12248549621579163, result[3])
-        self.assertAlmostEquals(0.05708884005243133, result[4])
-        self.assertAlmostEquals(0.14857948193544993, result[5])
-
-    def test_sd_rnorm(self):
-        result = util.sd_rnorm([1.3, 1.6, 1.2, 1.05], 9, 0.748951)
-        # the results are fairly random, make sure we have the right
-        # number of values
-        self.assertEquals(9, len(result))
+        result = util.kde_density(np.array([kvalues]).T, np.array([cluster_values]).T,
+                                  np.ones((4, 1), dtype=bool), [2.69474878768],
+                                  [-13.8848342423], [12.6744452247])
+        self.assertEquals((6, 1), result.shape)
+        self.assertAlmostEquals(0.08663036966690765, result[0, 0], places=12)
+        self.assertAlmostEquals(0.08809242907902183, result[1, 0], places=12)
+        self.assertAlmostEquals(0.49712338305039777, result[2, 0], places=12)
+        self.assertAlmostEquals(0.12248549621579163, result[3, 0], places=12)
+        self.assertAlmostEquals(0.05708884005243133, result[4, 0], places=12)
+        self.assertAlmostEquals(0.14857948193544993, result[5, 0], places=12)
+
+    def test_kde_density_batched(self):
+        """computing several clusters in one call gives the same result as
+        computing them one by one"""
+        values = np.random.RandomState(7).normal(size=(40, 3))
+        values[3, 1] = np.nan
+        mask = np.zeros((40, 3), dtype=bool)
+        mask[:10, 0] = True
+        mask[5:30, 1] = True
+        mask[20:, 2] = True
+        bandwidths = np.array([0.1, 0.5, 0.05])
+        dmin = np.nanmin(values, axis=0) - 1
+        dmax = np.nanmax(values, axis=0) + 1
+        result = util.kde_density(values, values, mask, bandwidths, dmin, dmax)
+        for cluster in range(3):
+            single = util.kde_density(values[:, cluster:cluster + 1],
+                                      values[:, cluster:cluster + 1],
+                                      mask[:, cluster:cluster + 1],
+                                      bandwidths[cluster:cluster + 1],
+                                      dmin[cluster:cluster + 1], dmax[cluster:cluster + 1])
+            self.assertTrue(np.allclose(single[:, 0], result[:, cluster],
+                                        rtol=0, atol=1e-15, equal_nan=True))
+        self.assertTrue(np.isnan(result[3, 1]))
+        self.assertAlmostEquals(1.0, np.nansum(result[:, 1]))
+
+    def test_bw_nrd0(self):
+        """tests the bandwidth rule against R's bw.nrd0(1:10)"""
+        self.assertAlmostEquals(1.719286, util.bw_nrd0(np.arange(1, 11)), places=6)
+        self.assertAlmostEquals(0.9 * 5 * 2 ** -0.2, util.bw_nrd0([5.0, 5.0]))
 
     def test_max_row_var(self):
         """tests maximum row variance function"""
@@ -281,6 +374,17 @@ class UtilsTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertTrue(1 in multiple)
         self.assertTrue(2 in multiple)
 
+    def test_read_url_cached_failed(self):
+        """a failed download does not leave a cache file"""
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(cache_dir, 'missing.html')
+            self.assertRaises(Exception, util.read_url_cached,
+                              'file://' + os.path.join(cache_dir, 'missing'), cache_file)
+            self.assertFalse(os.path.exists(cache_file))
+        finally:
+            shutil.rmtree(cache_dir)
+
 
 class Order2StringTest(unittest.TestCase):  # pylint: disable-msg=R09042
     """Test class for order2string"""
@@ -295,3 +399,156 @@ class Order2StringTest(unittest.TestCase):  # pylint: disable-msg=R09042
         self.assertEquals("21st", util.order2string(21))
         self.assertEquals("22nd", util.order2string(22))
         self.assertEquals("23rd", util.order2string(23))
+
+
+def scaled_by_state(value):
+    """reads the factor from the worker state, used by WorkerPoolTest"""
+    state = util.worker_state()
+    return value * state['factor'] + state['offset']
+
+
+def shared_row_sum(row):
+    """sums a row of the shared matrix in the worker state"""
+    return util.worker_state()['matrix'].values[row].sum()
+
+
+def worker_stats_backend(_):
+    """the stats backend of the worker, used by WorkerPoolTest"""
+    return stats.backend()
+
+
+def abort_barrier(_):
+    """breaks the broadcast barrier, used by WorkerPoolTest"""
+    util.WORKER_BARRIER.abort()
+
+
+class WorkerPoolTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for WorkerPool and pool_map"""
+
+    def test_broadcast(self):
+        """every worker sees the broadcast state, also after it changed"""
+        pool = util.WorkerPool(3, state={'offset': 1})
+        try:
+            pool.broadcast({'factor': 2})
+            self.assertEquals([1, 3, 5, 7, 9, 11], pool.map(scaled_by_state, range(6)))
+            pool.broadcast({'factor': 10}, readonly={'offset': 5})
+            self.assertEquals([5, 15, 25, 35, 45, 55], pool.map(scaled_by_state, range(6)))
+        finally:
+            pool.close()
+
+    def test_broadcast_broken_barrier(self):
+        """a broken barrier fails the broadcast instead of hanging"""
+        pool = util.WorkerPool(2)
+        try:
+            pool.map(abort_barrier, [0])
+            self.assertRaises(Exception, pool.broadcast, {'factor': 2})
+        finally:
+            pool.close()
+
+    def test_pool_map_run_pool(self):
+        """pool_map() uses the registered run pool"""
+        pool = util.WorkerPool(2)
+        util.set_run_pool(pool)
+        try:
+            result = util.pool_map({'multiprocessing': True}, scaled_by_state, range(4),
+                                   state={'factor': 3}, readonly={'offset': 0})
+            self.assertEquals([0, 3, 6, 9], result)
+        finally:
+            util.set_run_pool(None)
+            pool.close()
+
+    def test_pool_map_single(self):
+        """pool_map() without multiprocessing restores the previous state"""
+        result = util.pool_map({'multiprocessing': False}, scaled_by_state, range(4),
+                               state={'factor': 3}, readonly={'offset': 1})
+        self.assertEquals([1, 4, 7, 10], result)
+        self.assertEquals({}, util.worker_state())
+
+    def test_stats_backend(self):
+        """spawned workers use the stats backend of the parent"""
+        stats.set_backend('r')
+        try:
+            pool = util.WorkerPool(2, start_method='spawn')
+        finally:
+            stats.set_backend(stats.DEFAULT_BACKEND)
+        try:
+            self.assertEquals(['r', 'r'], pool.map(worker_stats_backend, range(2)))
+        finally:
+            pool.close()
+
+    def test_shared_array_spawn(self):
+        """spawned workers map the shared block instead of a copy"""
+        matrix = dm.DataMatrix(4, 3, values=np.arange(12.0).reshape(4, 3))
+        matrix.share_values()
+        pool = util.WorkerPool(2, start_method='spawn')
+        try:
+            pool.broadcast(readonly={'matrix': matrix})
+            self.assertEquals([3.0, 12.0, 21.0, 30.0], pool.map(shared_row_sum, range(4)))
+            matrix.values[0] = 10.0
+            self.assertEquals([30.0, 12.0, 21.0, 30.0], pool.map(shared_row_sum, range(4)))
+        finally:
+            pool.close()
+            util.release_shared()
+
+
+class RVecTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the R vector expressions of the scaling schedules"""
+
+    def test_default_config(self):
+        """every R vector expression in the default configuration, the
+        expected values are R's"""
+        expected = {
+            'seq(1e-5, 0.5, length=num_iterations*3/4)': (1500, 1e-5, 3.435490326884589e-4, 0.5),
+            'c(rep(1e-5, 100), seq(1e-5, 1, length=num_iterations*3/4))': (1600, 1e-5, 1e-5, 1.0),
+            'c(rep(1, num_iterations/3), rep(2, num_iterations/3))': (1332, 1.0, 1.0, 2.0)
+        }
+        config = configparser.ConfigParser()
+        config.read('cmonkey/default_config/default.ini')
+        rvecs = [config.get(section, option) for section in config.sections()
+                 for option in config.options(section) if option.endswith('_rvec')]
+        self.assertEquals(4, len(rvecs))
+        for rvec in rvecs:
+            length, first, second, last = expected[rvec]
+            result = util.parse_rvec(rvec, 2000)
+            self.assertEquals(length, len(result))
+            self.assertAlmostEquals(first, result[0])
+            self.assertAlmostEquals(second, result[1])
+            self.assertAlmostEquals(last, result[-1])
+        self.assertEquals(2.0, util.parse_rvec(rvecs[-1], 2000)[666])
+        self.assertAlmostEquals(1e-5, util.parse_rvec(rvecs[1], 2000)[100])
+
+    def test_seq(self):
+        """seq() with length.out, by and without both"""
+        self.assertEquals([0.0, 0.5, 1.0], util.parse_rvec('seq(0, 1, length=2.5)').tolist())
+        self.assertEquals([2.0, 3.0, 4.0], util.parse_rvec('seq(2, length.out=3)').tolist())
+        self.assertEquals([1.0, 1.25, 1.5, 1.75, 2.0],
+                          util.parse_rvec('seq(1, 2, by=0.25)').tolist())
+        self.assertEquals([3.0, 2.0, 1.0], util.parse_rvec('seq(3, 1)').tolist())
+        self.assertEquals([1.0, 2.0, 3.0], util.parse_rvec('seq(3)').tolist())
+
+    def test_rep_and_arithmetic(self):
+        """rep() with times and each, the operators and num_iterations"""
+        self.assertEquals([1.0, 1.0, 2.0, 2.0, 1.0, 1.0, 2.0, 2.0],
+                          util.parse_rvec('rep(c(1, 2), times=2, each=2)').tolist())
+        self.assertEquals([1.0, 2.0, 2.0], util.parse_rvec('rep(c(1, 2), c(1, 2))').tolist())
+        self.assertEquals([1.0, 1.0, 1.0], util.parse_rvec('rep(1, num_iterations/3)', 10).tolist())
+        self.assertEquals([-2.0, 8.0], util.parse_rvec('c(-2, 2^3)').tolist())
+
+    def test_power_precedence(self):
+        """^ binds like in R, tighter than the other operators and the
+        unary minus, and right to left"""
+        for rvec, expected in [('2*3^2', 18.0), ('1+2^2', 5.0), ('-2^2', -4.0),
+                               ('2^3^2', 512.0), ('2^-1', 0.5), ('(1+2)^2', 9.0)]:
+            self.assertEquals([expected], util.parse_rvec(rvec).tolist())
+
+    def test_invalid(self):
+        """expressions that are not supported or empty are rejected"""
+        for rvec in ['seq(1, 2', '1:10', 'exp(1)', 'x + 1', 'seq(1, 2, by=-1)',
+                     'rep(1, 0)', 'c(1, 2) + c(1, 2, 3)', 'seq(1, 2, step=1)',
+                     'seq(1, 2, length=num_iterations)', "c(1, 'a')", 'c(TRUE)']:
+            self.assertRaises(ValueError, util.parse_rvec, rvec)
+
+    def test_get_rvec_fun(self):
+        """the last value is used after the end of the schedule"""
+        scaling = util.get_rvec_fun('seq(0, 1, length=num_iterations*3/4)', 4)
+        self.assertEquals([0.0, 0.5, 1.0, 1.0, 1.0], [scaling(i) for i in range(1, 6)])